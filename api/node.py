@@ -1,8 +1,14 @@
+import hashlib
+import json
+import time
+from typing import Dict, Tuple
+
 from flask import Blueprint
-from flask import request, jsonify
+from flask import Response as HttpResponse
+from flask import current_app, request, jsonify, stream_with_context
 from middleware.auth import require_jwt
 from service import node as node_service
-from model import Response, ResponseMessage, ResponseStatus, ResponseCode, Node
+from model import Response, ResponseMessage, ResponseStatus, ResponseCode, Node, to_plain
 
 
 node = Blueprint('node', __name__)
@@ -25,14 +31,30 @@ def register_node():
 
 
 
-@node.route('/node/update/<node_id>', methods=['PUT'])
+def _expected_revision(data):
+    """CAS 条件：If-Match 头（可带引号 / W/ 前缀）优先，其次请求体 revision；都没有则不比较。"""
+    raw = request.headers.get('If-Match')
+    if raw is not None:
+        raw = raw.strip()
+        if raw.startswith('W/'):
+            raw = raw[2:]
+        raw = raw.strip('"')
+    else:
+        raw = data.pop('revision', None)
+    if raw is None or raw == '' or raw == '*':
+        return None
+    return int(raw)
+
+
+@node.route('/node/update/<node_id>', methods=['PUT', 'PATCH'])
 @require_jwt
 def update_node(node_id):
     try:
-        data = request.json or {}
+        data = dict(request.json or {})
         trace_id = request.headers.get('X-Trace-ID')
-        merged = {**data, 'node_id': node_id}
-        response = node_service.update_node(Node.from_dict(merged), trace_id)
+        data.pop('node_id', None)
+        expected = _expected_revision(data)
+        response = node_service.update_node(node_id, data, trace_id, expected)
         return jsonify(response.to_dict())
     except Exception as e:
         return jsonify(
@@ -43,6 +65,63 @@ def update_node(node_id):
                      trace_id=request.headers.get('X-Trace-ID')).to_dict())
 
 
+# 批量接口按 JSONL 解析的请求类型
+_JSONL_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+def _bulk_items():
+    """批量请求体：JSON 数组、{"items": [...]}，或 JSONL（每行一个 JSON，解析失败的行记为 null）。"""
+    raw = request.get_data(as_text=True)
+    if request.mimetype in _JSONL_TYPES:
+        items = []
+        for line in raw.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    data = json.loads(raw) if raw.strip() else []
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('expected a JSON array, {"items": [...]} or JSONL')
+    return data
+
+
+def _bulk_response(write):
+    try:
+        trace_id = request.headers.get('X-Trace-ID')
+        response = write(_bulk_items(), trace_id)
+        return jsonify(response.to_dict())
+    except Exception as e:
+        return jsonify(
+            Response(message=ResponseMessage.ERROR, 
+                     status=ResponseStatus.ERROR, 
+                     code=ResponseCode.ERROR, 
+                     error=str(e), 
+                     trace_id=request.headers.get('X-Trace-ID')).to_dict())
+
+
+@node.route('/node/bulk/register', methods=['POST'])
+@require_jwt
+def register_nodes():
+    return _bulk_response(node_service.register_nodes)
+
+
+@node.route('/node/bulk/update', methods=['POST', 'PUT', 'PATCH'])
+@require_jwt
+def update_nodes():
+    return _bulk_response(node_service.update_nodes)
+
+
+@node.route('/node/bulk/delete', methods=['POST', 'DELETE'])
+@require_jwt
+def delete_nodes():
+    return _bulk_response(node_service.delete_nodes)
+
+
 @node.route('/node/delete/<node_id>', methods=['DELETE'])
 @require_jwt
 def delete_node(node_id):
@@ -75,13 +154,120 @@ def get_node_status(node_id):
                      trace_id=request.headers.get('X-Trace-ID')).to_dict())
 
 
+# 节点 JSON 片段缓存：node_id -> (Node 对象, 片段, 片段摘要)；快照中节点变化时是新对象，按身份判断是否失效
+_node_json: Dict[str, Tuple[Node, str, bytes]] = {}
+_DATA_SLOT = "__nvllm_data__"
+# SSE 保活注释间隔
+_SSE_KEEPALIVE_SEC = 15.0
+
+
+def _node_fragment(n: Node) -> Tuple[str, bytes]:
+    cached = _node_json.get(n.node_id)
+    if cached is not None and cached[0] is n:
+        return cached[1], cached[2]
+    fragment = current_app.json.dumps(to_plain(n))
+    digest = hashlib.blake2b(fragment.encode('utf-8'), digest_size=16).digest()
+    _node_json[n.node_id] = (n, fragment, digest)
+    return fragment, digest
+
+
+def _page_etag(total: int, digests) -> str:
+    # 只由返回内容决定（筛选后总数 + 各节点片段），与网关进程、请求参数无关：多网关对相同内容给出相同 ETag
+    h = hashlib.blake2b(str(total).encode('ascii'), digest_size=16)
+    for digest in digests:
+        h.update(digest)
+    return h.hexdigest()
+
+
+def _prune_fragments(snap) -> None:
+    if len(_node_json) <= 2 * len(snap.nodes) + 64:
+        return
+    live = {n.node_id for n in snap.nodes}
+    for node_id in [k for k in _node_json if k not in live]:
+        _node_json.pop(node_id, None)
+
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    return default if value in (None, '') else int(value)
+
+
 @node.route('/node/all', methods=['GET'])
 @require_jwt
 def get_all_nodes():
     try:
         trace_id = request.headers.get('X-Trace-ID')
-        response = node_service.get_all_nodes(trace_id)
-        return jsonify(response.to_dict())
+        snap, total, page = node_service.list_nodes(
+            model=request.args.get('model'),
+            status=request.args.get('status'),
+            offset=_int_arg('offset', 0),
+            limit=_int_arg('limit'))
+        fragments = [_node_fragment(n) for n in page]
+        etag = _page_etag(total, (digest for _, digest in fragments))
+        headers = {
+            'ETag': '"%s"' % etag,
+            'Cache-Control': 'no-cache',
+            'X-Catalog-Version': str(snap.version),
+            'X-Total-Count': str(total),
+        }
+        if request.if_none_match.contains_weak(etag):
+            return HttpResponse(status=304, headers=headers)
+        # 信封照常序列化，data 处拼接按节点缓存的 JSON 片段，未变化的节点不再重复编码
+        envelope = Response(message=ResponseMessage.SUCCESS,
+                            status=ResponseStatus.SUCCESS,
+                            code=ResponseCode.SUCCESS,
+                            data=_DATA_SLOT,
+                            trace_id=trace_id).to_dict()
+        body = current_app.json.dumps(envelope).replace(
+            json.dumps(_DATA_SLOT), '[' + ','.join(f for f, _ in fragments) + ']', 1)
+        _prune_fragments(snap)
+        return HttpResponse(body, mimetype='application/json', headers=headers)
+    except Exception as e:
+        return jsonify(
+            Response(message=ResponseMessage.ERROR, 
+                     status=ResponseStatus.ERROR, 
+                     code=ResponseCode.ERROR, 
+                     error=str(e), 
+                     trace_id=request.headers.get('X-Trace-ID')).to_dict())
+
+
+def _watch_stream(since, timeout):
+    """SSE：每次目录变化推送一条 catalog 事件（id 为版本号），空闲时发送保活注释。"""
+    deadline = time.monotonic() + node_service.WATCH_STREAM_MAX_SEC
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        delta = node_service.watch_catalog(since, min(timeout, remaining))
+        if since is None or delta['reset'] or delta['upserts'] or delta['deletes']:
+            since = delta['version']
+            yield 'id: %d\nevent: catalog\ndata: %s\n\n' % (
+                since, current_app.json.dumps(delta))
+        else:
+            yield ': keepalive\n\n'
+
+
+@node.route('/node/watch', methods=['GET'])
+@require_jwt
+def watch_nodes():
+    try:
+        trace_id = request.headers.get('X-Trace-ID')
+        since = request.args.get('since') or request.headers.get('Last-Event-ID')
+        since = int(since) if since not in (None, '') else None
+        timeout = float(request.args.get('timeout', node_service.WATCH_TIMEOUT_SEC))
+        best = request.accept_mimetypes.best_match(['application/json', 'text/event-stream'])
+        if best == 'text/event-stream':
+            return HttpResponse(
+                stream_with_context(_watch_stream(since, min(timeout, _SSE_KEEPALIVE_SEC))),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        delta = node_service.watch_catalog(since, timeout)
+        return jsonify(
+            Response(message=ResponseMessage.SUCCESS,
+                     status=ResponseStatus.SUCCESS,
+                     code=ResponseCode.SUCCESS,
+                     data=delta,
+                     trace_id=trace_id).to_dict())
     except Exception as e:
         return jsonify(
             Response(message=ResponseMessage.ERROR, 
@@ -107,3 +293,21 @@ def get_node(node_id):
                 trace_id=request.headers.get('X-Trace-ID')).to_dict()
             )
     
+
+
+@node.route('/gateway/stats', methods=['GET'])
+@require_jwt
+def get_gateway_stats():
+    try:
+        trace_id = request.headers.get('X-Trace-ID')
+        response = node_service.get_gateway_stats(trace_id)
+        return jsonify(response.to_dict())
+    except Exception as e:
+        return jsonify(
+            Response(
+                message=ResponseMessage.ERROR,
+                status=ResponseStatus.ERROR,
+                code=ResponseCode.ERROR,
+                error=str(e),
+                trace_id=request.headers.get('X-Trace-ID')).to_dict()
+            )
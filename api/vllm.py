@@ -1,24 +1,51 @@
+import math
+import os
+
 from flask import Blueprint
 from flask import request, jsonify, Response
 
+from middleware.auth import require_jwt
 from service.errors import NoBackendError
 from service import vllm as vllm_service
 
 vllm = Blueprint('vllm', __name__)
 
+# 1 时 /v1 推理入口要求有效的网关 JWT（校验结果有缓存，见 middleware/auth.py）
+V1_AUTH = os.environ.get("NVLLM_V1_AUTH", "0").lower() in ("1", "true", "yes")
+
+
+def _v1_auth(f):
+    return require_jwt(f) if V1_AUTH else f
+
 _HTTP_FOR_CODE = {
     "NO_REGISTRY": 503,
     "NO_MODEL_POOL": 503,
     "ALL_UNHEALTHY": 503,
     "TARGET_NOT_FOUND": 404,
     "TARGET_UNHEALTHY": 503,
+    "ALL_SATURATED": 503,
+    "OVERLOADED": 429,
+    "RATE_LIMITED": 429,
     "NO_BACKEND": 503,
 }
 
 
+def retry_after_header(e: NoBackendError):
+    """准入拒绝 / 限流时附带 Retry-After（整数秒，至少 1）。"""
+    retry_after = getattr(e, "retry_after", None)
+    if retry_after is None:
+        return {}
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+def _no_backend(e: NoBackendError):
+    payload = {"error": str(e), "code": e.code}
+    return jsonify(payload), _HTTP_FOR_CODE.get(e.code, 503), retry_after_header(e)
+
+
 def _handle_forward(path: str):
     body = request.get_json(silent=True)
-    result = vllm_service.forward_openai(path, body, request.headers)
+    result = vllm_service.forward_openai(path, body, request.headers, request.remote_addr)
     if isinstance(result, Response):
         return result
     data, status = result
@@ -26,22 +53,22 @@ def _handle_forward(path: str):
 
 
 @vllm.route('/completions', methods=['POST'])
+@_v1_auth
 def completions_route():
     try:
         return _handle_forward('/v1/completions')
     except NoBackendError as e:
-        payload = {"error": str(e), "code": e.code}
-        return jsonify(payload), _HTTP_FOR_CODE.get(e.code, 503)
+        return _no_backend(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @vllm.route('/chat/completions', methods=['POST'])
+@_v1_auth
 def chat_completions_route():
     try:
         return _handle_forward('/v1/chat/completions')
     except NoBackendError as e:
-        payload = {"error": str(e), "code": e.code}
-        return jsonify(payload), _HTTP_FOR_CODE.get(e.code, 503)
+        return _no_backend(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,165 @@
+"""
+ASGI 入口（异步数据面）：/v1 推理转发在事件循环上执行（httpx + redis.asyncio），
+一个 worker 可同时承载大量 SSE 长流；其余路径（/api/user、/api/node）仍由 Flask 控制面处理。
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import asyncio
+import json
+import logging
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+from api.vllm import V1_AUTH, _HTTP_FOR_CODE, retry_after_header
+from main import app as flask_app
+from middleware.auth import authenticate
+from middleware.redis_client import redis_cli
+from service import response_cache, vllm_async
+from service.errors import NoBackendError
+
+logger = logging.getLogger(__name__)
+
+# ASGI 路径 -> 上游 OpenAI 路径（与 api/vllm.py 蓝图一致）
+_V1_ROUTES = {
+    "/v1/completions": "/v1/completions",
+    "/v1/chat/completions": "/v1/chat/completions",
+}
+
+_control_plane = WsgiToAsgi(flask_app)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, payload, status: int, extra_headers=None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    for k, v in (extra_headers or {}).items():
+        headers.append((k.lower().encode("latin-1"), v.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_raw(send, raw: response_cache.RawResponse) -> None:
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(raw.body)).encode()),
+    ]
+    headers.extend(
+        (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in raw.headers.items()
+    )
+    await send({"type": "http.response.start", "status": raw.status, "headers": headers})
+    await send({"type": "http.response.body", "body": raw.body})
+
+
+async def _wait_disconnect(receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _pump(send, upstream: vllm_async.UpstreamStream) -> None:
+    async for chunk in upstream.iter_chunks():
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _send_stream(send, receive, upstream: vllm_async.UpstreamStream) -> None:
+    """逐块转发上游流；客户端断开时立即取消并关闭上游连接，释放副本算力。"""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": upstream.status_code,
+            "headers": [(b"content-type", upstream.content_type.encode("latin-1"))],
+        }
+    )
+    pump = asyncio.ensure_future(_pump(send, upstream))
+    watcher = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        done, _ = await asyncio.wait(
+            {pump, watcher}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if pump in done:
+            pump.result()
+    except httpx.HTTPError as e:
+        logger.warning("upstream stream aborted: %s", e)
+    finally:
+        for task in (pump, watcher):
+            task.cancel()
+        await upstream.aclose()
+
+
+async def _handle_v1(scope, receive, send, path: str) -> None:
+    raw = await _read_body(receive)
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        body = None
+    headers = httpx.Headers(scope.get("headers") or [])
+    if V1_AUTH:
+        _, error = authenticate(headers.get("Authorization"))
+        if error is not None:
+            await _send_json(send, {"error": error}, 401)
+            return
+
+    try:
+        client = (scope.get("client") or (None,))[0]
+        result = await vllm_async.forward_openai_async(path, body, headers, client)
+    except NoBackendError as e:
+        payload = {"error": str(e), "code": e.code}
+        await _send_json(
+            send, payload, _HTTP_FOR_CODE.get(e.code, 503), retry_after_header(e)
+        )
+        return
+    except Exception as e:
+        logger.exception("async forward failed path=%s", path)
+        await _send_json(send, {"error": str(e)}, 500)
+        return
+
+    if isinstance(result, vllm_async.UpstreamStream):
+        await _send_stream(send, receive, result)
+        return
+    if isinstance(result, response_cache.RawResponse):
+        await _send_raw(send, result)
+        return
+    data, status = result
+    await _send_json(send, data, status)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await vllm_async.aclose()
+            if redis_cli._async_client is not None:
+                await redis_cli._async_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope.get("method") == "POST":
+        path = _V1_ROUTES.get(scope.get("path", "").rstrip("/"))
+        if path is not None:
+            await _handle_v1(scope, receive, send, path)
+            return
+    await _control_plane(scope, receive, send)
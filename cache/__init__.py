@@ -1 +1,4 @@
-# cache/__init__.py
\ No newline at end of file
+# cache/__init__.py
+from .cache_manager import CacheEntry, CacheManager
+
+__all__ = ["CacheEntry", "CacheManager"]
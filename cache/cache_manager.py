@@ -1,16 +1,217 @@
+"""
+两级缓存：进程内 LRU（条目数 + 字节上限 + TTL）在前，Redis（EX TTL）在后。
 
+- 读：L1 命中直接返回；否则读 Redis，命中后回填 L1（L1 TTL 不超过 Redis 剩余寿命的近似值）；
+- 写：同时写 L1 与 Redis；Redis 不可用时仅记日志，L1 仍然生效；
+- 值为 bytes，Redis 中以 "<写入时间毫秒>:<值>" 存储，以便返回 Age 并支持 max-age。
+"""
+from __future__ import annotations
 
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from middleware.redis_client import redis_cli
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    value: bytes
+    created_at: float  # 写入时的 wall clock（秒）
+
+    @property
+    def age(self) -> float:
+        return max(0.0, time.time() - self.created_at)
+
+
+def _encode(entry: CacheEntry) -> str:
+    return f"{int(entry.created_at * 1000)}:" + entry.value.decode("utf-8")
+
+
+def _decode(raw: Any) -> Optional[CacheEntry]:
+    if raw is None:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    ts, sep, value = raw.partition(":")
+    if not sep or not ts.isdigit():
+        return None
+    return CacheEntry(value=value.encode("utf-8"), created_at=int(ts) / 1000.0)
 
 
 class CacheManager():
-    def __init__(self):
+    def __init__(
+        self,
+        prefix: str = "nvllm:cache:",
+        ttl_sec: float = 600,
+        local_ttl_sec: float = 60,
+        local_max_entries: int = 10000,
+        local_max_bytes: int = 64 * 1024 * 1024,
+        use_redis: bool = True,
+    ):
         self.redis_cli = redis_cli
+        self.prefix = prefix
+        self.ttl_sec = ttl_sec
+        self.local_ttl_sec = local_ttl_sec
+        self.local_max_entries = max(0, local_max_entries)
+        self.local_max_bytes = max(0, local_max_bytes)
+        self.use_redis = use_redis
+        # key -> (L1 到期的 monotonic 时间, entry)
+        self._local: "OrderedDict[str, Tuple[float, CacheEntry]]" = OrderedDict()
+        self._local_bytes = 0
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, int] = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "bytes_served": 0,
+            "bytes_stored": 0,
+            "redis_errors": 0,
+        }
+
+    # ---------- L1 ----------
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._metrics[name] += n
 
-    def get_cache(self, key: str):
-        return self.redis_cli.get(key)
+    def _local_get(self, key: str) -> Optional[CacheEntry]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if now >= expires:
+                self._local_drop(key)
+                return None
+            self._local.move_to_end(key)
+            return entry
 
-    def set_cache(self, key: str, value: any):
-        return self.redis_cli.set(key, value)
+    def _local_drop(self, key: str) -> None:
+        item = self._local.pop(key, None)
+        if item is not None:
+            self._local_bytes -= len(item[1].value)
+
+    def _local_put(self, key: str, entry: CacheEntry, ttl_sec: float) -> None:
+        size = len(entry.value)
+        if ttl_sec <= 0 or not self.local_max_entries or size > self.local_max_bytes:
+            return
+        with self._lock:
+            self._local_drop(key)
+            self._local[key] = (time.monotonic() + ttl_sec, entry)
+            self._local_bytes += size
+            while self._local and (
+                len(self._local) > self.local_max_entries
+                or self._local_bytes > self.local_max_bytes
+            ):
+                _, (_, old) = self._local.popitem(last=False)
+                self._local_bytes -= len(old.value)
+                self._metrics["evictions"] += 1
+
+    def _local_ttl_for(self, entry: CacheEntry) -> float:
+        return min(self.local_ttl_sec, self.ttl_sec - entry.age)
+
+    def _hit(self, tier: str, entry: CacheEntry) -> CacheEntry:
+        with self._lock:
+            self._metrics[tier] += 1
+            self._metrics["bytes_served"] += len(entry.value)
+        return entry
+
+    # ---------- 读写 ----------
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        entry = self._local_get(key)
+        if entry is not None:
+            return self._hit("local_hits", entry)
+        if self.use_redis:
+            try:
+                entry = _decode(self.redis_cli.client.get(self.prefix + key))
+            except Exception as e:
+                self._count("redis_errors")
+                logger.warning("cache redis get failed: %s", e)
+                entry = None
+            if entry is not None:
+                self._local_put(key, entry, self._local_ttl_for(entry))
+                return self._hit("redis_hits", entry)
+        self._count("misses")
+        return None
+
+    async def aget_entry(self, key: str) -> Optional[CacheEntry]:
+        """get_entry 的 asyncio 版本（Redis 层使用 redis.asyncio）。"""
+        entry = self._local_get(key)
+        if entry is not None:
+            return self._hit("local_hits", entry)
+        if self.use_redis:
+            try:
+                raw = await self.redis_cli.async_client.get(self.prefix + key)
+                entry = _decode(raw)
+            except Exception as e:
+                self._count("redis_errors")
+                logger.warning("cache redis get failed: %s", e)
+                entry = None
+            if entry is not None:
+                self._local_put(key, entry, self._local_ttl_for(entry))
+                return self._hit("redis_hits", entry)
+        self._count("misses")
+        return None
+
+    def get_cache(self, key: str) -> Optional[bytes]:
+        entry = self.get_entry(key)
+        return entry.value if entry is not None else None
+
+    def _prepare(self, key: str, value: bytes, ttl_sec: Optional[float]):
+        ttl = self.ttl_sec if ttl_sec is None else ttl_sec
+        entry = CacheEntry(value=value, created_at=time.time())
+        self._local_put(key, entry, min(self.local_ttl_sec, ttl))
+        with self._lock:
+            self._metrics["stores"] += 1
+            self._metrics["bytes_stored"] += len(value)
+        return entry, max(1, int(ttl))
+
+    def set_cache(self, key: str, value: bytes, ttl_sec: Optional[float] = None):
+        entry, ttl = self._prepare(key, value, ttl_sec)
+        if not self.use_redis:
+            return
+        try:
+            self.redis_cli.client.set(self.prefix + key, _encode(entry), ex=ttl)
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("cache redis set failed: %s", e)
+
+    async def aset_cache(self, key: str, value: bytes, ttl_sec: Optional[float] = None):
+        entry, ttl = self._prepare(key, value, ttl_sec)
+        if not self.use_redis:
+            return
+        try:
+            await self.redis_cli.async_client.set(
+                self.prefix + key, _encode(entry), ex=ttl
+            )
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("cache redis set failed: %s", e)
 
     def delete_cache(self, key: str):
-        return self.redis_cli.delete(key)
\ No newline at end of file
+        with self._lock:
+            self._local_drop(key)
+        if self.use_redis:
+            return self.redis_cli.delete(self.prefix + key)
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._metrics)
+            out["local_entries"] = len(self._local)
+            out["local_bytes"] = self._local_bytes
+        lookups = out["local_hits"] + out["redis_hits"] + out["misses"]
+        out["hit_ratio"] = (
+            (out["local_hits"] + out["redis_hits"]) / lookups if lookups else 0.0
+        )
+        return out
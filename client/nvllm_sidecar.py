@@ -12,18 +12,29 @@ nvllm 侧上报脚本：向 nvllm 控制面登录、注册节点并周期性 PUT
   export NVLLM_SERVED_MODEL_NAME=meta-llama/Llama-3.1-8B-Instruct
   python nvllm_sidecar.py
 
-可选：设置 NVLLM_VLLM_METRICS_URL=http://127.0.0.1:8000/metrics 从 Prometheus 文本抓取
-running/waiting（匹配常见 vLLM 指标名）；未设置则使用固定数值或全 0。
+可选：设置 NVLLM_VLLM_METRICS_URL=http://127.0.0.1:8000/metrics 从 Prometheus 文本抓取指标：
+解析完整 exposition（多 engine / 多标签序列求和，histogram 按 le 合并桶），以两次抓取的差分计算
+窗口内的 token 吞吐、请求速率、抢占速率、prefix cache 命中率，以及 TTFT / inter-token / 排队 /
+端到端时延的 p50/p95（按桶线性插值，同 Prometheus histogram_quantile）；未设置则使用固定数值或全 0。
+
+可选：设置 NVLLM_HEARTBEAT_ADDR=gateway:9100 与 NVLLM_HEARTBEAT_SECRET 后，每 NVLLM_HEARTBEAT_INTERVAL_SEC
+（默认 1 秒）抓取一次指标并以 UDP 心跳（紧凑二进制 + HMAC）上报 node_info；完整的 HTTP 更新仍按
+NVLLM_REPORT_INTERVAL_SEC 进行，用于刷新状态与地址。
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
+import hmac
 import logging
+import math
 import os
+import socket
+import struct
 import sys
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
 
@@ -37,37 +48,247 @@ def _env(name: str, default: Optional[str] = None) -> str:
     return v
 
 
-def _parse_metrics(text: str) -> Tuple[int, int, int]:
+# 一次抓取：普通样本 {指标名: (各序列之和, 序列数)}；histogram {族名: {le: 累计计数}}
+Samples = Dict[str, Tuple[float, int]]
+Buckets = Dict[str, Dict[float, float]]
+
+
+def _label(labels: str, name: str) -> Optional[str]:
+    """从 `a="x",le="0.5"` 形式的标签串中取出 name 的值。"""
+    key = name + '="'
+    i = labels.find(key)
+    while i > 0 and labels[i - 1] not in ", ":
+        i = labels.find(key, i + 1)
+    if i < 0:
+        return None
+    i += len(key)
+    return labels[i : labels.find('"', i)]
+
+
+def _parse_exposition(text: str) -> Tuple[Samples, Buckets]:
     """
-    从 Prometheus 文本中解析 running / waiting / kv_cache。
-    优先匹配 vLLM 常见指标名；解析失败则返回 (0,0,0)。
+    解析 Prometheus 文本格式。同名指标的多个标签序列（多 engine、多 model_name）求和；
+    `_bucket` 行按 le 合并到所属 histogram 族，其余（gauge、counter、_sum、_count）按名称汇总。
     """
-    running = waiting = kv = 0
+    samples: Samples = {}
+    buckets: Buckets = {}
     for line in text.splitlines():
         line = line.strip()
-        if not line or line.startswith("#"):
+        if not line or line[0] == "#":
             continue
-        parts = line.split()
-        if len(parts) < 2:
+        brace = line.find("{")
+        if brace >= 0:
+            close = line.rfind("}")
+            if close < brace:
+                continue
+            name = line[:brace]
+            labels = line[brace + 1 : close]
+            rest = line[close + 1 :]
+        else:
+            name, _, rest = line.partition(" ")
+            labels = ""
+        fields = rest.split()
+        if not fields:
             continue
-        metric = parts[0]
         try:
-            val = int(float(parts[-1]))
+            val = float(fields[0])
         except ValueError:
             continue
-        if "num_requests_running" in metric or metric.endswith("_requests_running"):
-            running = val
-        elif "num_requests_waiting" in metric or metric.endswith("_requests_waiting"):
-            waiting = val
-        elif "kv_cache" in metric.lower() and "usage" in metric.lower():
-            kv = val
-    return running, waiting, kv
+        if math.isnan(val):
+            continue
+        if name.endswith("_bucket"):
+            le = _label(labels, "le")
+            if le is None:
+                continue
+            try:
+                bound = float(le)
+            except ValueError:
+                continue
+            family = buckets.setdefault(name[: -len("_bucket")], {})
+            family[bound] = family.get(bound, 0.0) + val
+        else:
+            total, n = samples.get(name, (0.0, 0))
+            samples[name] = (total + val, n + 1)
+    return samples, buckets
+
+
+def _quantile(q: float, cumulative: List[Tuple[float, float]]) -> float:
+    """按升序 (le, 累计计数) 求分位数：桶内线性插值，落入 +Inf 桶时取上一个有限边界。"""
+    if not cumulative:
+        return 0.0
+    total = cumulative[-1][1]
+    if total <= 0:
+        return 0.0
+    rank = q * total
+    prev_bound = prev_count = 0.0
+    for bound, count in cumulative:
+        if count >= rank:
+            if math.isinf(bound):
+                return prev_bound
+            if count == prev_count:
+                return bound
+            return prev_bound + (bound - prev_bound) * (rank - prev_count) / (
+                count - prev_count
+            )
+        prev_bound, prev_count = bound, count
+    return prev_bound
+
+
+def _first(samples: Samples, names: Iterable[str]) -> Optional[Tuple[float, int]]:
+    for name in names:
+        v = samples.get(name)
+        if v is not None:
+            return v
+    return None
+
+
+# 各字段对应的 vLLM 指标名（按版本新旧依次尝试）
+_RUNNING = ("vllm:num_requests_running",)
+_WAITING = ("vllm:num_requests_waiting",)
+_KV_USAGE = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+# counter -> node_info 中的每秒速率字段
+_RATES = {
+    "preemption_rate": ("vllm:num_preemptions_total",),
+    "prompt_tokens_rate": ("vllm:prompt_tokens_total",),
+    "generation_tokens_rate": ("vllm:generation_tokens_total",),
+    "request_rate": ("vllm:request_success_total",),
+}
+_PREFIX_HITS = ("vllm:prefix_cache_hits_total", "vllm:gpu_prefix_cache_hits_total")
+_PREFIX_QUERIES = (
+    "vllm:prefix_cache_queries_total",
+    "vllm:gpu_prefix_cache_queries_total",
+)
+# histogram -> (node_info 字段前缀, 分位数)；时延单位秒，上报毫秒
+_LATENCIES = {
+    "ttft": (("vllm:time_to_first_token_seconds",), (0.5, 0.95)),
+    "itl": (
+        ("vllm:inter_token_latency_seconds", "vllm:time_per_output_token_seconds"),
+        (0.5, 0.95),
+    ),
+    "queue": (("vllm:request_queue_time_seconds",), (0.95,)),
+    "e2e": (("vllm:e2e_request_latency_seconds",), (0.95,)),
+}
+
+
+class MetricsWindow:
+    """
+    保存上一次抓取，把累计型 counter / histogram 换算为两次抓取之间的速率与分位数。
+    首次抓取或计数器回退（vLLM 重启）时该项按从 0 开始计；窗口内无样本的分位数与命中率为 0。
+    """
 
+    def __init__(self) -> None:
+        self._last: Optional[Tuple[float, Samples, Buckets]] = None
+
+    def update(self, text: str, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.monotonic() if now is None else now
+        samples, buckets = _parse_exposition(text)
+        last = self._last
+        self._last = (now, samples, buckets)
+
+        running = _first(samples, _RUNNING)
+        waiting = _first(samples, _WAITING)
+        kv = _first(samples, _KV_USAGE)
+        info: Dict[str, Any] = {
+            "running": int(running[0]) if running else 0,
+            "waiting": int(waiting[0]) if waiting else 0,
+            # 多 engine 时取平均利用率
+            "kv_cache": kv[0] / kv[1] if kv else 0.0,
+        }
+        if last is None or now <= last[0]:
+            prev: Samples = {}
+            prev_buckets: Buckets = {}
+            elapsed = 0.0
+        else:
+            _, prev, prev_buckets = last
+            elapsed = now - last[0]
+
+        def delta(names) -> float:
+            cur = _first(samples, names)
+            if cur is None:
+                return 0.0
+            old = _first(prev, names)
+            if old is None or cur[0] < old[0]:
+                return cur[0] if prev else 0.0
+            return cur[0] - old[0]
+
+        for field, names in _RATES.items():
+            info[field] = delta(names) / elapsed if elapsed > 0 else 0.0
+        queries = delta(_PREFIX_QUERIES)
+        info["prefix_cache_hit_rate"] = (
+            min(1.0, delta(_PREFIX_HITS) / queries) if queries > 0 else 0.0
+        )
 
-def _fetch_metrics(url: str, timeout: float) -> Tuple[int, int, int]:
+        for prefix, (names, quantiles) in _LATENCIES.items():
+            window = self._window_buckets(buckets, prev_buckets, names)
+            for q in quantiles:
+                info[f"{prefix}_p{int(q * 100)}_ms"] = (
+                    round(_quantile(q, window) * 1000, 3) if window else 0.0
+                )
+        return info
+
+    @staticmethod
+    def _window_buckets(
+        buckets: Buckets, prev_buckets: Buckets, names: Iterable[str]
+    ) -> List[Tuple[float, float]]:
+        for name in names:
+            cur = buckets.get(name)
+            if cur is None:
+                continue
+            old = prev_buckets.get(name)
+            if old is None:
+                # 首次抓取没有基线，不把进程生命周期内的累计分布当作窗口
+                return []
+            window = [(le, count - old.get(le, 0.0)) for le, count in sorted(cur.items())]
+            if any(count < 0 for _, count in window):
+                # 计数器回退：vLLM 重启后的累计即为窗口
+                window = sorted(cur.items())
+            return window
+        return []
+
+
+def _fetch_metrics(url: str, timeout: float) -> str:
     r = requests.get(url, timeout=timeout)
     r.raise_for_status()
-    return _parse_metrics(r.text)
+    return r.text
+
+
+# 心跳报文格式，与网关 service/heartbeat.py 保持一致
+HEARTBEAT_MAGIC = b"NH"
+HEARTBEAT_VERSION = 1
+FLOAT_FIELDS = (
+    "kv_cache",
+    "preemption_rate",
+    "prompt_tokens_rate",
+    "generation_tokens_rate",
+    "request_rate",
+    "prefix_cache_hit_rate",
+    "ttft_p50_ms",
+    "ttft_p95_ms",
+    "itl_p50_ms",
+    "itl_p95_ms",
+    "queue_p95_ms",
+    "e2e_p95_ms",
+)
+_HB_HEAD = struct.Struct("!2sBB")
+_HB_BODY = struct.Struct("!dII" + "f" * len(FLOAT_FIELDS))
+HEARTBEAT_MAC_LEN = 16
+
+
+def encode_heartbeat(node_id: str, info: Dict[str, Any], secret: bytes) -> bytes:
+    raw_id = node_id.encode("utf-8")
+    if len(raw_id) > 255:
+        raise ValueError("node_id too long for heartbeat")
+    signed = (
+        _HB_HEAD.pack(HEARTBEAT_MAGIC, HEARTBEAT_VERSION, len(raw_id))
+        + raw_id
+        + _HB_BODY.pack(
+            time.time(),
+            max(0, int(info.get("running", 0))),
+            max(0, int(info.get("waiting", 0))),
+            *(float(info.get(name, 0.0) or 0.0) for name in FLOAT_FIELDS),
+        )
+    )
+    return signed + hmac.new(secret, signed, hashlib.sha256).digest()[:HEARTBEAT_MAC_LEN]
 
 
 def _extract_token(payload: Dict[str, Any]) -> str:
@@ -106,6 +327,23 @@ class Sidecar:
         self._session = requests.Session()
         self._token: Optional[str] = None
         self._token_obtained_at = 0.0
+        # 上次抓取的累计 counter / histogram，用于计算两次抓取间的速率与分位数
+        self._metrics = MetricsWindow()
+
+        self.heartbeat_secret = os.environ.get("NVLLM_HEARTBEAT_SECRET", "").encode()
+        self.heartbeat_interval = float(
+            os.environ.get("NVLLM_HEARTBEAT_INTERVAL_SEC", "1")
+        )
+        self._heartbeat_target: Optional[Tuple[Any, ...]] = None
+        self._heartbeat_sock: Optional[socket.socket] = None
+        heartbeat_addr = os.environ.get("NVLLM_HEARTBEAT_ADDR", "")
+        if heartbeat_addr and self.heartbeat_secret:
+            host, _, port = heartbeat_addr.rpartition(":")
+            family, _, _, _, target = socket.getaddrinfo(
+                host, int(port), type=socket.SOCK_DGRAM
+            )[0]
+            self._heartbeat_sock = socket.socket(family, socket.SOCK_DGRAM)
+            self._heartbeat_target = target
 
     def _need_refresh_token(self) -> bool:
         if not self._token:
@@ -150,6 +388,8 @@ class Sidecar:
             "node_info": {"running": 0, "waiting": 0, "kv_cache": 0},
             "remark": os.environ.get("NVLLM_NODE_REMARK", "nvllm_sidecar"),
             "timeout": int(os.environ.get("NVLLM_NODE_TIMEOUT_SEC", "120")),
+            "weight": int(os.environ.get("NVLLM_NODE_WEIGHT", "1")),
+            "max_concurrency": int(os.environ.get("NVLLM_NODE_MAX_CONCURRENCY", "0")),
         }
         r = self._session.post(
             url, json=body, headers=self._auth_headers(), timeout=self.timeout_sec
@@ -159,27 +399,33 @@ class Sidecar:
             r.raise_for_status()
         logger.info("register ok node_id=%s", self.node_id)
 
-    def _collect_node_info(self) -> Dict[str, int]:
+    def _collect_node_info(self) -> Dict[str, Any]:
         if self.metrics_url:
             try:
-                running, waiting, kv = _fetch_metrics(
-                    self.metrics_url, self.metrics_timeout
+                return self._metrics.update(
+                    _fetch_metrics(self.metrics_url, self.metrics_timeout)
                 )
-                return {"running": running, "waiting": waiting, "kv_cache": kv}
             except Exception as e:
                 logger.warning("metrics scrape failed, using env fallback: %s", e)
         # 静态兜底（无 metrics 或抓取失败）
         return {
             "running": int(os.environ.get("NVLLM_NODE_INFO_RUNNING", "0")),
             "waiting": int(os.environ.get("NVLLM_NODE_INFO_WAITING", "0")),
-            "kv_cache": int(os.environ.get("NVLLM_NODE_INFO_KV_CACHE", "0")),
+            "kv_cache": float(os.environ.get("NVLLM_NODE_INFO_KV_CACHE", "0")),
         }
 
-    def update(self) -> None:
+    def heartbeat(self, info: Dict[str, Any]) -> None:
+        assert self._heartbeat_sock is not None
+        self._heartbeat_sock.sendto(
+            encode_heartbeat(self.node_id, info, self.heartbeat_secret),
+            self._heartbeat_target,
+        )
+
+    def update(self, node_info: Optional[Dict[str, Any]] = None) -> None:
         url = f"{self.base}/api/node/node/update/{self.node_id}"
         body: Dict[str, Any] = {
             "node_status": self.node_status,
-            "node_info": self._collect_node_info(),
+            "node_info": node_info if node_info is not None else self._collect_node_info(),
         }
         # 允许顺带刷新可达地址（例如弹性网卡变更）
         if os.environ.get("NVLLM_UPDATE_ADDRESS", "").lower() in ("1", "true", "yes"):
@@ -203,6 +449,9 @@ class Sidecar:
         self.login()
         if not self.skip_register:
             self.register()
+        if self._heartbeat_sock is not None:
+            self._run_with_heartbeat()
+            return
         while True:
             try:
                 self.update()
@@ -212,6 +461,28 @@ class Sidecar:
                 logger.exception("update loop error")
             time.sleep(self.interval)
 
+    def _run_with_heartbeat(self) -> None:
+        """每个心跳周期抓取一次指标并发 UDP 心跳；到达上报周期时复用同一份 node_info 做 HTTP 更新。"""
+        next_update = 0.0
+        while True:
+            started = time.monotonic()
+            info = self._collect_node_info()
+            try:
+                self.heartbeat(info)
+            except OSError as e:
+                logger.warning("heartbeat send failed: %s", e)
+            if started >= next_update:
+                next_update = started + self.interval
+                try:
+                    self.update(info)
+                except requests.HTTPError as e:
+                    logger.error(
+                        "update failed: %s %s", e, getattr(e.response, "text", "")
+                    )
+                except Exception:
+                    logger.exception("update loop error")
+            time.sleep(max(0.0, self.heartbeat_interval - (time.monotonic() - started)))
+
 
 def main() -> int:
     logging.basicConfig(
@@ -1,10 +1,15 @@
 from flask import Flask
 from api import register_routes
-from service.health import start_background_health_prober
+from service.catalog import start_catalog_watcher
+from service.heartbeat import start_heartbeat
+from service.health import start_background_health_prober, start_health_watcher
 
 app = Flask(__name__)
 
 register_routes(app)
+start_catalog_watcher()
+start_heartbeat()
+start_health_watcher()
 start_background_health_prober()
 
 if __name__ == '__main__':
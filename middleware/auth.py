@@ -1,11 +1,35 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
+from typing import Any, Dict, Optional, Tuple
 from flask import Flask, request, jsonify
 import jwt
 from datetime import datetime, timedelta
 
+from service import stats
+
 
 SECRET_KEY = "your-jwt-secret-key"
 
+# 已校验 token 的 LRU：键为 token 的 SHA-256 摘要，命中时按 exp 判断过期，跳过 HS256 验签
+JWT_CACHE_SIZE = int(os.environ.get("NVLLM_JWT_CACHE_SIZE", "4096"))
+# 无 exp 的 token 在缓存中的最长停留时间
+JWT_CACHE_TTL_SEC = float(os.environ.get("NVLLM_JWT_CACHE_TTL_SEC", "300"))
+
+# digest -> (缓存到期的 wall clock 秒, payload)
+_verified: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_verified_lock = threading.Lock()
+_cache_metrics: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "expired": 0,
+    "evictions": 0,
+    "invalid": 0,
+}
+
 def generate_token(username):
     payload = {
         "username": username,
@@ -13,20 +37,79 @@ def generate_token(username):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
+def _count(name: str) -> None:
+    with _verified_lock:
+        _cache_metrics[name] += 1
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """
+    校验 token 并返回 payload（副本）；过期抛 jwt.ExpiredSignatureError，其余无效抛 jwt.InvalidTokenError。
+    验签通过的 token 缓存到 exp（无 exp 时 NVLLM_JWT_CACHE_TTL_SEC），缓存期内不再重复 HS256 验签。
+    """
+    if JWT_CACHE_SIZE <= 0:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    now = time.time()
+    with _verified_lock:
+        item = _verified.get(digest)
+        if item is not None:
+            if now < item[0]:
+                _verified.move_to_end(digest)
+                _cache_metrics["hits"] += 1
+                return dict(item[1])
+            del _verified[digest]
+            _cache_metrics["expired"] += 1
+        _cache_metrics["misses"] += 1
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        _count("invalid")
+        raise
+    exp = payload.get("exp")
+    until = float(exp) if isinstance(exp, (int, float)) else now + JWT_CACHE_TTL_SEC
+    with _verified_lock:
+        _verified[digest] = (until, payload)
+        while len(_verified) > JWT_CACHE_SIZE:
+            _verified.popitem(last=False)
+            _cache_metrics["evictions"] += 1
+    return dict(payload)
+
+def jwt_cache_stats() -> Dict[str, Any]:
+    with _verified_lock:
+        out: Dict[str, Any] = dict(_cache_metrics)
+        out["entries"] = len(_verified)
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = out["hits"] / lookups if lookups else 0.0
+    return out
+
+def authenticate(authorization: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """返回 (payload, None) 或 (None, 401 错误信息)；供 require_jwt 与 ASGI 数据面共用。"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return None, "Token required"
+    try:
+        return verify_token(authorization.split(" ")[1]), None
+    except jwt.ExpiredSignatureError:
+        return None, "Token expired"
+    except jwt.InvalidTokenError:
+        return None, "Invalid token"
+
+def decode_token(authorization: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    校验 "Bearer <token>" 并返回 claims；缺失、过期或无效时返回 None（供可选鉴权场景读取 claims）。
+    """
+    payload, _ = authenticate(authorization)
+    return payload
+
 def require_jwt(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get("Authorization")
-        if not token or not token.startswith("Bearer "):
-            return jsonify({"error": "Token required"}), 401
-        
-        try:
-            payload = jwt.decode(token.split(" ")[1], SECRET_KEY, algorithms=["HS256"])
-            request.current_user = payload["username"]
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-        
+        payload, error = authenticate(request.headers.get("Authorization"))
+        if error is not None:
+            return jsonify({"error": error}), 401
+        request.current_user = payload.get("username") or payload.get("sub")
         return f(*args, **kwargs)
-    return decorated
\ No newline at end of file
+    return decorated
+
+
+if JWT_CACHE_SIZE > 0:
+    stats.register_provider("jwt_cache", jwt_cache_stats)
\ No newline at end of file
@@ -10,6 +10,8 @@ logger = logging.getLogger(__name__)
 class RedisClient:
     _instance = None
     _client = None
+    _async_client = None
+    _conn_kwargs: Dict[str, Any] = {}
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -30,18 +32,19 @@ class RedisClient:
         if self._client is not None:
             return  # 避免重复初始化
 
+        self._conn_kwargs = dict(
+            host=host,
+            port=port,
+            db=db,
+            password=password,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            retry_on_timeout=retry_on_timeout,
+            decode_responses=decode_responses,
+            encoding="utf-8",
+        )
         try:
-            pool = redis.ConnectionPool(
-                host=host,
-                port=port,
-                db=db,
-                password=password,
-                max_connections=max_connections,
-                socket_timeout=socket_timeout,
-                retry_on_timeout=retry_on_timeout,
-                decode_responses=decode_responses,
-                encoding="utf-8"
-            )
+            pool = redis.ConnectionPool(**self._conn_kwargs)
             self._client = redis.Redis(connection_pool=pool)
             # 测试连接
             self._client.ping()
@@ -55,6 +58,17 @@ class RedisClient:
         """获取原始 Redis 客户端（用于高级操作）"""
         return self._client
 
+    @property
+    def async_client(self):
+        """获取 asyncio Redis 客户端（ASGI 数据面使用，首次访问时按相同配置创建）"""
+        if self._async_client is None:
+            import redis.asyncio as aioredis
+
+            self._async_client = aioredis.Redis(
+                connection_pool=aioredis.ConnectionPool(**self._conn_kwargs)
+            )
+        return self._async_client
+
     # ======================
     # 基础键值操作
     # ======================
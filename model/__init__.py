@@ -1,4 +1,4 @@
-from .base import Response, ResponseMessage, ResponseStatus, ResponseCode
+from .base import Response, ResponseMessage, ResponseStatus, ResponseCode, to_plain
 from .node import Node
 
-__all__ = ["Response", "ResponseMessage", "ResponseStatus", "ResponseCode", "Node"]
\ No newline at end of file
+__all__ = ["Response", "ResponseMessage", "ResponseStatus", "ResponseCode", "Node", "to_plain"]
\ No newline at end of file
@@ -1,5 +1,5 @@
-from dataclasses import dataclass, asdict
-from typing import Any
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Dict, Tuple
 from enum import Enum
 from dataclasses import field
 
@@ -7,6 +7,7 @@ from dataclasses import field
 class ResponseMessage(str, Enum):
     SUCCESS = "success"
     ERROR = "error"
+    BAD_REQUEST = "bad request"
     UNAUTHORIZED = "unauthorized"
     FORBIDDEN = "forbidden"
     NOT_FOUND = "not found"
@@ -20,6 +21,7 @@ class ResponseMessage(str, Enum):
 class ResponseCode(int, Enum):
     SUCCESS = 200
     ERROR = 500
+    BAD_REQUEST = 400
     UNAUTHORIZED = 401
     FORBIDDEN = 403
     NOT_FOUND = 404
@@ -33,6 +35,7 @@ class ResponseCode(int, Enum):
 class ResponseStatus(str, Enum):
     SUCCESS = "success"
     ERROR = "error"
+    BAD_REQUEST = "bad request"
     UNAUTHORIZED = "unauthorized"
     FORBIDDEN = "forbidden"
     NOT_FOUND = "not found"
@@ -62,4 +65,34 @@ class Response:
     error: str = field(default_factory=lambda: "")
 
     def to_dict(self) -> dict:
-        return asdict(self, dict_factory=lambda x: {k: v for k, v in x.items() if v is not None})
\ No newline at end of file
+        return to_plain(self)
+
+
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+_FIELD_NAMES: Dict[type, Tuple[str, ...]] = {}
+
+
+def to_plain(value: Any) -> Any:
+    """
+    与 asdict(value, dict_factory=去掉取值为 None 的字段) 结果相同，供 jsonify 编码；
+    按类型缓存字段名，且不深拷贝叶子值（datetime 等原样交给 JSON 编码器）。
+    """
+    cls = type(value)
+    if cls in _SCALARS:
+        return value
+    names = _FIELD_NAMES.get(cls)
+    if names is None and is_dataclass(value) and not isinstance(value, type):
+        names = _FIELD_NAMES[cls] = tuple(f.name for f in fields(value))
+    if names is not None:
+        out = {}
+        for name in names:
+            v = to_plain(getattr(value, name))
+            if v is not None:
+                out[name] = v
+        return out
+    if isinstance(value, (list, tuple)):
+        items = [to_plain(v) for v in value]
+        return tuple(items) if cls is tuple else items
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    return value
@@ -0,0 +1,56 @@
+"""
+目录记录解码 / 响应序列化微基准：python -m model.bench
+
+- from_dict：通用解析（请求体、旧版 JSON 记录，逐字段校验）；
+- from_fields：副本 Hash 快速路径，cold 为 node_info 均未见过，warm 为目录重载时负载未变化；
+- asdict / to_plain：Response.to_dict 旧实现（dataclasses.asdict 深拷贝）与当前实现。
+"""
+import timeit
+from dataclasses import asdict
+
+from model import node as node_model
+from model.base import Response, ResponseCode, ResponseMessage, ResponseStatus, to_plain
+from model.node import Node, NodeInfo
+
+
+def _per_node_us(fn, n: int) -> float:
+    runs = max(3, 20000 // n)
+    return min(timeit.repeat(fn, number=runs, repeat=3)) / runs / n * 1e6
+
+
+def _main() -> None:
+    print(f"{'nodes':>6} {'from_dict':>10} {'fields_cold':>12} {'fields_warm':>12} "
+          f"{'asdict':>8} {'to_plain':>9}   (us/node)")
+    for n in (10, 100, 1000):
+        nodes = [
+            Node(node_id=f"node-{i:04d}", node_address=f"10.0.{i // 256}.{i % 256}",
+                 served_model_name="m", node_info=NodeInfo(running=i, kv_cache=i / n))
+            for i in range(n)
+        ]
+        hashes = [x.to_fields() for x in nodes]
+        assert [Node.from_fields(h) for h in hashes] == nodes
+        resp = Response(message=ResponseMessage.SUCCESS, status=ResponseStatus.SUCCESS,
+                        code=ResponseCode.SUCCESS, trace_id="bench", data=nodes)
+        legacy = lambda: asdict(resp, dict_factory=lambda x: {k: v for k, v in x if v is not None})
+        assert legacy() == to_plain(resp)
+
+        def cold():
+            node_model._NODE_INFO_CACHE.clear()
+            return [Node.from_fields(h) for h in hashes]
+
+        cost = [
+            _per_node_us(fn, n)
+            for fn in (
+                lambda: [Node.from_dict(h) for h in hashes],
+                cold,
+                lambda: [Node.from_fields(h) for h in hashes],
+                legacy,
+                resp.to_dict,
+            )
+        ]
+        print(f"{n:>6} {cost[0]:>10.2f} {cost[1]:>12.2f} {cost[2]:>12.2f} "
+              f"{cost[3]:>8.2f} {cost[4]:>9.2f}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,46 +1,126 @@
 from dataclasses import dataclass, field
+import sys
 import uuid
 from datetime import datetime
-from typing import Any, Union
+from typing import Any, ClassVar, Dict, Mapping, Tuple, Union
 import json
 
+# 目录记录不可变（快照间共享、按对象身份缓存序列化结果）；3.10+ 同时启用 __slots__
+_RECORD = {"frozen": True, "slots": True} if sys.version_info >= (3, 10) else {"frozen": True}
 
-@dataclass
+
+@dataclass(**_RECORD)
 class NodeInfo:
     """
-    Node info model, used to store node information
+    Node info model, used to store node information (immutable; use dataclasses.replace to derive)
     Args:
         running: Running tasks
         waiting: Waiting tasks
-        kv_cache: KV cache
+        kv_cache: KV cache utilisation as a 0-1 fraction (vllm:kv_cache_usage_perc)
+        preemption_rate: Preemptions per second between sidecar scrapes
+        prompt_tokens_rate: Prompt tokens per second between sidecar scrapes
+        generation_tokens_rate: Generated tokens per second between sidecar scrapes
+        request_rate: Finished requests per second between sidecar scrapes
+        prefix_cache_hit_rate: Prefix cache hit tokens / queried tokens in the scrape window (0-1)
+        ttft_p50_ms / ttft_p95_ms: Time-to-first-token percentiles in the scrape window
+        itl_p50_ms / itl_p95_ms: Inter-token latency percentiles in the scrape window
+        queue_p95_ms: Scheduler queue time p95 in the scrape window
+        e2e_p95_ms: End-to-end request latency p95 in the scrape window
     """
     running: int = 0
     waiting: int = 0
-    kv_cache: int = 0
+    kv_cache: float = 0.0
+    preemption_rate: float = 0.0
+    prompt_tokens_rate: float = 0.0
+    generation_tokens_rate: float = 0.0
+    request_rate: float = 0.0
+    prefix_cache_hit_rate: float = 0.0
+    ttft_p50_ms: float = 0.0
+    ttft_p95_ms: float = 0.0
+    itl_p50_ms: float = 0.0
+    itl_p95_ms: float = 0.0
+    queue_p95_ms: float = 0.0
+    e2e_p95_ms: float = 0.0
 
     def to_dict(self) -> dict:
         return {
             "running": self.running,
             "waiting": self.waiting,
             "kv_cache": self.kv_cache,
+            "preemption_rate": self.preemption_rate,
+            "prompt_tokens_rate": self.prompt_tokens_rate,
+            "generation_tokens_rate": self.generation_tokens_rate,
+            "request_rate": self.request_rate,
+            "prefix_cache_hit_rate": self.prefix_cache_hit_rate,
+            "ttft_p50_ms": self.ttft_p50_ms,
+            "ttft_p95_ms": self.ttft_p95_ms,
+            "itl_p50_ms": self.itl_p50_ms,
+            "itl_p95_ms": self.itl_p95_ms,
+            "queue_p95_ms": self.queue_p95_ms,
+            "e2e_p95_ms": self.e2e_p95_ms,
         }
 
     @classmethod
     def from_dict(cls, data: Union[dict, str]) -> "NodeInfo":
         if isinstance(data, str):
             data = json.loads(data)
+        get = data.get
+        # 按字段声明顺序位置传参：running / waiting 为整数，其余为浮点
         return cls(
-            running=int(data.get("running", 0)),
-            waiting=int(data.get("waiting", 0)),
-            kv_cache=int(data.get("kv_cache", 0)),
+            int(get("running", 0)),
+            int(get("waiting", 0)),
+            *[float(get(name, 0) or 0) for name in _NODE_INFO_FLOATS],
         )
 
 
+_NODE_INFO_FLOATS = (
+    "kv_cache",
+    "preemption_rate",
+    "prompt_tokens_rate",
+    "generation_tokens_rate",
+    "request_rate",
+    "prefix_cache_hit_rate",
+    "ttft_p50_ms",
+    "ttft_p95_ms",
+    "itl_p50_ms",
+    "itl_p95_ms",
+    "queue_p95_ms",
+    "e2e_p95_ms",
+)
+
+
+# node_info JSON 串 -> NodeInfo：记录不可变，可在副本与快照间共享；目录重载时未变化的负载不再重复解析
+_NODE_INFO_CACHE: Dict[str, NodeInfo] = {}
+_NODE_INFO_CACHE_MAX = 4096
+
+
+def _decode_info(raw: str) -> NodeInfo:
+    info = _NODE_INFO_CACHE.get(raw)
+    if info is None:
+        info = NodeInfo.from_dict(raw)
+        if len(_NODE_INFO_CACHE) >= _NODE_INFO_CACHE_MAX:
+            _NODE_INFO_CACHE.clear()
+        _NODE_INFO_CACHE[raw] = info
+    return info
 
-@dataclass
+
+def _parse_dt(value: Any) -> datetime:
+    if value is None:
+        return datetime.now()
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return datetime.now()
+    return datetime.now()
+
+
+@dataclass(**_RECORD)
 class Node:
     """
-    Node model, used to store node information
+    Node model, used to store node information (immutable; use dataclasses.replace to derive)
     Args:
         node_id: Node ID (default: random UUID)
         node_type: Node type (required)
@@ -49,8 +129,12 @@ class Node:
         node_status: Node status (default: 'offline')
         served_model_name: OpenAI model id served on this replica (empty = accept any / wildcard pool)
         remark: Remark (default: '')
+        timeout: Upstream request timeout in seconds (default: 60)
+        weight: Relative routing weight, scales the node's share of the hash ring (default: 1)
+        max_concurrency: Gateway-enforced cap on in-flight requests, 0 = unlimited (default: 0)
         create_time: Create time (default: current time)
         update_time: Update time (default: current time)
+        revision: Per-node revision maintained by the catalog, bumped on every change (for compare-and-set)
     """
     node_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     node_type: str = field(default='master')
@@ -61,8 +145,25 @@ class Node:
     node_info: NodeInfo = field(default_factory=NodeInfo)
     remark: str = field(default='doc')
     timeout: int = field(default=60)
+    weight: int = field(default=1)
+    max_concurrency: int = field(default=0)
     create_time: datetime = field(default_factory=datetime.now)
     update_time: datetime = field(default_factory=datetime.now)
+    revision: int = field(default=0)
+
+    # 可部分更新的字段；node_id / create_time / revision 由目录维护
+    MUTABLE_FIELDS: ClassVar[Tuple[str, ...]] = (
+        "node_type",
+        "node_address",
+        "node_port",
+        "node_status",
+        "served_model_name",
+        "node_info",
+        "remark",
+        "timeout",
+        "weight",
+        "max_concurrency",
+    )
 
     def to_dict(self) -> dict:
         ct = self.create_time
@@ -77,10 +178,25 @@ class Node:
             "node_info": self.node_info.to_dict(),
             "remark": self.remark,
             "timeout": self.timeout,
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
             "create_time": ct.isoformat() if isinstance(ct, datetime) else ct,
             "update_time": ut.isoformat() if isinstance(ut, datetime) else ut,
+            "revision": self.revision,
         }
 
+    def to_fields(self) -> Dict[str, str]:
+        """Redis 哈希字段（每个属性一个字段，node_info 为 JSON 串）。"""
+        d = self.to_dict()
+        d["node_info"] = json.dumps(d["node_info"], separators=(",", ":"))
+        return {k: str(v) for k, v in d.items()}
+
+    @classmethod
+    def patch_fields(cls, data: dict) -> Dict[str, str]:
+        """部分更新请求体 -> 需写入的哈希字段：只含请求中出现的可变字段，取值按 from_dict 规则规范化。"""
+        fields = cls.from_dict({**data, "node_id": "-"}).to_fields()
+        return {k: fields[k] for k in cls.MUTABLE_FIELDS if k in data}
+
     @classmethod
     def from_dict(cls, data: Union[dict, str, Any]) -> "Node":
         if isinstance(data, str):
@@ -89,19 +205,6 @@ class Node:
             raise TypeError("Node.from_dict expects dict or JSON string")
         raw_info = data.get("node_info") or {}
         node_info = NodeInfo.from_dict(raw_info) if isinstance(raw_info, (dict, str)) else NodeInfo()
-
-        def _parse_dt(value: Any) -> datetime:
-            if value is None:
-                return datetime.now()
-            if isinstance(value, datetime):
-                return value
-            if isinstance(value, str):
-                try:
-                    return datetime.fromisoformat(value.replace("Z", "+00:00"))
-                except ValueError:
-                    return datetime.now()
-            return datetime.now()
-
         return cls(
             node_id=data.get("node_id") or str(uuid.uuid4()),
             node_type=data.get("node_type", "master"),
@@ -112,6 +215,37 @@ class Node:
             node_info=node_info,
             remark=data.get("remark", "doc"),
             timeout=int(data.get("timeout", 60)),
+            weight=max(1, int(data.get("weight", 1) or 1)),
+            max_concurrency=max(0, int(data.get("max_concurrency", 0) or 0)),
             create_time=_parse_dt(data.get("create_time")),
             update_time=_parse_dt(data.get("update_time")),
-        )
\ No newline at end of file
+            revision=int(data.get("revision", 0) or 0),
+        )
+
+    @classmethod
+    def from_fields(cls, fields: Mapping[str, str]) -> "Node":
+        """
+        解析 to_fields 写入的副本 Hash：取值已按 from_dict 规范化，字段齐全时按已知格式直接转换；
+        缺字段或格式不符（旧记录、手工写入）时回退 from_dict。
+        """
+        try:
+            # 按字段声明顺序位置传参
+            return cls(
+                fields["node_id"],
+                fields["node_type"],
+                fields["node_address"],
+                int(fields["node_port"]),
+                fields["node_status"],
+                fields["served_model_name"],
+                _decode_info(fields["node_info"]),
+                fields["remark"],
+                int(fields["timeout"]),
+                int(fields["weight"]),
+                int(fields["max_concurrency"]),
+                datetime.fromisoformat(fields["create_time"]),
+                datetime.fromisoformat(fields["update_time"]),
+                int(fields["revision"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            return cls.from_dict(dict(fields))
+
@@ -3,13 +3,15 @@ from enum import Enum
 from typing import Any
 
 class VllmStrategy(Enum):
-    DEFAULT = "round_robin" # 轮询
+    ROUND_ROBIN = "round_robin" # 轮询
     WEIGHTED = "weighted" # 权重
     LEAST_LOAD = "least_load" # 最少负载
-    ROUND_ROBIN = "round_robin"
     STREAM = "minimal"  # 最小链接
     RANDOM = "random" # 随机
     SIM_PROMPT = "sim_prompt" # 相似Prompt
+    PREFIX_AFFINITY = "prefix_affinity" # 前缀亲和 + JSQ（网关默认）
+    POWER_OF_TWO = "p2c" # 随机两选一（大池）
+    DEFAULT = "prefix_affinity"
 
 class VllmResponseCode(Enum):
     SUCCESS = 0
@@ -67,5 +69,5 @@ class VllmRequest(BaseRequest):
         params: Params (required), to store request parameters
         strategy: Strategy (required)
     """
-    model: str
+    model: str = ""
     params: str = ""  # json parms
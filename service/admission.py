@@ -0,0 +1,363 @@
+"""
+网关侧准入控制：每个模型池一个有界排队，副本算力占满时请求在网关排队而不是堆进 vLLM 的 waiting 队列。
+
+- 池容量 = Σ(副本 max_concurrency，未登记时取 NVLLM_ADMISSION_REPLICA_SLOTS) / NVLLM_ADMISSION_GATEWAYS，
+  随目录快照变化；池内在途数未满时直接放行；
+- 优先级类别（默认 interactive > batch）来自 JWT claim `priority` 或请求头 X-Priority；
+  空出的名额按类别优先、同类先到先得分派，交互请求可越过批量任务；
+- 截止时间：类别最长排队时间（可由 X-Deadline-Ms 缩短）。按「前方排队数 / 容量 × 平均服务时长」
+  估计等待，超过截止时间立即拒绝；队列满时挤掉优先级更低的最后一个等待者，否则拒绝；
+  排队超时同样拒绝。拒绝统一返回 HTTP 429 + Retry-After。
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from middleware.auth import decode_token
+from service import catalog, stats
+from service.errors import AdmissionRejected
+from service.routing import filter_pool_by_requested_model, requested_openai_model
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.environ.get("NVLLM_ADMISSION", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+CLASSES: List[str] = [
+    c.strip().lower()
+    for c in os.environ.get("NVLLM_ADMISSION_CLASSES", "interactive,batch").split(",")
+    if c.strip()
+] or ["interactive"]
+DEFAULT_CLASS = os.environ.get("NVLLM_ADMISSION_DEFAULT_CLASS", CLASSES[0]).lower()
+QUEUE_SIZE = max(0, int(os.environ.get("NVLLM_ADMISSION_QUEUE_SIZE", "256")))
+REPLICA_SLOTS = max(1, int(os.environ.get("NVLLM_ADMISSION_REPLICA_SLOTS", "16")))
+GATEWAYS = max(1, int(os.environ.get("NVLLM_ADMISSION_GATEWAYS", "1")))
+# 尚无样本时假设的单请求服务时长
+INITIAL_SERVICE_SEC = float(os.environ.get("NVLLM_ADMISSION_SERVICE_MS", "1000")) / 1000
+DEFAULT_MAX_WAIT_SEC = 10.0
+
+
+def _parse_max_wait(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in raw.split(","):
+        name, sep, ms = part.partition(":")
+        if not sep:
+            continue
+        try:
+            out[name.strip().lower()] = float(ms) / 1000
+        except ValueError:
+            logger.warning("invalid NVLLM_ADMISSION_MAX_WAIT_MS entry %r", part)
+    return out
+
+
+# 各类别最长排队时间，如 "interactive:2000,batch:60000"
+MAX_WAIT_SEC = _parse_max_wait(
+    os.environ.get("NVLLM_ADMISSION_MAX_WAIT_MS", "interactive:2000,batch:60000")
+)
+
+_EWMA_ALPHA = 0.2
+
+
+class Ticket:
+    """准入凭证：请求（含流式响应）结束时 release 归还名额。"""
+
+    __slots__ = ("_controller", "_pool", "_started", "_released")
+
+    def __init__(self, controller: "AdmissionController", pool: "_PoolQueue"):
+        self._controller = controller
+        self._pool = pool
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._pool, time.monotonic() - self._started)
+
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "wake", "granted", "rejected", "done")
+
+    def __init__(self, rank: int, seq: int, wake: Callable[[], None]):
+        self.rank = rank
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.rejected = False
+        # 已出队（放行、拒绝或超时取消）
+        self.done = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class _PoolQueue:
+    __slots__ = ("name", "limit", "active", "heap", "queued", "service_sec")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.limit = 1
+        self.active = 0
+        self.heap: List[_Waiter] = []
+        self.queued = 0
+        self.service_sec = INITIAL_SERVICE_SEC
+
+
+class AdmissionController:
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._pools: Dict[str, _PoolQueue] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    # ---------- 内部（持锁调用） ----------
+
+    def _count(self, cls: str, name: str) -> None:
+        per = self._counters.setdefault(
+            cls, {"admitted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+        )
+        per[name] += 1
+
+    def _pool(self, name: str, limit: int) -> _PoolQueue:
+        q = self._pools.get(name)
+        if q is None:
+            q = _PoolQueue(name)
+            self._pools[name] = q
+        q.limit = max(1, limit)
+        return q
+
+    def _estimate_wait(self, q: _PoolQueue, rank: int) -> float:
+        ahead = sum(1 for w in q.heap if not w.done and w.rank <= rank)
+        return (ahead + 1) / q.limit * q.service_sec
+
+    def _dispatch(self, q: _PoolQueue) -> None:
+        while q.active < q.limit and q.heap:
+            w = heapq.heappop(q.heap)
+            if w.done:
+                continue
+            w.done = True
+            w.granted = True
+            q.queued -= 1
+            q.active += 1
+            w.wake()
+
+    def _evict_lowest(self, q: _PoolQueue, rank: int) -> bool:
+        """队列满时挤掉优先级低于 rank 的最后一个等待者。"""
+        live = [w for w in q.heap if not w.done]
+        if not live:
+            return False
+        worst = max(live)
+        if worst.rank <= rank:
+            return False
+        worst.done = True
+        worst.rejected = True
+        q.queued -= 1
+        worst.wake()
+        return True
+
+    def _enter(
+        self,
+        pool: str,
+        limit: int,
+        cls: str,
+        max_wait: float,
+        wake: Callable[[], None],
+    ) -> Tuple[_PoolQueue, Optional[_Waiter]]:
+        """放行返回 (池, None)；需排队返回 (池, waiter)；拒绝抛 AdmissionRejected。"""
+        rank = CLASSES.index(cls) if cls in CLASSES else len(CLASSES)
+        with self._lock:
+            q = self._pool(pool, limit)
+            # 容量可能随目录变化而增加
+            self._dispatch(q)
+            if q.active < q.limit and not q.queued:
+                q.active += 1
+                self._count(cls, "admitted")
+                return q, None
+            est = self._estimate_wait(q, rank)
+            if est > max_wait:
+                self._count(cls, "shed")
+                raise AdmissionRejected(
+                    f"pool {pool or '*'} overloaded: estimated wait {est:.1f}s "
+                    f"exceeds {max_wait:.1f}s for class {cls}",
+                    retry_after=est,
+                )
+            if q.queued >= self.queue_size and not self._evict_lowest(q, rank):
+                self._count(cls, "shed")
+                raise AdmissionRejected(
+                    f"pool {pool or '*'} admission queue full", retry_after=est
+                )
+            w = _Waiter(rank, next(self._seq), wake)
+            heapq.heappush(q.heap, w)
+            q.queued += 1
+            self._count(cls, "queued")
+            return q, w
+
+    def _leave(self, q: _PoolQueue, w: _Waiter, cls: str) -> Ticket:
+        """等待结束（被唤醒或超时）后的收尾：放行返回 Ticket，否则抛 AdmissionRejected。"""
+        with self._lock:
+            if w.granted:
+                self._count(cls, "admitted")
+                return Ticket(self, q)
+            retry_after = self._estimate_wait(q, w.rank)
+            if not w.done:
+                w.done = True
+                q.queued -= 1
+                self._count(cls, "timeouts")
+            else:
+                self._count(cls, "shed")
+        raise AdmissionRejected(
+            f"pool {q.name or '*'} admission wait exceeded for class {cls}",
+            retry_after=retry_after,
+        )
+
+    def _release(self, q: _PoolQueue, duration: float) -> None:
+        with self._lock:
+            q.active = max(0, q.active - 1)
+            q.service_sec += _EWMA_ALPHA * (duration - q.service_sec)
+            self._dispatch(q)
+
+    # ---------- 对外 ----------
+
+    def admit(self, pool: str, limit: int, cls: str, max_wait: float) -> Ticket:
+        """阻塞直到放行（返回 Ticket）或被拒绝（AdmissionRejected）。"""
+        event = threading.Event()
+        q, w = self._enter(pool, limit, cls, max_wait, event.set)
+        if w is None:
+            return Ticket(self, q)
+        event.wait(max_wait)
+        return self._leave(q, w, cls)
+
+    async def aadmit(self, pool: str, limit: int, cls: str, max_wait: float) -> Ticket:
+        """admit 的 asyncio 版本：排队期间不占用事件循环。"""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+
+        q, w = self._enter(pool, limit, cls, max_wait, wake)
+        if w is None:
+            return Ticket(self, q)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 客户端断开：已放行则立即归还名额
+            try:
+                self._leave(q, w, cls).release()
+            except AdmissionRejected:
+                pass
+            raise
+        return self._leave(q, w, cls)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pools": {
+                    name or "*": {
+                        "limit": q.limit,
+                        "active": q.active,
+                        "queued": q.queued,
+                        "service_ms": round(q.service_sec * 1000, 1),
+                    }
+                    for name, q in self._pools.items()
+                },
+                "classes": {k: dict(v) for k, v in self._counters.items()},
+            }
+
+
+controller = AdmissionController()
+
+_limit_cache: Dict[str, Tuple[int, int]] = {}
+
+
+def pool_limit(model: str) -> int:
+    """本网关在该模型池上的并发名额（按目录快照版本缓存）。"""
+    snap = catalog.snapshot()
+    cached = _limit_cache.get(model)
+    if cached is not None and cached[0] == snap.version:
+        return cached[1]
+    nodes = list(snap.nodes)
+    online = [n for n in nodes if n.node_status == "online"] or nodes
+    pool = filter_pool_by_requested_model(online, model)
+    slots = sum(int(n.max_concurrency or 0) or REPLICA_SLOTS for n in pool)
+    limit = max(1, math.ceil(slots / GATEWAYS))
+    _limit_cache[model] = (snap.version, limit)
+    return limit
+
+
+def request_class(headers: Mapping[str, str]) -> str:
+    """JWT claim `priority` 优先，其次 X-Priority；未知类别归入默认类别。"""
+    claims = decode_token(headers.get("Authorization"))
+    cls = (claims or {}).get("priority") or headers.get("X-Priority") or DEFAULT_CLASS
+    cls = str(cls).strip().lower()
+    return cls if cls in CLASSES else DEFAULT_CLASS
+
+
+def _max_wait(cls: str, headers: Mapping[str, str]) -> float:
+    wait = MAX_WAIT_SEC.get(cls, DEFAULT_MAX_WAIT_SEC)
+    raw = headers.get("X-Deadline-Ms")
+    if raw:
+        try:
+            wait = min(wait, max(0.0, float(raw) / 1000))
+        except ValueError:
+            pass
+    return wait
+
+
+def _params(
+    body: Optional[Dict[str, Any]],
+    headers: Mapping[str, str],
+) -> Optional[Tuple[str, int, str, float]]:
+    if not ADMISSION_ENABLED:
+        return None
+    # 显式指定副本的请求（调试 / 运维）不排队
+    if headers.get("X-Target-Node-Id") or headers.get("X-Target-Node-ID"):
+        return None
+    model = requested_openai_model(body, headers) or ""
+    cls = request_class(headers)
+    return model, pool_limit(model), cls, _max_wait(cls, headers)
+
+
+def admit(body: Optional[Dict[str, Any]], headers: Mapping[str, str]) -> Optional[Ticket]:
+    """未开启准入控制时返回 None。"""
+    params = _params(body, headers)
+    if params is None:
+        return None
+    return controller.admit(*params)
+
+
+async def aadmit(
+    body: Optional[Dict[str, Any]],
+    headers: Mapping[str, str],
+) -> Optional[Ticket]:
+    """admit 的 asyncio 版本：池容量（目录快照可能访问 Redis）与 JWT 验签在线程池中计算，不阻塞事件循环。"""
+    if not ADMISSION_ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    params = await loop.run_in_executor(None, _params, body, headers)
+    if params is None:
+        return None
+    return await controller.aadmit(*params)
+
+
+def release(ticket: Optional[Ticket]) -> None:
+    if ticket is not None:
+        ticket.release()
+
+
+if ADMISSION_ENABLED:
+    stats.register_provider("admission", controller.stats)
@@ -0,0 +1,285 @@
+"""
+按副本的进程内熔断器（closed / open / half-open）与异常副本摘除。
+
+- 每次上游尝试以 acquire()（选定副本时原子占用 half-open 试探名额）+ begin() 开始、record() 结束：连接失败或 5xx 记为失败，其余（含 4xx）为成功；
+  耗时超过 NVLLM_BREAKER_SLOW_MS 的成功记为慢调用（非流式为完整响应耗时，流式为首字节耗时）；
+- 连续失败达到 NVLLM_BREAKER_CONSECUTIVE，或滑动窗口（NVLLM_BREAKER_WINDOW_SEC，按秒分桶）内请求数
+  不少于 NVLLM_BREAKER_MIN_REQUESTS 且失败率 / 慢调用率达到阈值时打开（摘除）；
+- 摘除时长按连续摘除次数指数退避：BASE × 2^(n-1)，上限 NVLLM_BREAKER_MAX_EJECT_SEC；恢复正常超过
+  上限时长后退避次数清零；
+- 到期后进入 half-open：最多 NVLLM_BREAKER_HALF_OPEN_PROBES 个请求同时试探，连续成功
+  NVLLM_BREAKER_HALF_OPEN_SUCCESSES 次后关闭，试探失败则再次打开；
+- 选路时按模型池过滤（filter_pool），同一池内被摘除的副本不超过 NVLLM_BREAKER_MAX_EJECT_PCT%
+  （至少可摘除 1 个），超出部分按到期时间最早者放回。
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from service import stats
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.environ.get("NVLLM_BREAKER", "0").lower() in ("1", "true", "yes")
+CONSECUTIVE_ERRORS = int(os.environ.get("NVLLM_BREAKER_CONSECUTIVE", "5"))
+WINDOW_SEC = max(1, int(os.environ.get("NVLLM_BREAKER_WINDOW_SEC", "10")))
+MIN_REQUESTS = max(1, int(os.environ.get("NVLLM_BREAKER_MIN_REQUESTS", "20")))
+ERROR_RATE = float(os.environ.get("NVLLM_BREAKER_ERROR_RATE", "0.5"))
+SLOW_CALL_SEC = float(os.environ.get("NVLLM_BREAKER_SLOW_MS", "0")) / 1000
+SLOW_CALL_RATE = float(os.environ.get("NVLLM_BREAKER_SLOW_RATE", "0.5"))
+BASE_EJECT_SEC = float(os.environ.get("NVLLM_BREAKER_BASE_EJECT_SEC", "5"))
+MAX_EJECT_SEC = float(os.environ.get("NVLLM_BREAKER_MAX_EJECT_SEC", "300"))
+MAX_EJECT_PCT = float(os.environ.get("NVLLM_BREAKER_MAX_EJECT_PCT", "50"))
+HALF_OPEN_PROBES = max(1, int(os.environ.get("NVLLM_BREAKER_HALF_OPEN_PROBES", "1")))
+HALF_OPEN_SUCCESSES = max(
+    1, int(os.environ.get("NVLLM_BREAKER_HALF_OPEN_SUCCESSES", "2"))
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    __slots__ = (
+        "state",
+        "consecutive",
+        "buckets",
+        "ejections",
+        "open_until",
+        "closed_at",
+        "probes",
+        "probe_successes",
+    )
+
+    def __init__(self):
+        self.state = CLOSED
+        self.consecutive = 0
+        # 每秒一个桶：[秒, 请求数, 失败数, 慢调用数]
+        self.buckets: List[List[int]] = [[-1, 0, 0, 0] for _ in range(WINDOW_SEC)]
+        self.ejections = 0
+        self.open_until = 0.0
+        self.closed_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+
+    def add(self, now: float, failed: bool, slow: bool) -> None:
+        sec = int(now)
+        bucket = self.buckets[sec % WINDOW_SEC]
+        if bucket[0] != sec:
+            bucket[:] = [sec, 0, 0, 0]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+
+    def window(self, now: float):
+        oldest = int(now) - WINDOW_SEC + 1
+        total = errors = slow = 0
+        for sec, n, e, s in self.buckets:
+            if sec >= oldest:
+                total += n
+                errors += e
+                slow += s
+        return total, errors, slow
+
+    def reset_window(self) -> None:
+        for bucket in self.buckets:
+            bucket[:] = [-1, 0, 0, 0]
+
+
+_breakers: Dict[str, _Breaker] = {}
+_lock = threading.Lock()
+_metrics: Dict[str, int] = {
+    "ejections": 0,
+    "reinstated": 0,
+    "rejected": 0,
+    "eject_limit_overrides": 0,
+}
+
+
+def _get(node_id: str) -> _Breaker:
+    b = _breakers.get(node_id)
+    if b is None:
+        b = _Breaker()
+        _breakers[node_id] = b
+    return b
+
+
+def _open(node_id: str, b: _Breaker, now: float, reason: str) -> None:
+    if b.state == CLOSED and now - b.closed_at > MAX_EJECT_SEC:
+        b.ejections = 0
+    b.ejections += 1
+    eject = min(MAX_EJECT_SEC, BASE_EJECT_SEC * 2 ** (b.ejections - 1))
+    b.state = OPEN
+    b.open_until = now + eject
+    b.probes = 0
+    b.probe_successes = 0
+    _metrics["ejections"] += 1
+    logger.warning(
+        "circuit opened node=%s reason=%s eject_sec=%.1f", node_id, reason, eject
+    )
+
+
+def _close(node_id: str, b: _Breaker, now: float) -> None:
+    b.state = CLOSED
+    b.consecutive = 0
+    b.closed_at = now
+    b.probes = 0
+    b.reset_window()
+    _metrics["reinstated"] += 1
+    logger.info("circuit closed node=%s", node_id)
+
+
+def _available(b: Optional[_Breaker], now: float) -> bool:
+    if b is None or b.state == CLOSED:
+        return True
+    if b.state == OPEN:
+        if now < b.open_until:
+            return False
+        b.state = HALF_OPEN
+        b.probes = 0
+        b.probe_successes = 0
+    return b.probes < HALF_OPEN_PROBES
+
+
+def filter_pool(pool: Sequence[Any]) -> List[Any]:
+    """过滤掉被摘除（或试探名额已满）的副本；同一池内摘除比例受 NVLLM_BREAKER_MAX_EJECT_PCT 限制。"""
+    if not BREAKER_ENABLED or not pool:
+        return list(pool)
+    now = time.monotonic()
+    with _lock:
+        allowed = []
+        ejected = []
+        for n in pool:
+            b = _breakers.get(n.node_id)
+            if _available(b, now):
+                allowed.append(n)
+            else:
+                ejected.append((b.open_until if b.state == OPEN else now, n))
+        max_ejected = max(1, math.floor(len(pool) * MAX_EJECT_PCT / 100))
+        if len(ejected) > max_ejected:
+            ejected.sort(key=lambda item: item[0])
+            restore = len(ejected) - max_ejected
+            allowed.extend(n for _, n in ejected[:restore])
+            _metrics["eject_limit_overrides"] += restore
+        _metrics["rejected"] += len(pool) - len(allowed)
+    return allowed
+
+
+def allows(node: Any) -> bool:
+    """单个副本（粘性 trace）是否可用。"""
+    if not BREAKER_ENABLED:
+        return True
+    with _lock:
+        return _available(_breakers.get(node.node_id), time.monotonic())
+
+
+def acquire(node: Any) -> bool:
+    """
+    选定副本时调用：half-open 时原子占用一个试探名额，名额已满返回 False（调用方换下一个候选）。
+    filter_pool 只是预筛，并发请求可能同时通过，名额以此处为准。
+    """
+    if not BREAKER_ENABLED:
+        return True
+    now = time.monotonic()
+    with _lock:
+        b = _breakers.get(node.node_id)
+        if b is None or b.state == CLOSED:
+            return True
+        if b.state == OPEN and now >= b.open_until:
+            _available(b, now)
+        if b.state != HALF_OPEN:
+            # 仍在摘除期（按 NVLLM_BREAKER_MAX_EJECT_PCT 放回的副本）：不占试探名额
+            return True
+        if b.probes >= HALF_OPEN_PROBES:
+            _metrics["rejected"] += 1
+            return False
+        b.probes += 1
+        return True
+
+
+def begin(node: Any) -> float:
+    """一次上游尝试开始（已经 acquire）；返回起始时间供 record 计算耗时。"""
+    return time.monotonic()
+
+
+def record(node: Any, started: float, ok: bool, elapsed: Optional[float] = None) -> None:
+    """一次上游尝试结束：ok=False 为连接失败或 5xx；elapsed 缺省为自 begin 起的耗时。"""
+    if not BREAKER_ENABLED:
+        return
+    now = time.monotonic()
+    if elapsed is None:
+        elapsed = now - started
+    slow = ok and SLOW_CALL_SEC > 0 and elapsed > SLOW_CALL_SEC
+    with _lock:
+        b = _get(node.node_id)
+        if b.state == OPEN:
+            # 打开前已发出的请求
+            return
+        if b.state == HALF_OPEN:
+            b.probes = max(0, b.probes - 1)
+            if not ok or slow:
+                _open(node.node_id, b, now, "half-open probe failed")
+                return
+            b.probe_successes += 1
+            if b.probe_successes >= HALF_OPEN_SUCCESSES:
+                _close(node.node_id, b, now)
+            return
+        b.add(now, not ok, slow)
+        b.consecutive = 0 if ok else b.consecutive + 1
+        if CONSECUTIVE_ERRORS > 0 and b.consecutive >= CONSECUTIVE_ERRORS:
+            _open(node.node_id, b, now, f"{b.consecutive} consecutive errors")
+            return
+        total, errors, slow_calls = b.window(now)
+        if total < MIN_REQUESTS:
+            return
+        if errors / total >= ERROR_RATE:
+            _open(node.node_id, b, now, f"error rate {errors}/{total}")
+        elif SLOW_CALL_SEC > 0 and slow_calls / total >= SLOW_CALL_RATE:
+            _open(node.node_id, b, now, f"slow call rate {slow_calls}/{total}")
+
+
+def abandon(node: Any) -> None:
+    """尝试被主动取消（如对冲落败）：不计成败，只归还 half-open 试探名额。"""
+    if not BREAKER_ENABLED:
+        return
+    with _lock:
+        b = _breakers.get(node.node_id)
+        if b is not None and b.state == HALF_OPEN:
+            b.probes = max(0, b.probes - 1)
+
+
+def forget_node(node_id: str) -> None:
+    with _lock:
+        _breakers.pop(node_id, None)
+
+
+def get_stats() -> Dict[str, Any]:
+    now = time.monotonic()
+    with _lock:
+        out: Dict[str, Any] = dict(_metrics)
+        nodes: Dict[str, Any] = {}
+        for node_id, b in _breakers.items():
+            total, errors, slow = b.window(now)
+            nodes[node_id] = {
+                "state": b.state,
+                "consecutive_errors": b.consecutive,
+                "window_requests": total,
+                "window_errors": errors,
+                "window_slow": slow,
+                "ejections": b.ejections,
+                "open_for_sec": round(max(0.0, b.open_until - now), 1)
+                if b.state == OPEN
+                else 0.0,
+            }
+        out["nodes"] = nodes
+    return out
+
+
+if BREAKER_ENABLED:
+    stats.register_provider("breaker", get_stats)
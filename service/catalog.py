@@ -0,0 +1,761 @@
+"""
+进程内副本目录快照：请求路径只读不可变快照，仅在目录实际变化时访问 Redis。
+
+- 每个副本一个 Redis Hash（NVLLM_CATALOG_NODE_PREFIX + node_id，每个属性一个字段，含 revision），
+  登记顺序保存在有序集合 NVLLM_CATALOG_INDEX_KEY；
+- 写路径（register / update / delete）由 Lua 脚本原子修改副本 Hash 并 INCR 目录版本号，随后 PUBLISH
+  变更事件（版本号 + node_id）；update 只写入取值变化的字段，可按 revision 比较后写入（CAS），
+  无变化时不推进版本号；批量写入在一个 MULTI 事务中执行，整批只发布一条事件（带起始版本 base）；
+- 订阅线程收到事件后按 node_id 增量刷新（仅 HGETALL 变更条目），版本不连续时整表重载；
+- 旧版整条 JSON 目录（Hash `nodes`）在首次加载时迁移到新格式；
+- 每次版本变化记录 (起始版本, 新版本, 变更 / 删除的 node_id) 到有界历史，供 watch 接口按版本计算增量
+  （changes_since / wait_for_change）；
+- 订阅未启动或断开时，请求路径按 NVLLM_CATALOG_POLL_MS 节流比对版本号，变化才重载；
+- 侧车心跳（service.heartbeat）只替换快照中的 node_info，不推进版本号；覆盖在有效期内优先于目录记录，
+  快照另存未覆盖的目录记录，覆盖过期后（下一次读取快照时）恢复为目录中的 node_info。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from middleware.redis_client import redis_cli
+from model.node import Node, NodeInfo
+
+logger = logging.getLogger(__name__)
+
+# 旧版目录：Hash nodes，field 为 node_id、value 为整条 JSON（仅用于迁移）
+LEGACY_CATALOG_KEY = "nodes"
+CATALOG_NODE_PREFIX = os.environ.get("NVLLM_CATALOG_NODE_PREFIX", "nvllm:node:")
+CATALOG_INDEX_KEY = os.environ.get("NVLLM_CATALOG_INDEX_KEY", "nvllm:catalog:index")
+CATALOG_VERSION_KEY = os.environ.get(
+    "NVLLM_CATALOG_VERSION_KEY", "nvllm:catalog:version"
+)
+CATALOG_CHANNEL = os.environ.get("NVLLM_CATALOG_CHANNEL", "nvllm:catalog:events")
+
+# 无订阅时请求路径比对版本号的最小间隔
+CATALOG_POLL_SEC = float(os.environ.get("NVLLM_CATALOG_POLL_MS", "1000")) / 1000.0
+# 有订阅时的兜底校验间隔（防止漏收事件导致长期不一致）
+CATALOG_MAX_STALE_SEC = float(os.environ.get("NVLLM_CATALOG_MAX_STALE_SEC", "30"))
+CATALOG_WATCH = os.environ.get("NVLLM_CATALOG_WATCH", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# watch 增量历史保留的版本变更条数；更早的 since 需全量同步
+CATALOG_HISTORY = max(1, int(os.environ.get("NVLLM_CATALOG_HISTORY", "1024")))
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+# KEYS: 副本 Hash、登记顺序索引、版本号；ARGV: node_id、期望 revision（空为不比较）、字段/值…
+# 整条覆盖，保留原 create_time；返回 {状态, revision, 目录版本, HGETALL}，状态 -2 为 revision 不符
+_UPSERT_LUA = """
+local rev = tonumber(redis.call('HGET', KEYS[1], 'revision') or '0')
+if ARGV[2] ~= '' and tonumber(ARGV[2]) ~= rev then
+  return {-2, rev, 0, {}}
+end
+local created = redis.call('HGET', KEYS[1], 'create_time')
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'revision', rev + 1, unpack(ARGV, 3))
+if created then
+  redis.call('HSET', KEYS[1], 'create_time', created)
+end
+local v = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[2], 'NX', v, ARGV[1])
+return {1, rev + 1, v, redis.call('HGETALL', KEYS[1])}
+"""
+
+# KEYS: 副本 Hash、版本号；ARGV: 期望 revision（空为不比较）、update_time、字段/值…
+# 只写取值变化的字段；返回 {状态, revision, 目录版本, HGETALL}：-1 不存在，-2 revision 不符，0 无变化
+_PATCH_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return {-1, 0, 0, {}}
+end
+local rev = tonumber(redis.call('HGET', KEYS[1], 'revision') or '0')
+if ARGV[1] ~= '' and tonumber(ARGV[1]) ~= rev then
+  return {-2, rev, 0, {}}
+end
+local changed = {}
+for i = 3, #ARGV, 2 do
+  if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+    changed[#changed + 1] = ARGV[i]
+    changed[#changed + 1] = ARGV[i + 1]
+  end
+end
+if #changed == 0 then
+  return {0, rev, 0, redis.call('HGETALL', KEYS[1])}
+end
+redis.call('HSET', KEYS[1], 'revision', rev + 1, 'update_time', ARGV[2], unpack(changed))
+local v = redis.call('INCR', KEYS[2])
+return {1, rev + 1, v, redis.call('HGETALL', KEYS[1])}
+"""
+
+
+class NodeNotFound(LookupError):
+    pass
+
+
+class RevisionConflict(Exception):
+    """期望 revision 与当前不符；current 为当前 revision。"""
+
+    def __init__(self, node_id: str, current: int):
+        super().__init__(f"revision mismatch for node {node_id}: current {current}")
+        self.current = current
+
+
+def node_key(node_id: str) -> str:
+    return CATALOG_NODE_PREFIX + node_id
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    某一目录版本下的只读视图；替换而非修改，读方无需加锁。
+    nodes 保持 Redis 中的登记顺序，by_id 供按 node_id 直接查找（均已叠加心跳覆盖）；
+    records 为未叠加覆盖的目录记录，增量与覆盖变化都从它重建。
+    """
+    version: int
+    nodes: Tuple[Node, ...] = ()
+    by_id: Mapping[str, Node] = field(default_factory=lambda: MappingProxyType({}))
+    records: Mapping[str, Node] = field(default_factory=lambda: MappingProxyType({}))
+
+    def get(self, node_id: Optional[str]) -> Optional[Node]:
+        if not node_id:
+            return None
+        return self.by_id.get(node_id)
+
+
+def _build(version: int, records: Dict[str, Node]) -> CatalogSnapshot:
+    """由目录记录构建快照并叠加未过期的心跳覆盖；沿用上一快照中相同的覆盖结果（保持对象身份）。"""
+    global _load_expiry
+    by_id = records
+    _load_expiry = math.inf
+    if _load:
+        now = time.monotonic()
+        prev = _snapshot
+        by_id = dict(records)
+        for node_id, (until, info) in _load.items():
+            node = records.get(node_id)
+            if node is None or until <= now:
+                continue
+            _load_expiry = min(_load_expiry, until)
+            current = prev.by_id.get(node_id) if prev is not None else None
+            if (
+                current is not None
+                and current.node_info is info
+                and prev.records.get(node_id) is node
+            ):
+                by_id[node_id] = current
+            else:
+                by_id[node_id] = replace(node, node_info=info)
+    return CatalogSnapshot(
+        version=version,
+        nodes=tuple(by_id.values()),
+        by_id=MappingProxyType(by_id),
+        records=MappingProxyType(records),
+    )
+
+
+def decode_node(raw: Any) -> Optional[Node]:
+    """解析一条目录记录（副本 Hash 或旧版 JSON）；不存在或非法记录返回 None。"""
+    if not raw:
+        return None
+    try:
+        return Node.from_fields(raw) if isinstance(raw, dict) else Node.from_dict(raw)
+    except (TypeError, ValueError, KeyError) as e:
+        logger.warning("skip invalid node record: %s", e)
+        return None
+
+
+def load_nodes_from_redis() -> List[Node]:
+    """直接读取整张目录（不经快照），供控制面与快照重载使用。"""
+    return list(_load_all()[1].values())
+
+
+def load_node(node_id: str) -> Optional[Node]:
+    """直接读取一条目录记录（不经快照）。"""
+    _migrate_legacy()
+    return decode_node(redis_cli.client.hgetall(node_key(node_id)))
+
+
+def _load_all() -> Tuple[int, Dict[str, Node]]:
+    _migrate_legacy()
+    pipe = redis_cli.client.pipeline(transaction=True)
+    pipe.get(CATALOG_VERSION_KEY)
+    pipe.zrange(CATALOG_INDEX_KEY, 0, -1)
+    raw_version, ids = pipe.execute()
+    pipe = redis_cli.client.pipeline(transaction=False)
+    for node_id in ids:
+        pipe.hgetall(node_key(node_id))
+    by_id: Dict[str, Node] = {}
+    for raw in pipe.execute() if ids else ():
+        node = decode_node(raw)
+        if node is not None:
+            by_id[node.node_id] = node
+    return _as_version(raw_version), by_id
+
+
+_migrated = False
+
+
+def _migrate_legacy() -> None:
+    """把旧版 Hash nodes 中的整条 JSON 拆成副本 Hash；HSETNX 不覆盖已按新格式写入的字段，可重复执行。"""
+    global _migrated
+    if _migrated:
+        return
+    legacy = redis_cli.client.hgetall(LEGACY_CATALOG_KEY)
+    if legacy:
+        pipe = redis_cli.client.pipeline(transaction=True)
+        for i, raw in enumerate(legacy.values()):
+            node = decode_node(raw)
+            if node is None:
+                continue
+            key = node_key(node.node_id)
+            for name, value in {**node.to_fields(), "revision": "1"}.items():
+                pipe.hsetnx(key, name, value)
+            # 负分数：迁移的副本排在新登记的副本之前，保持原有顺序
+            pipe.zadd(CATALOG_INDEX_KEY, {node.node_id: i - len(legacy)}, nx=True)
+        pipe.delete(LEGACY_CATALOG_KEY)
+        pipe.incr(CATALOG_VERSION_KEY)
+        pipe.execute()
+        logger.info("migrated %d legacy catalog records", len(legacy))
+    _migrated = True
+
+
+def _as_version(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+_snapshot: Optional[CatalogSnapshot] = None
+_lock = threading.Lock()
+_verified_at = 0.0
+_watching = threading.Event()
+
+# 心跳负载覆盖：node_id -> (monotonic 过期时刻, NodeInfo)
+_load: Dict[str, Tuple[float, NodeInfo]] = {}
+# 当前快照中最早到期的覆盖（monotonic）；到期后读取快照时回退为目录记录
+_load_expiry = math.inf
+
+# 版本变更历史：(起始版本, 新版本, 新增或变更的 node_id, 删除的 node_id)
+_history: Deque[Tuple[int, int, Tuple[str, ...], Tuple[str, ...]]] = deque(
+    maxlen=CATALOG_HISTORY
+)
+# 版本号变化时通知 watch 等待者
+_changed = threading.Condition()
+
+# 变更监听：listener(old, new)，删除时 new 为 None；在快照替换后同步调用，须快速返回
+_listeners: List[Callable[[Node, Optional[Node]], None]] = []
+
+
+def add_listener(fn: Callable[[Node, Optional[Node]], None]) -> None:
+    """注册目录变更回调（连接池、熔断器等按 node_id 维护状态的组件使用）。"""
+    _listeners.append(fn)
+
+
+def _notify(old: Optional[CatalogSnapshot], new: CatalogSnapshot) -> None:
+    if not _listeners or old is None:
+        return
+    for node_id, before in old.by_id.items():
+        after = new.by_id.get(node_id)
+        if after is before:
+            continue
+        for fn in _listeners:
+            try:
+                fn(before, after)
+            except Exception:
+                logger.exception("catalog listener failed node=%s", node_id)
+
+
+def _install(snap: CatalogSnapshot) -> CatalogSnapshot:
+    global _snapshot, _verified_at
+    old = _snapshot
+    _snapshot = snap
+    _verified_at = time.monotonic()
+    if old is not None and old.version != snap.version:
+        _record_history(old, snap)
+    _notify(old, snap)
+    return snap
+
+
+def _record_history(old: CatalogSnapshot, new: CatalogSnapshot) -> None:
+    if new.version < old.version:
+        # Redis 被清空或回滚：旧历史不再可信
+        _history.clear()
+    else:
+        changed = tuple(i for i, n in new.by_id.items() if old.by_id.get(i) is not n)
+        deleted = tuple(i for i in old.by_id if i not in new.by_id)
+        _history.append((old.version, new.version, changed, deleted))
+    with _changed:
+        _changed.notify_all()
+
+
+def changes_since(
+    version: int,
+) -> Optional[Tuple[CatalogSnapshot, List[Node], List[str]]]:
+    """
+    自 version 以来的增量：(当前快照, 新增或变更且仍存在的副本, 已删除的 node_id)。
+    历史不足以覆盖（过旧、进程刚启动或版本回退）时返回 None，调用方应全量同步。
+    """
+    with _lock:
+        snap = _snapshot
+        history = list(_history)
+    if snap is None or version > snap.version:
+        return None
+    if version == snap.version:
+        return snap, [], []
+    entries = [e for e in history if e[1] > version]
+    if not entries or entries[0][0] > version:
+        return None
+    ids = dict.fromkeys(i for e in entries for i in e[2] + e[3])
+    upserts = [snap.by_id[i] for i in ids if i in snap.by_id]
+    deletes = [i for i in ids if i not in snap.by_id]
+    return snap, upserts, deletes
+
+
+def wait_for_change(version: int, timeout: float) -> CatalogSnapshot:
+    """阻塞至目录版本不等于 version 或超时，返回当前快照（未订阅时按 NVLLM_CATALOG_POLL_MS 校验版本号）。"""
+    deadline = time.monotonic() + timeout
+    while True:
+        snap = snapshot()
+        remaining = deadline - time.monotonic()
+        if snap.version != version or remaining <= 0:
+            return snap
+        with _changed:
+            current = _snapshot
+            if current is not None and current.version != version:
+                continue
+            if not _watching.is_set():
+                remaining = min(remaining, CATALOG_POLL_SEC)
+            _changed.wait(remaining)
+
+
+def reload() -> CatalogSnapshot:
+    """整表重载（阻塞），返回新快照。"""
+    with _lock:
+        version, by_id = _load_all()
+        return _install(_build(version, by_id))
+
+
+def snapshot() -> CatalogSnapshot:
+    """
+    请求路径入口：返回当前快照。
+    仅在超过校验间隔时读取一次版本号，版本变化才整表重载；并发请求不会同时重载。
+    """
+    snap = _snapshot
+    if snap is None:
+        try:
+            return reload()
+        except Exception as e:
+            logger.error("catalog initial load failed: %s", e)
+            return _build(0, {})
+    now = time.monotonic()
+    if _load_expiry <= now:
+        snap = _expire_load(snap)
+    interval = CATALOG_MAX_STALE_SEC if _watching.is_set() else CATALOG_POLL_SEC
+    if now - _verified_at < interval:
+        return snap
+    return _revalidate(snap)
+
+
+def _revalidate(snap: CatalogSnapshot) -> CatalogSnapshot:
+    global _verified_at
+    if not _lock.acquire(blocking=False):
+        return snap
+    try:
+        try:
+            version = _as_version(redis_cli.client.get(CATALOG_VERSION_KEY))
+        except Exception as e:
+            logger.warning("catalog version check failed, serving cached: %s", e)
+            _verified_at = time.monotonic()
+            return snap
+        if version == snap.version:
+            _verified_at = time.monotonic()
+            return snap
+        version, by_id = _load_all()
+        return _install(_build(version, by_id))
+    except Exception as e:
+        logger.warning("catalog reload failed, serving cached: %s", e)
+        return snap
+    finally:
+        _lock.release()
+
+
+def _drop_expired_load(now: float) -> List[str]:
+    expired = [k for k, (until, _) in _load.items() if until <= now]
+    for node_id in expired:
+        del _load[node_id]
+    return expired
+
+
+def _expire_load(snap: CatalogSnapshot) -> CatalogSnapshot:
+    """移除过期覆盖并从目录记录重建快照（不阻塞：其它线程持锁时沿用当前快照）。"""
+    global _verified_at
+    if not _lock.acquire(blocking=False):
+        return snap
+    try:
+        snap = _snapshot or snap
+        _drop_expired_load(time.monotonic())
+        verified_at = _verified_at
+        snap = _install(_build(snap.version, dict(snap.records)))
+        # 只是覆盖到期，不代表已与 Redis 校验过版本号
+        _verified_at = verified_at
+        return snap
+    finally:
+        _lock.release()
+
+
+def apply_load(infos: Mapping[str, Tuple[float, NodeInfo]]) -> None:
+    """
+    心跳负载覆盖：infos 为 node_id -> (monotonic 过期时刻, NodeInfo)。
+    替换当前快照中对应副本的 node_info（版本号不变），之后的重载在过期前也沿用该覆盖；
+    过期后快照恢复为目录记录中的 node_info。
+    """
+    global _verified_at
+    if not infos:
+        return
+    with _lock:
+        _drop_expired_load(time.monotonic())
+        _load.update(infos)
+        snap = _snapshot
+        if snap is None or not any(node_id in snap.records for node_id in infos):
+            return
+        verified_at = _verified_at
+        _install(_build(snap.version, dict(snap.records)))
+        _verified_at = verified_at
+
+
+def _apply_delta(
+    version: int,
+    upserts: Mapping[str, Node],
+    deletes: Iterable[str],
+) -> None:
+    """在快照上应用增量；调用方须持有 _lock。"""
+    snap = _snapshot
+    if snap is None:
+        return
+    by_id = dict(snap.records)
+    for node_id in deletes:
+        by_id.pop(node_id, None)
+    by_id.update(upserts)
+    _install(_build(version, by_id))
+
+
+def _publish(
+    version: int, op: str, node_ids: List[str], base: Optional[int] = None
+) -> None:
+    # base：事件覆盖的起始版本（批量写入一次推进多个版本），缺省为 version - 1
+    evt: Dict[str, Any] = {"v": version, "op": op, "ids": node_ids}
+    if base is not None and base != version - 1:
+        evt["base"] = base
+    try:
+        redis_cli.client.publish(CATALOG_CHANNEL, json.dumps(evt))
+    except Exception as e:
+        # 订阅方会通过版本号兜底校验追上
+        logger.warning("catalog publish failed version=%s: %s", version, e)
+
+
+_scripts: Dict[str, Any] = {}
+
+
+def _script(body: str):
+    script = _scripts.get(body)
+    if script is None:
+        script = redis_cli.client.register_script(body)
+        _scripts[body] = script
+    return script
+
+
+def _committed(node_id: str, result: List[Any]) -> Tuple[int, Optional[Node]]:
+    """解析脚本返回值：(目录版本, 写入后的记录)；目录版本为 0 表示未写入。"""
+    status, revision, version, raw = int(result[0]), int(result[1]), int(result[2]), result[3]
+    if status == -1:
+        raise NodeNotFound(node_id)
+    if status == -2:
+        raise RevisionConflict(node_id, revision)
+    fields = dict(zip(raw[::2], raw[1::2]))
+    return version, decode_node(fields)
+
+
+def _as_revision(expected_revision: Optional[int]) -> str:
+    return "" if expected_revision is None else str(int(expected_revision))
+
+
+def commit_upsert(node: Node, expected_revision: Optional[int] = None) -> Node:
+    """写入/覆盖一条目录记录（保留原 create_time）并推进版本号；返回写入后的记录。"""
+    result = commit_upsert_many([(node, expected_revision)])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def commit_upsert_many(
+    items: Sequence[Tuple[Node, Optional[int]]],
+) -> List[Union[Node, Exception]]:
+    """
+    批量登记：(记录, 期望 revision) 在同一个 MULTI 事务中逐条执行登记脚本，整批只发布一条事件。
+    返回与输入一一对应的写入后记录，或该条的异常（RevisionConflict 等）。
+    """
+    _migrate_legacy()
+    if not items:
+        return []
+    script = _script(_UPSERT_LUA)
+    pipe = redis_cli.client.pipeline(transaction=True)
+    for node, expected in items:
+        fields = node.to_fields()
+        fields.pop("revision", None)
+        args: List[Any] = [node.node_id, _as_revision(expected)]
+        for name, value in fields.items():
+            args += (name, value)
+        script(
+            keys=[node_key(node.node_id), CATALOG_INDEX_KEY, CATALOG_VERSION_KEY],
+            args=args,
+            client=pipe,
+        )
+    results: List[Union[Node, Exception]] = []
+    written: Dict[str, Node] = {}
+    versions: List[int] = []
+    for (node, _), raw in zip(items, pipe.execute(raise_on_error=False)):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            version, stored = _committed(node.node_id, raw)
+        except Exception as e:
+            results.append(e)
+            continue
+        stored = stored or node
+        written[node.node_id] = stored
+        versions.append(version)
+        results.append(stored)
+    _after_commit(versions, OP_UPSERT, written, ())
+    return results
+
+
+def commit_patch(
+    node_id: str,
+    fields: Mapping[str, str],
+    expected_revision: Optional[int] = None,
+) -> Node:
+    """
+    部分更新：只写入取值变化的字段（无变化时不推进版本号、不发布事件）。
+    副本不存在抛 NodeNotFound，revision 不符抛 RevisionConflict；返回更新后的记录。
+    """
+    result = commit_patch_many([(node_id, fields, expected_revision)])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def commit_patch_many(
+    items: Sequence[Tuple[str, Mapping[str, str], Optional[int]]],
+) -> List[Union[Node, Exception]]:
+    """批量部分更新：(node_id, 字段, 期望 revision) 在同一个 MULTI 事务中执行，返回值同 commit_upsert_many。"""
+    _migrate_legacy()
+    if not items:
+        return []
+    script = _script(_PATCH_LUA)
+    now = datetime.now().isoformat()
+    pipe = redis_cli.client.pipeline(transaction=True)
+    for node_id, fields, expected in items:
+        args: List[Any] = [_as_revision(expected), now]
+        for name, value in fields.items():
+            args += (name, value)
+        script(keys=[node_key(node_id), CATALOG_VERSION_KEY], args=args, client=pipe)
+    results: List[Union[Node, Exception]] = []
+    written: Dict[str, Node] = {}
+    versions: List[int] = []
+    for (node_id, _, _), raw in zip(items, pipe.execute(raise_on_error=False)):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            version, stored = _committed(node_id, raw)
+            if stored is None:
+                raise NodeNotFound(node_id)
+        except Exception as e:
+            results.append(e)
+            continue
+        if version:
+            written[node_id] = stored
+            versions.append(version)
+        results.append(stored)
+    _after_commit(versions, OP_UPSERT, written, ())
+    return results
+
+
+def commit_delete(node_id: str) -> int:
+    """删除一条目录记录并推进版本号；返回新版本。"""
+    return _delete([node_id])[1]
+
+
+def commit_delete_many(node_ids: Sequence[str]) -> List[bool]:
+    """批量删除（同一个 MULTI 事务）；返回每条删除前是否存在。"""
+    return _delete(node_ids)[0]
+
+
+def _delete(node_ids: Sequence[str]) -> Tuple[List[bool], int]:
+    _migrate_legacy()
+    if not node_ids:
+        return [], 0
+    pipe = redis_cli.client.pipeline(transaction=True)
+    for node_id in node_ids:
+        pipe.delete(node_key(node_id))
+        pipe.zrem(CATALOG_INDEX_KEY, node_id)
+        pipe.incr(CATALOG_VERSION_KEY)
+    raw = pipe.execute()
+    existed = [bool(raw[i]) for i in range(0, len(raw), 3)]
+    versions = [int(raw[i]) for i in range(2, len(raw), 3)]
+    _after_commit(versions, OP_DELETE, {}, node_ids)
+    return existed, versions[-1]
+
+
+def _after_commit(
+    versions: List[int],
+    op: str,
+    upserts: Mapping[str, Node],
+    deletes: Sequence[str],
+) -> None:
+    """一次事务内的版本号连续：本进程按 (base, last] 应用增量，并只发布一条事件。"""
+    if not versions:
+        return
+    base, last = min(versions) - 1, max(versions)
+    _on_local_commit(last, upserts, deletes, base)
+    ids = list(upserts) if op == OP_UPSERT else list(dict.fromkeys(deletes))
+    _publish(last, op, ids, base)
+
+
+def _on_local_commit(
+    version: int,
+    upserts: Mapping[str, Node],
+    deletes: Iterable[str],
+    base: Optional[int] = None,
+) -> None:
+    # 本进程的写立即可见；版本不连续（其它实例并发写）则下次校验时重载
+    global _verified_at
+    with _lock:
+        snap = _snapshot
+        if snap is None:
+            return
+        if (version - 1 if base is None else base) == snap.version:
+            _apply_delta(version, upserts, deletes)
+        else:
+            _verified_at = 0.0
+
+
+def _on_event(data: Any) -> None:
+    try:
+        evt = json.loads(data)
+        version = int(evt["v"])
+        base = int(evt.get("base", version - 1))
+        op = evt.get("op")
+        ids = [str(i) for i in evt.get("ids") or []]
+    except (TypeError, ValueError, KeyError) as e:
+        logger.warning("bad catalog event %r: %s", data, e)
+        return
+
+    with _lock:
+        snap = _snapshot
+        if snap is None or version <= snap.version:
+            return
+        if base != snap.version:
+            logger.info(
+                "catalog version gap local=%s event=%s, full reload",
+                snap.version,
+                version,
+            )
+            loaded, by_id = _load_all()
+            _install(_build(loaded, by_id))
+            return
+        if op == OP_DELETE:
+            _apply_delta(version, {}, ids)
+            return
+        pipe = redis_cli.client.pipeline(transaction=False)
+        for node_id in ids:
+            pipe.hgetall(node_key(node_id))
+        upserts: Dict[str, Node] = {}
+        deletes: List[str] = []
+        for node_id, raw in zip(ids, pipe.execute()):
+            node = decode_node(raw)
+            if node is None:
+                deletes.append(node_id)
+            else:
+                upserts[node_id] = node
+        _apply_delta(version, upserts, deletes)
+
+
+def _watch_loop() -> None:
+    global _verified_at
+    backoff = 1.0
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_cli.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CATALOG_CHANNEL)
+            _watching.set()
+            # 订阅建立前可能漏掉事件：强制下一次请求校验版本号
+            _verified_at = 0.0
+            backoff = 1.0
+            while True:
+                msg = pubsub.get_message(timeout=1.0)
+                if msg and msg.get("type") == "message":
+                    try:
+                        _on_event(msg.get("data"))
+                    except Exception:
+                        logger.exception("catalog event apply failed")
+        except Exception as e:
+            logger.warning("catalog watcher disconnected: %s", e)
+        finally:
+            _watching.clear()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+_watch_started = False
+_watch_start_lock = threading.Lock()
+
+
+def start_catalog_watcher() -> None:
+    """在进程启动时调用：订阅目录变更事件（NVLLM_CATALOG_WATCH=0 时仅靠版本号轮询）。"""
+    global _watch_started
+    if not CATALOG_WATCH:
+        return
+    with _watch_start_lock:
+        if _watch_started:
+            return
+        t = threading.Thread(
+            target=_watch_loop,
+            daemon=True,
+            name="nvllm-catalog-watch",
+        )
+        t.start()
+        _watch_started = True
+        logger.info("catalog watcher started channel=%s", CATALOG_CHANNEL)
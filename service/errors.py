@@ -4,9 +4,27 @@
 class NoBackendError(Exception):
     """
     无可派发的后端副本。
-    code 约定：NO_REGISTRY / NO_MODEL_POOL / ALL_UNHEALTHY / TARGET_NOT_FOUND / TARGET_UNHEALTHY
+    code 约定：NO_REGISTRY / NO_MODEL_POOL / ALL_UNHEALTHY / TARGET_NOT_FOUND / TARGET_UNHEALTHY /
+    ALL_SATURATED（候选副本均已达到 max_concurrency）/ OVERLOADED（准入控制拒绝，见 AdmissionRejected）/
+    RATE_LIMITED（租户限流，见 RateLimited）
     """
 
     def __init__(self, message: str, code: str = "NO_BACKEND"):
         super().__init__(message)
         self.code = code
+
+
+class AdmissionRejected(NoBackendError):
+    """网关准入排队已满或预计等待超过截止时间；API 层返回 429 与 Retry-After（秒）。"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message, "OVERLOADED")
+        self.retry_after = retry_after
+
+
+class RateLimited(NoBackendError):
+    """租户超出请求数或 token 配额；API 层返回 429 与 Retry-After（秒）。"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message, "RATE_LIMITED")
+        self.retry_after = retry_after
@@ -0,0 +1,129 @@
+"""
+带权一致性哈希环（虚拟节点）：前缀亲和的键 -> 副本映射。
+
+- 每个副本按权重放置 NVLLM_HASHRING_VNODES × weight 个虚拟点，点位只由 node_id 决定；
+- 增删 / 健康摘除一个副本时，只有落在该副本点位上的键（约 1/N）迁移，其余前缀的 KV 局部性不受影响；
+- 环按成员集合（node_id, weight）缓存，目录版本变化但成员不变时直接复用。
+
+本模块只依赖标准库，可单独运行 `python -m service.hashring` 观察键迁移比例。
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+VNODES_PER_WEIGHT = max(1, int(os.environ.get("NVLLM_HASHRING_VNODES", "160")))
+RING_CACHE_SIZE = max(1, int(os.environ.get("NVLLM_HASHRING_CACHE_SIZE", "64")))
+
+Membership = Tuple[Tuple[str, int], ...]
+
+
+def hash64(data: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """不可变的哈希环；lookup 为 O(log V)。"""
+
+    __slots__ = ("members", "_points", "_owners")
+
+    def __init__(self, members: Iterable[Tuple[str, int]]):
+        self.members: Membership = tuple(sorted(members))
+        points: List[Tuple[int, str]] = []
+        for node_id, weight in self.members:
+            for i in range(VNODES_PER_WEIGHT * max(1, int(weight))):
+                points.append((hash64(f"{node_id}#{i}"), node_id))
+        points.sort()
+        self._points = [p for p, _ in points]
+        self._owners = [o for _, o in points]
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """键顺时针遇到的第一个虚拟点所属的 node_id。"""
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, hash64(key)) % len(self._points)
+        return self._owners[idx]
+
+    def walk(self, key: str) -> Iterator[str]:
+        """按环上顺序依次给出互不相同的 node_id（首选、次选……），可用于确定性的备选顺序。"""
+        n = len(self._points)
+        if not n:
+            return
+        start = bisect.bisect(self._points, hash64(key))
+        seen = set()
+        for step in range(n):
+            owner = self._owners[(start + step) % n]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+                if len(seen) == len(self.members):
+                    return
+
+
+_cache: "OrderedDict[Membership, HashRing]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def ring_for(members: Iterable[Tuple[str, int]]) -> HashRing:
+    """按成员集合取（或构建并缓存）哈希环。"""
+    key: Membership = tuple(sorted(members))
+    with _cache_lock:
+        ring = _cache.get(key)
+        if ring is not None:
+            _cache.move_to_end(key)
+            return ring
+    ring = HashRing(key)
+    with _cache_lock:
+        _cache[key] = ring
+        _cache.move_to_end(key)
+        while len(_cache) > RING_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return ring
+
+
+def measure_key_movement(
+    before: Dict[str, int],
+    after: Dict[str, int],
+    keys: Sequence[str],
+) -> float:
+    """成员从 before 变为 after（node_id -> weight）时，迁移到其它副本的键占比。"""
+    if not keys:
+        return 0.0
+    r1 = HashRing(before.items())
+    r2 = HashRing(after.items())
+    moved = sum(1 for k in keys if r1.lookup(k) != r2.lookup(k))
+    return moved / len(keys)
+
+
+def _main() -> None:
+    keys = [f"prompt-prefix-{i}" for i in range(20000)]
+    print(f"{'nodes':>6} {'change':>8} {'ring':>8} {'modulo':>8} {'ideal':>8}")
+    for n in (4, 16, 64, 256):
+        base = {f"node-{i:03d}": 1 for i in range(n)}
+        cases = {
+            "remove": {k: w for k, w in base.items() if k != "node-000"},
+            "add": {**base, "node-new": 1},
+        }
+        for change, after in cases.items():
+            ring = measure_key_movement(base, after, keys)
+            ids1, ids2 = sorted(base), sorted(after)
+            mod = sum(
+                1
+                for k in keys
+                if ids1[hash64(k) % len(ids1)] != ids2[hash64(k) % len(ids2)]
+            ) / len(keys)
+            ideal = 1.0 / max(len(base), len(after))
+            print(f"{n:>6} {change:>8} {ring:>8.3f} {mod:>8.3f} {ideal:>8.3f}")
+
+
+if __name__ == "__main__":
+    _main()
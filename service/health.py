@@ -1,19 +1,30 @@
 """
 副本存活探测（HTTP GET）；结果写入 Redis；探测路径使用分布式锁，避免多网关同时打同一副本。
 
-可选后台线程按间隔主动刷新（心跳），与请求路径共用同一锁与缓存。
+可选后台线程按间隔主动刷新（心跳）：集群内以 Redis 租约选出唯一的探测者，每轮用线程池并发探测全部副本
+（并发上限 + 随机抖动），结果以一次 pipeline 写回 Redis，一轮耗时约为一次探测超时，与副本数量无关。
+
+请求路径使用 pool_health 批量判定：进程内 L1 缓存 → 一次 MGET 补齐 → 过期条目先返回旧值、
+后台再刷新（stale-while-revalidate）；从无记录的副本乐观视为健康并后台探测，请求不等待探测。
+
+探测结果同时发布到 Redis 频道：各网关订阅后立即更新 L1，等待他处探测锁的线程被唤醒，而不是轮询 sleep。
 """
 from __future__ import annotations
 
+import json
 import logging
 import os
+import random
 import threading
 import time
-from typing import Optional
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
 
 from middleware.redis_client import redis_cli
+from service import stats
 
 logger = logging.getLogger(__name__)
 
@@ -35,10 +46,24 @@ HEALTH_REDIS_PREFIX = os.environ.get("NVLLM_HEALTH_REDIS_PREFIX", "nvllm:health:
 LOCK_PREFIX = os.environ.get("NVLLM_HEALTH_LOCK_PREFIX", "nvllm:health:lock:")
 PROBE_LOCK_SEC = int(os.environ.get("NVLLM_HEALTH_PROBE_LOCK_SEC", "5"))
 
-# 未抢到锁时轮询 Redis 结果：次数 × 间隔 ≈ 最长等待
+# 未抢到锁时等待他处探测结果：次数 × 间隔 ≈ 最长等待（订阅可用时由发布唤醒，否则轮询 Redis）
 LOCK_WAIT_ITERATIONS = int(os.environ.get("NVLLM_HEALTH_LOCK_WAIT_ITERATIONS", "20"))
 LOCK_WAIT_SLEEP_SEC = float(os.environ.get("NVLLM_HEALTH_LOCK_WAIT_MS", "50")) / 1000.0
 
+# 1 时 node_is_healthy 缓存未命中立即返回上次状态（无则乐观健康）并后台探测，不等待
+HEALTH_NONBLOCKING = os.environ.get("NVLLM_HEALTH_NONBLOCKING", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# 探测结果发布频道（消息体为 {node_id: bool} JSON）
+HEALTH_CHANNEL = os.environ.get("NVLLM_HEALTH_CHANNEL", "nvllm:health:events")
+HEALTH_WATCH = os.environ.get("NVLLM_HEALTH_WATCH", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
 HEALTH_INVALIDATE_SEC = int(
     os.environ.get(
         "NVLLM_HEALTH_INVALIDATE_SEC",
@@ -46,8 +71,26 @@ HEALTH_INVALIDATE_SEC = int(
     )
 )
 
-# >0 时启动守护线程，周期性拉 catalog 并 force 刷新（仍走分布式锁）
+# 进程内 L1：新鲜期内直接使用；超过新鲜期但在 stale 窗口内先返回旧值并后台刷新
+HEALTH_L1_SEC = float(os.environ.get("NVLLM_HEALTH_L1_MS", "1000")) / 1000.0
+HEALTH_L1_STALE_SEC = float(
+    os.environ.get("NVLLM_HEALTH_L1_STALE_SEC", str(max(10.0, HEALTH_CACHE_SEC * 2)))
+)
+# 后台刷新 / 探测线程数
+HEALTH_ASYNC_WORKERS = max(1, int(os.environ.get("NVLLM_HEALTH_ASYNC_WORKERS", "4")))
+
+# >0 时启动守护线程，周期性拉 catalog 并发探测全部副本
 HEALTH_BG_INTERVAL_SEC = float(os.environ.get("NVLLM_HEALTH_BG_INTERVAL_SEC", "0"))
+# 后台探测并发上限与每个探测发出前的随机抖动
+HEALTH_BG_CONCURRENCY = max(1, int(os.environ.get("NVLLM_HEALTH_BG_CONCURRENCY", "32")))
+HEALTH_BG_JITTER_SEC = float(os.environ.get("NVLLM_HEALTH_BG_JITTER_MS", "200")) / 1000.0
+# 1 时集群内只有持有 Redis 租约的网关执行后台探测
+HEALTH_BG_LEADER = os.environ.get("NVLLM_HEALTH_BG_LEADER", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+LEADER_KEY = os.environ.get("NVLLM_HEALTH_LEADER_KEY", "nvllm:health:leader")
 
 
 def _key(node_id: str) -> str:
@@ -78,13 +121,45 @@ def _norm_cached_ok(value) -> Optional[bool]:
     return None
 
 
+_l1: Dict[str, Tuple[bool, float]] = {}
+_l1_lock = threading.Lock()
+_refreshing: set = set()
+_executor = ThreadPoolExecutor(
+    max_workers=HEALTH_ASYNC_WORKERS,
+    thread_name_prefix="nvllm-health",
+)
+
+
+def _l1_put(node_id: str, ok: bool) -> None:
+    with _l1_lock:
+        _l1[node_id] = (ok, time.monotonic())
+
+
+def _l1_get_fresh(node_id: str) -> Optional[bool]:
+    entry = _l1.get(node_id)
+    if entry is not None and time.monotonic() - entry[1] < HEALTH_L1_SEC:
+        return entry[0]
+    return None
+
+
 def invalidate_node(node_id: str) -> None:
+    _l1_put(node_id, False)
     k = _key(node_id)
     ex = max(_ttl_cache_seconds(), HEALTH_INVALIDATE_SEC)
     if not redis_cli.set(k, "0", ex=ex):
         logger.warning("redis set failed for health invalidate node=%s", node_id)
 
 
+async def invalidate_node_async(node_id: str) -> None:
+    """invalidate_node 的 asyncio 版本，供 ASGI 数据面在事件循环内调用。"""
+    _l1_put(node_id, False)
+    ex = max(_ttl_cache_seconds(), HEALTH_INVALIDATE_SEC)
+    try:
+        await redis_cli.async_client.set(_key(node_id), "0", ex=ex)
+    except Exception as e:
+        logger.warning("redis set failed for health invalidate node=%s: %s", node_id, e)
+
+
 def _probe_http(node) -> bool:
     url = f"http://{node.node_address}:{node.node_port}{HEALTH_PATH}"
     try:
@@ -95,12 +170,101 @@ def _probe_http(node) -> bool:
         return False
 
 
+def _notify(results: Dict[str, bool]) -> None:
+    try:
+        redis_cli.client.publish(HEALTH_CHANNEL, json.dumps(results))
+    except Exception as e:
+        logger.warning("health notify failed: %s", e)
+
+
 def _probe_and_publish(node) -> bool:
     ok = _probe_http(node)
+    _l1_put(node.node_id, ok)
     redis_cli.set(_key(node.node_id), "1" if ok else "0", ex=_ttl_cache_seconds())
+    _notify({node.node_id: ok})
     return ok
 
 
+# ---------- 结果订阅 ----------
+
+_watching = threading.Event()
+_waiters: Dict[str, threading.Event] = {}
+
+
+def _on_health_event(data) -> None:
+    try:
+        results = json.loads(data)
+    except (TypeError, ValueError) as e:
+        logger.warning("bad health event %r: %s", data, e)
+        return
+    if not isinstance(results, dict):
+        return
+    now = time.monotonic()
+    with _l1_lock:
+        for node_id, ok in results.items():
+            _l1[node_id] = (bool(ok), now)
+            waiter = _waiters.pop(node_id, None)
+            if waiter is not None:
+                waiter.set()
+
+
+def _wait_published(node_id: str, timeout: float) -> Optional[bool]:
+    """等待他处发布 node_id 的探测结果；超时返回 None。"""
+    with _l1_lock:
+        waiter = _waiters.get(node_id)
+        if waiter is None:
+            waiter = threading.Event()
+            _waiters[node_id] = waiter
+    if not waiter.wait(timeout):
+        return None
+    entry = _l1.get(node_id)
+    return entry[0] if entry is not None else None
+
+
+def _watch_loop() -> None:
+    backoff = 1.0
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_cli.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(HEALTH_CHANNEL)
+            _watching.set()
+            backoff = 1.0
+            while True:
+                msg = pubsub.get_message(timeout=1.0)
+                if msg and msg.get("type") == "message":
+                    _on_health_event(msg.get("data"))
+        except Exception as e:
+            logger.warning("health watcher disconnected: %s", e)
+        finally:
+            _watching.clear()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+_watch_started = False
+_watch_start_lock = threading.Lock()
+
+
+def start_health_watcher() -> None:
+    """在进程启动时调用：启用健康检查时订阅探测结果频道。"""
+    global _watch_started
+    if not HEALTH_ENABLED or not HEALTH_WATCH:
+        return
+    with _watch_start_lock:
+        if _watch_started:
+            return
+        threading.Thread(
+            target=_watch_loop, daemon=True, name="nvllm-health-watch"
+        ).start()
+        _watch_started = True
+
+
 def _try_acquire_probe_lock(node_id: str) -> bool:
     try:
         return bool(
@@ -126,16 +290,25 @@ def _release_probe_lock(node_id: str) -> None:
 def node_is_healthy(node, force_refresh: bool = False) -> bool:
     """
     force_refresh=True 时跳过读缓存（用于后台心跳），仍通过分布式锁与其它实例协调探测。
+    非阻塞模式（默认）下缓存未命中不探测：返回上次已知状态（无则乐观视为健康）并安排后台探测。
     """
     if not HEALTH_ENABLED:
         return True
 
     k = _key(node.node_id)
     if not force_refresh:
+        ok_l1 = _l1_get_fresh(node.node_id)
+        if ok_l1 is not None:
+            return ok_l1
         cached = redis_cli.get(k)
         ok_cached = _norm_cached_ok(cached)
         if ok_cached is not None:
+            _l1_put(node.node_id, ok_cached)
             return ok_cached
+        if HEALTH_NONBLOCKING:
+            _refresh_async([node])
+            last = _l1.get(node.node_id)
+            return last[0] if last is not None else True
 
     if _try_acquire_probe_lock(node.node_id):
         try:
@@ -143,22 +316,211 @@ def node_is_healthy(node, force_refresh: bool = False) -> bool:
         finally:
             _release_probe_lock(node.node_id)
 
+    if _watching.is_set():
+        ok = _wait_published(node.node_id, LOCK_WAIT_ITERATIONS * LOCK_WAIT_SLEEP_SEC)
+        if ok is not None:
+            return ok
+    else:
+        ok = _poll_cached(k, node.node_id)
+        if ok is not None:
+            return ok
+
+    logger.warning(
+        "health probe lock wait exhausted node=%s, probing without lock",
+        node.node_id,
+    )
+    return _probe_and_publish(node)
+
+
+def _poll_cached(k: str, node_id: str) -> Optional[bool]:
+    """未订阅结果频道时的兜底：轮询 Redis 结果键。"""
     for _ in range(LOCK_WAIT_ITERATIONS):
         time.sleep(LOCK_WAIT_SLEEP_SEC)
         cached = redis_cli.get(k)
         ok_cached = _norm_cached_ok(cached)
         if ok_cached is not None:
+            _l1_put(node_id, ok_cached)
             return ok_cached
+    return None
 
-    logger.warning(
-        "health probe lock wait exhausted node=%s, probing without lock",
-        node.node_id,
-    )
-    return _probe_and_publish(node)
 
+def _mget_health(nodes: List) -> List[Optional[bool]]:
+    """一次 MGET 读取一组副本的 Redis 健康结果；Redis 异常时全部视为未知。"""
+    if not nodes:
+        return []
+    try:
+        values = redis_cli.client.mget([_key(n.node_id) for n in nodes])
+    except Exception as e:
+        logger.warning("redis health mget failed: %s", e)
+        return [None] * len(nodes)
+    return [_norm_cached_ok(v) for v in values]
+
+
+def _refresh_async(nodes: List) -> None:
+    """后台刷新：先 MGET 取他处探测结果，仍无结果的再走 node_is_healthy（含分布式锁）。"""
+    with _l1_lock:
+        todo = [n for n in nodes if n.node_id not in _refreshing]
+        _refreshing.update(n.node_id for n in todo)
+    if not todo:
+        return
+
+    def run() -> None:
+        try:
+            unknown = []
+            for node, ok in zip(todo, _mget_health(todo)):
+                if ok is None:
+                    unknown.append(node)
+                else:
+                    _l1_put(node.node_id, ok)
+            for node in unknown:
+                try:
+                    node_is_healthy(node, force_refresh=True)
+                except Exception:
+                    logger.exception("async health probe failed node=%s", node.node_id)
+        finally:
+            with _l1_lock:
+                _refreshing.difference_update(n.node_id for n in todo)
+
+    try:
+        _executor.submit(run)
+    except RuntimeError:
+        # 解释器退出阶段 executor 已关闭
+        with _l1_lock:
+            _refreshing.difference_update(n.node_id for n in todo)
+
+
+def pool_health(nodes: Iterable) -> Dict[str, bool]:
+    """
+    批量判定一组副本的健康状态（node_id -> bool），请求路径不等待任何 HTTP 探测：
+    - L1 新鲜：直接使用；
+    - L1 过期但在 stale 窗口内：返回旧值并后台刷新；
+    - 无 L1：一次 MGET 读 Redis；仍无记录的乐观视为健康，并后台探测。
+    """
+    nodes = list(nodes)
+    if not HEALTH_ENABLED:
+        return {n.node_id: True for n in nodes}
+
+    now = time.monotonic()
+    result: Dict[str, bool] = {}
+    missing = []
+    stale = []
+    for n in nodes:
+        entry = _l1.get(n.node_id)
+        if entry is not None:
+            age = now - entry[1]
+            if age < HEALTH_L1_SEC:
+                result[n.node_id] = entry[0]
+                continue
+            if age < HEALTH_L1_STALE_SEC:
+                result[n.node_id] = entry[0]
+                stale.append(n)
+                continue
+        missing.append(n)
+
+    unknown = []
+    for node, ok in zip(missing, _mget_health(missing)):
+        if ok is None:
+            result[node.node_id] = True
+            unknown.append(node)
+        else:
+            result[node.node_id] = ok
+            _l1_put(node.node_id, ok)
+
+    if stale or unknown:
+        _refresh_async(stale + unknown)
+    return result
+
+
+# KEYS: leader  ARGV: token, ttl_ms
+# 已持有则续租，空闲则抢占；返回 1 表示本实例为探测者
+_LEADER_LUA = """
+local v = redis.call('GET', KEYS[1])
+if v == ARGV[1] then
+  redis.call('PEXPIRE', KEYS[1], ARGV[2])
+  return 1
+end
+if not v then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+  return 1
+end
+return 0
+"""
 
 _bg_started = False
 _bg_lock = threading.Lock()
+_leader_token = uuid.uuid4().hex
+_leader_script = None
+_bg_executor: Optional[ThreadPoolExecutor] = None
+_bg_stats: Dict[str, object] = {
+    "leader": False,
+    "sweeps": 0,
+    "last_sweep_ms": 0.0,
+    "last_nodes": 0,
+    "last_unhealthy": 0,
+}
+
+
+def _lease_ms() -> int:
+    # 探测者异常退出后，其它实例最迟在约两轮后接手
+    return int((2 * HEALTH_BG_INTERVAL_SEC + HEALTH_TIMEOUT + HEALTH_BG_JITTER_SEC) * 1000)
+
+
+def _is_leader() -> bool:
+    global _leader_script
+    if not HEALTH_BG_LEADER:
+        return True
+    try:
+        if _leader_script is None:
+            _leader_script = redis_cli.client.register_script(_LEADER_LUA)
+        leader = bool(_leader_script(keys=[LEADER_KEY], args=[_leader_token, _lease_ms()]))
+    except Exception as e:
+        logger.warning("health leader lease failed: %s", e)
+        leader = False
+    if leader != _bg_stats["leader"]:
+        logger.info("health prober leadership %s", "acquired" if leader else "lost")
+    _bg_stats["leader"] = leader
+    return leader
+
+
+def _probe_jittered(node) -> bool:
+    if HEALTH_BG_JITTER_SEC > 0:
+        time.sleep(random.uniform(0, HEALTH_BG_JITTER_SEC))
+    return _probe_http(node)
+
+
+def _sweep(nodes: List) -> Dict[str, bool]:
+    """并发探测一组副本；超出单轮时限仍未返回的探测不计入本轮结果。"""
+    global _bg_executor
+    if _bg_executor is None:
+        _bg_executor = ThreadPoolExecutor(
+            max_workers=HEALTH_BG_CONCURRENCY,
+            thread_name_prefix="nvllm-health-sweep",
+        )
+    futures = {_bg_executor.submit(_probe_jittered, n): n for n in nodes}
+    waves = -(-len(nodes) // HEALTH_BG_CONCURRENCY)
+    done, _ = wait(futures, timeout=waves * (HEALTH_TIMEOUT + HEALTH_BG_JITTER_SEC) + 1)
+    results: Dict[str, bool] = {}
+    for future in done:
+        try:
+            results[futures[future].node_id] = future.result()
+        except Exception:
+            logger.exception("bg health probe failed node=%s", futures[future].node_id)
+    return results
+
+
+def _publish(results: Dict[str, bool]) -> None:
+    """本轮结果一次 pipeline 写回；TTL 覆盖到下一轮之后，避免两轮之间键过期。"""
+    ex = max(_ttl_cache_seconds(), int(HEALTH_BG_INTERVAL_SEC * 2) + 1)
+    for node_id, ok in results.items():
+        _l1_put(node_id, ok)
+    try:
+        pipe = redis_cli.client.pipeline(transaction=False)
+        for node_id, ok in results.items():
+            pipe.set(_key(node_id), "1" if ok else "0", ex=ex)
+        pipe.publish(HEALTH_CHANNEL, json.dumps(results))
+        pipe.execute()
+    except Exception as e:
+        logger.warning("health publish failed: %s", e)
 
 
 def _background_health_loop() -> None:
@@ -168,18 +530,27 @@ def _background_health_loop() -> None:
             if interval <= 0:
                 return
             time.sleep(interval)
-            from service.node import _nodes_from_redis
-
-            nodes = _nodes_from_redis()
-            for node in nodes:
-                try:
-                    node_is_healthy(node, force_refresh=True)
-                except Exception:
-                    logger.exception("bg health probe failed node=%s", node.node_id)
+            if not _is_leader():
+                continue
+            from service.catalog import snapshot
+
+            nodes = list(snapshot().nodes)
+            started = time.monotonic()
+            results = _sweep(nodes)
+            if results:
+                _publish(results)
+            _bg_stats["sweeps"] += 1
+            _bg_stats["last_sweep_ms"] = round((time.monotonic() - started) * 1000, 1)
+            _bg_stats["last_nodes"] = len(nodes)
+            _bg_stats["last_unhealthy"] = sum(1 for ok in results.values() if not ok)
         except Exception:
             logger.exception("bg health iteration failed")
 
 
+def prober_stats() -> Dict[str, object]:
+    return dict(_bg_stats)
+
+
 def start_background_health_prober() -> None:
     """在进程启动时调用：若 NVLLM_HEALTH_BG_INTERVAL_SEC>0 且启用健康检查则启动守护线程。"""
     global _bg_started
@@ -195,7 +566,9 @@ def start_background_health_prober() -> None:
         )
         t.start()
         _bg_started = True
+        stats.register_provider("health_prober", prober_stats)
         logger.info(
-            "background health prober started interval_sec=%s",
+            "background health prober started interval_sec=%s concurrency=%s",
             HEALTH_BG_INTERVAL_SEC,
+            HEALTH_BG_CONCURRENCY,
         )
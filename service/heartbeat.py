@@ -0,0 +1,292 @@
+"""
+侧车高频负载心跳：UDP 报文只携带 node_info，不经 Flask / JWT / 整条目录记录写入。
+
+- 报文（网络字节序）：b"NH" + 版本(1B) + node_id 长度(1B) + node_id + 发送时间(f64, unix 秒)
+  + running/waiting(u32) + 其余 NodeInfo 字段(f32，顺序见 FLOAT_FIELDS)
+  + HMAC-SHA256(NVLLM_HEARTBEAT_SECRET) 前 16 字节；
+- 签名不符、时间偏差超过 NVLLM_HEARTBEAT_MAX_SKEW_SEC、或不新于该副本上一条的报文丢弃（防伪造与重放）；
+- 接收线程只保留每个副本最新一条，写线程每 NVLLM_HEARTBEAT_FLUSH_MS 用一次 pipeline 写入
+  （每副本 SET EX 一个键 + 整批一条 PUBLISH）；
+- 各网关订阅负载频道，把 node_info 覆盖到目录快照（catalog.apply_load，不推进目录版本号），
+  有效期 NVLLM_HEARTBEAT_TTL_SEC；订阅建立时先按目录 MGET 补齐。
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+from middleware.redis_client import redis_cli
+from model.node import NodeInfo
+from service import catalog, stats
+
+logger = logging.getLogger(__name__)
+
+# >0 时在该端口接收侧车心跳（多 worker 通过 SO_REUSEPORT 共享端口）
+HEARTBEAT_PORT = int(os.environ.get("NVLLM_HEARTBEAT_UDP_PORT", "0"))
+HEARTBEAT_HOST = os.environ.get("NVLLM_HEARTBEAT_UDP_HOST", "0.0.0.0")
+HEARTBEAT_SECRET = os.environ.get("NVLLM_HEARTBEAT_SECRET", "").encode()
+HEARTBEAT_MAX_SKEW_SEC = float(os.environ.get("NVLLM_HEARTBEAT_MAX_SKEW_SEC", "10"))
+HEARTBEAT_FLUSH_SEC = (
+    max(10.0, float(os.environ.get("NVLLM_HEARTBEAT_FLUSH_MS", "200"))) / 1000.0
+)
+# 覆盖有效期：超过后回退到目录记录中的 node_info（应大于侧车心跳周期的数倍）
+HEARTBEAT_TTL_SEC = float(os.environ.get("NVLLM_HEARTBEAT_TTL_SEC", "5"))
+HEARTBEAT_WATCH = os.environ.get("NVLLM_HEARTBEAT_WATCH", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+HEARTBEAT_KEY_PREFIX = os.environ.get("NVLLM_HEARTBEAT_KEY_PREFIX", "nvllm:load:")
+HEARTBEAT_CHANNEL = os.environ.get("NVLLM_HEARTBEAT_CHANNEL", "nvllm:load:events")
+
+MAGIC = b"NH"
+VERSION = 1
+# 与 client/nvllm_sidecar.py 中的同名常量保持一致
+FLOAT_FIELDS = (
+    "kv_cache",
+    "preemption_rate",
+    "prompt_tokens_rate",
+    "generation_tokens_rate",
+    "request_rate",
+    "prefix_cache_hit_rate",
+    "ttft_p50_ms",
+    "ttft_p95_ms",
+    "itl_p50_ms",
+    "itl_p95_ms",
+    "queue_p95_ms",
+    "e2e_p95_ms",
+)
+_HEAD = struct.Struct("!2sBB")
+_BODY = struct.Struct("!dII" + "f" * len(FLOAT_FIELDS))
+MAC_LEN = 16
+MAX_PACKET = _HEAD.size + 255 + _BODY.size + MAC_LEN
+
+
+class BadHeartbeat(ValueError):
+    pass
+
+
+def decode(packet: bytes, secret: bytes) -> Tuple[str, float, Dict[str, Any]]:
+    """校验并解析一条心跳；返回 (node_id, 发送时间, node_info 字典)。"""
+    if len(packet) < _HEAD.size + _BODY.size + MAC_LEN:
+        raise BadHeartbeat("short packet")
+    signed, mac = packet[:-MAC_LEN], packet[-MAC_LEN:]
+    expected = hmac.new(secret, signed, hashlib.sha256).digest()[:MAC_LEN]
+    if not hmac.compare_digest(mac, expected):
+        raise BadHeartbeat("bad signature")
+    magic, version, id_len = _HEAD.unpack_from(signed)
+    if magic != MAGIC or version != VERSION:
+        raise BadHeartbeat("unknown format")
+    if len(signed) != _HEAD.size + id_len + _BODY.size:
+        raise BadHeartbeat("length mismatch")
+    node_id = signed[_HEAD.size : _HEAD.size + id_len].decode("utf-8")
+    values = _BODY.unpack_from(signed, _HEAD.size + id_len)
+    info: Dict[str, Any] = {"running": values[1], "waiting": values[2]}
+    for name, v in zip(FLOAT_FIELDS, values[3:]):
+        info[name] = v if math.isfinite(v) else 0.0
+    return node_id, values[0], info
+
+
+_lock = threading.Lock()
+# 待写入：node_id -> (发送时间, node_info)，同一副本后到覆盖
+_pending: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_last_ts: Dict[str, float] = {}
+_metrics: Dict[str, int] = {
+    "received": 0,
+    "rejected": 0,
+    "stale": 0,
+    "flushes": 0,
+    "flushed_reports": 0,
+    "applied": 0,
+}
+
+
+def _accept(packet: bytes) -> None:
+    try:
+        node_id, ts, info = decode(packet, HEARTBEAT_SECRET)
+    except (BadHeartbeat, struct.error, UnicodeDecodeError) as e:
+        with _lock:
+            _metrics["rejected"] += 1
+        logger.debug("heartbeat rejected: %s", e)
+        return
+    with _lock:
+        _metrics["received"] += 1
+        if abs(time.time() - ts) > HEARTBEAT_MAX_SKEW_SEC or ts <= _last_ts.get(
+            node_id, 0.0
+        ):
+            _metrics["stale"] += 1
+            return
+        _last_ts[node_id] = ts
+        _pending[node_id] = (ts, info)
+
+
+def _recv_loop(sock: socket.socket) -> None:
+    while True:
+        try:
+            packet, _ = sock.recvfrom(MAX_PACKET)
+        except OSError as e:
+            logger.warning("heartbeat socket error: %s", e)
+            time.sleep(1.0)
+            continue
+        _accept(packet)
+
+
+def _flush() -> None:
+    with _lock:
+        if not _pending:
+            return
+        batch = dict(_pending)
+        _pending.clear()
+    payload = {node_id: {**info, "ts": ts} for node_id, (ts, info) in batch.items()}
+    ex = max(1, math.ceil(HEARTBEAT_TTL_SEC))
+    pipe = redis_cli.client.pipeline(transaction=False)
+    for node_id, record in payload.items():
+        pipe.set(HEARTBEAT_KEY_PREFIX + node_id, json.dumps(record), ex=ex)
+    pipe.publish(HEARTBEAT_CHANNEL, json.dumps(payload))
+    pipe.execute()
+    with _lock:
+        _metrics["flushes"] += 1
+        _metrics["flushed_reports"] += len(batch)
+    if not _watching.is_set():
+        # 未订阅（或订阅断开）时至少让本进程立即生效
+        _apply(payload)
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(HEARTBEAT_FLUSH_SEC)
+        try:
+            _flush()
+        except Exception as e:
+            logger.warning("heartbeat flush failed: %s", e)
+
+
+# ---------- 订阅与覆盖 ----------
+
+_watching = threading.Event()
+
+
+def _apply(records: Dict[str, Any]) -> None:
+    now_wall = time.time()
+    now = time.monotonic()
+    infos: Dict[str, Tuple[float, NodeInfo]] = {}
+    for node_id, record in records.items():
+        if not isinstance(record, dict):
+            continue
+        try:
+            remaining = HEARTBEAT_TTL_SEC - max(0.0, now_wall - float(record.get("ts", 0)))
+            if remaining <= 0:
+                continue
+            infos[str(node_id)] = (now + remaining, NodeInfo.from_dict(record))
+        except (TypeError, ValueError) as e:
+            logger.warning("bad heartbeat record node=%s: %s", node_id, e)
+    if infos:
+        catalog.apply_load(infos)
+        with _lock:
+            _metrics["applied"] += len(infos)
+
+
+def _prime() -> None:
+    """订阅建立后补齐当前仍有效的心跳（订阅前发布的消息已错过）。"""
+    ids = [n.node_id for n in catalog.snapshot().nodes]
+    if not ids:
+        return
+    raw = redis_cli.client.mget([HEARTBEAT_KEY_PREFIX + i for i in ids])
+    records = {}
+    for node_id, value in zip(ids, raw):
+        if value:
+            try:
+                records[node_id] = json.loads(value)
+            except ValueError:
+                continue
+    _apply(records)
+
+
+def _watch_loop() -> None:
+    backoff = 1.0
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_cli.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(HEARTBEAT_CHANNEL)
+            _watching.set()
+            backoff = 1.0
+            _prime()
+            while True:
+                msg = pubsub.get_message(timeout=1.0)
+                if msg and msg.get("type") == "message":
+                    try:
+                        _apply(json.loads(msg.get("data")))
+                    except (TypeError, ValueError, AttributeError) as e:
+                        logger.warning("bad heartbeat event: %s", e)
+        except Exception as e:
+            logger.warning("heartbeat watcher disconnected: %s", e)
+        finally:
+            _watching.clear()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+def _bind() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((HEARTBEAT_HOST, HEARTBEAT_PORT))
+    return sock
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_metrics)
+        out["pending"] = len(_pending)
+    out["watching"] = _watching.is_set()
+    return out
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_heartbeat() -> None:
+    """在进程启动时调用：订阅负载频道；配置了 NVLLM_HEARTBEAT_UDP_PORT 时同时接收侧车心跳。"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        stats.register_provider("heartbeat", get_stats)
+        if HEARTBEAT_WATCH:
+            threading.Thread(
+                target=_watch_loop, daemon=True, name="nvllm-heartbeat-watch"
+            ).start()
+        if HEARTBEAT_PORT <= 0:
+            return
+        if not HEARTBEAT_SECRET:
+            logger.error("NVLLM_HEARTBEAT_SECRET is required to accept heartbeats")
+            return
+        try:
+            sock = _bind()
+        except OSError as e:
+            logger.error("heartbeat bind failed port=%s: %s", HEARTBEAT_PORT, e)
+            return
+        threading.Thread(
+            target=_recv_loop, args=(sock,), daemon=True, name="nvllm-heartbeat-recv"
+        ).start()
+        threading.Thread(
+            target=_flush_loop, daemon=True, name="nvllm-heartbeat-flush"
+        ).start()
+        logger.info("heartbeat listener started udp=%s:%s", HEARTBEAT_HOST, HEARTBEAT_PORT)
@@ -0,0 +1,117 @@
+"""
+流式请求的首字节（TTFT）看门狗与对冲请求。
+
+- 每个模型池记录最近 NVLLM_HEDGE_WINDOW 个流式请求的 TTFT（发出请求到收到首个响应体字节），
+  看门狗时限 = max(NVLLM_HEDGE_MIN_MS, p95 × NVLLM_HEDGE_P95_FACTOR)；样本不足 NVLLM_HEDGE_MIN_SAMPLES
+  时使用 NVLLM_HEDGE_TTFT_MS；
+- 时限内首字节未到时，向候选链路中的下一个副本发出对冲请求，先返回首字节者胜出，另一方被取消
+  （关闭上游连接、归还在途占位）；每一路尝试最多对冲一次，换副本重试时看门狗重新计时；
+- 全局对冲预算（令牌桶）：每个流式请求存入 NVLLM_HEDGE_BUDGET_PCT / 100 个令牌（上限
+  NVLLM_HEDGE_BUDGET_BURST），每次对冲消耗 1 个，长期对冲量不超过请求量的该百分比。
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from service import stats
+
+HEDGE_ENABLED = os.environ.get("NVLLM_HEDGE", "0").lower() in ("1", "true", "yes")
+DEFAULT_TTFT_MS = float(os.environ.get("NVLLM_HEDGE_TTFT_MS", "2000"))
+MIN_TTFT_MS = float(os.environ.get("NVLLM_HEDGE_MIN_MS", "200"))
+P95_FACTOR = float(os.environ.get("NVLLM_HEDGE_P95_FACTOR", "1.0"))
+WINDOW = max(1, int(os.environ.get("NVLLM_HEDGE_WINDOW", "200")))
+MIN_SAMPLES = max(1, int(os.environ.get("NVLLM_HEDGE_MIN_SAMPLES", "20")))
+BUDGET_PCT = float(os.environ.get("NVLLM_HEDGE_BUDGET_PCT", "5"))
+BUDGET_BURST = float(os.environ.get("NVLLM_HEDGE_BUDGET_BURST", "10"))
+
+
+class _Pool:
+    __slots__ = ("samples", "p95", "stale")
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=WINDOW)
+        self.p95: Optional[float] = None
+        self.stale = 0
+
+
+_pools: Dict[str, _Pool] = {}
+_lock = threading.Lock()
+_tokens = BUDGET_BURST
+_metrics: Dict[str, int] = {
+    "streams": 0,
+    "ttft_timeouts": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "budget_denied": 0,
+}
+
+
+def _p95(samples: Deque[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+def ttft_budget(model: Optional[str]) -> float:
+    """本次流式请求的首字节时限（秒）；同时为全局对冲预算存入令牌。"""
+    global _tokens
+    with _lock:
+        _metrics["streams"] += 1
+        _tokens = min(BUDGET_BURST, _tokens + BUDGET_PCT / 100)
+        pool = _pools.get(model or "")
+        if pool is None or len(pool.samples) < MIN_SAMPLES:
+            return DEFAULT_TTFT_MS / 1000
+        # 每积累 WINDOW / 10 个新样本重新排序一次
+        if pool.p95 is None or pool.stale >= max(1, WINDOW // 10):
+            pool.p95 = _p95(pool.samples)
+            pool.stale = 0
+        return max(MIN_TTFT_MS, pool.p95 * P95_FACTOR) / 1000
+
+
+def observe(model: Optional[str], ttft_sec: float) -> None:
+    with _lock:
+        pool = _pools.get(model or "")
+        if pool is None:
+            pool = _Pool()
+            _pools[model or ""] = pool
+        pool.samples.append(ttft_sec * 1000)
+        pool.stale += 1
+
+
+def try_hedge() -> bool:
+    """首字节超时时调用：预算足够则消耗一个令牌并返回 True。"""
+    global _tokens
+    with _lock:
+        _metrics["ttft_timeouts"] += 1
+        if _tokens < 1:
+            _metrics["budget_denied"] += 1
+            return False
+        _tokens -= 1
+        _metrics["hedges"] += 1
+        return True
+
+
+def hedge_won() -> None:
+    with _lock:
+        _metrics["hedge_wins"] += 1
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_metrics)
+        out["budget_tokens"] = round(_tokens, 3)
+        out["pools"] = {
+            name or "(default)": {
+                "samples": len(pool.samples),
+                "p95_ms": round(_p95(pool.samples), 1) if pool.samples else None,
+            }
+            for name, pool in _pools.items()
+        }
+    return out
+
+
+if HEDGE_ENABLED:
+    stats.register_provider("hedging", get_stats)
@@ -0,0 +1,271 @@
+"""
+集群级在途请求计数：网关在转发前通过一段 Lua 脚本「选择 + 占位」（一次往返），结束时释放。
+
+- Hash  nvllm:inflight         node_id -> 所有网关对该副本的在途请求数；
+- ZSet  nvllm:inflight:leases  成员 "<node_id>|<lease_id>"，分值为租约到期时间（毫秒）；
+  网关崩溃或漏释放的租约到期后由下一次选择脚本回收并扣减计数；流式响应在转发期间续租；
+- 每个候选的有效负载取 max(上报指标的综合负载分, 在途计数)：计数实时、上报覆盖网关外流量；
+- 首选候选（亲和 / 前缀索引）负载不超过最小值 + margin 时保留，否则取负载最低者；
+  节点登记 max_concurrency>0 时作为硬上限，已满的候选不参与选择。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
+
+from middleware.redis_client import redis_cli
+from service import stats
+from service.routing import AFFINITY_LOAD_MARGIN, node_load
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_ENABLED = os.environ.get("NVLLM_INFLIGHT_TRACKING", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+INFLIGHT_KEY = os.environ.get("NVLLM_INFLIGHT_KEY", "nvllm:inflight")
+LEASE_KEY = f"{INFLIGHT_KEY}:leases"
+LEASE_TTL_MS = int(float(os.environ.get("NVLLM_INFLIGHT_LEASE_SEC", "120")) * 1000)
+# 每次选择时最多回收的过期租约数，避免单次脚本执行过长
+REAP_BATCH = int(os.environ.get("NVLLM_INFLIGHT_REAP_BATCH", "100"))
+
+# 以 Redis 服务器时间计算租约，避免各网关时钟偏差
+_NOW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+"""
+
+_REAP_LUA = _NOW_LUA + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, member in ipairs(expired) do
+  if redis.call('ZREM', KEYS[2], member) == 1 then
+    local node = string.match(member, '^(.*)|[^|]*$')
+    if node and redis.call('HINCRBY', KEYS[1], node, -1) < 0 then
+      redis.call('HSET', KEYS[1], node, 0)
+    end
+  end
+end
+"""
+
+# KEYS: counts, leases
+# ARGV: reap_batch, lease_ttl_ms, lease_id, margin, then (node_id, cap, base_load)*
+_SELECT_RESERVE_LUA = _REAP_LUA + """
+local margin = tonumber(ARGV[4])
+local first_score, best, best_score = nil, nil, nil
+local first = nil
+local idx = 0
+for i = 5, #ARGV, 3 do
+  idx = idx + 1
+  local node = ARGV[i]
+  local cap = tonumber(ARGV[i + 1])
+  local base = tonumber(ARGV[i + 2])
+  local inflight = tonumber(redis.call('HGET', KEYS[1], node) or '0')
+  if cap <= 0 or inflight < cap then
+    local score = math.max(base, inflight)
+    if idx == 1 then
+      first, first_score = node, score
+    end
+    if best_score == nil or score < best_score then
+      best, best_score = node, score
+    end
+  end
+end
+if best == nil then
+  return false
+end
+local chosen = best
+if first ~= nil and first_score <= best_score + margin then
+  chosen = first
+end
+redis.call('HINCRBY', KEYS[1], chosen, 1)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), chosen .. '|' .. ARGV[3])
+return chosen
+"""
+
+# KEYS: counts, leases  ARGV: member, node_id
+_RELEASE_LUA = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 1 then
+  if redis.call('HINCRBY', KEYS[1], ARGV[2], -1) < 0 then
+    redis.call('HSET', KEYS[1], ARGV[2], 0)
+  end
+  return 1
+end
+return 0
+"""
+
+# KEYS: leases  ARGV: member, lease_ttl_ms
+_RENEW_LUA = _NOW_LUA + """
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', now + tonumber(ARGV[2]), ARGV[1])
+"""
+
+
+@dataclass
+class Lease:
+    node: Any
+    member: str
+    renewed_at: float
+    released: bool = False
+
+
+class Saturated(Exception):
+    """所有候选都已达到 max_concurrency。"""
+
+
+_scripts = {}
+
+
+def _script(name: str, body: str):
+    script = _scripts.get(name)
+    if script is None:
+        script = redis_cli.client.register_script(body)
+        _scripts[name] = script
+    return script
+
+
+_async_scripts = {}
+
+
+def _async_script(name: str, body: str):
+    script = _async_scripts.get(name)
+    if script is None:
+        script = redis_cli.async_client.register_script(body)
+        _async_scripts[name] = script
+    return script
+
+
+def _select_args(candidates: Sequence[Any], lease_id: str) -> List[Any]:
+    args: List[Any] = [
+        REAP_BATCH,
+        LEASE_TTL_MS,
+        lease_id,
+        AFFINITY_LOAD_MARGIN,
+    ]
+    for n in candidates:
+        args.extend(
+            [n.node_id, int(getattr(n, "max_concurrency", 0) or 0), node_load(n)]
+        )
+    return args
+
+
+def _to_lease(chosen: Any, candidates: Sequence[Any], lease_id: str) -> Lease:
+    if isinstance(chosen, bytes):
+        chosen = chosen.decode("utf-8")
+    node = next(n for n in candidates if n.node_id == chosen)
+    return Lease(node=node, member=f"{chosen}|{lease_id}", renewed_at=time.monotonic())
+
+
+def reserve(candidates: Sequence[Any]) -> Optional[Lease]:
+    """
+    在候选中原子地选择并占位一个副本（candidates[0] 视为首选）。
+    全部已满抛 Saturated；Redis 不可用时返回 None，由调用方按原顺序直接转发。
+    """
+    if not candidates:
+        raise Saturated("no candidates")
+    lease_id = uuid.uuid4().hex
+    try:
+        chosen = _script("select", _SELECT_RESERVE_LUA)(
+            keys=[INFLIGHT_KEY, LEASE_KEY],
+            args=_select_args(candidates, lease_id),
+        )
+    except Exception as e:
+        logger.warning("inflight reserve failed, forwarding untracked: %s", e)
+        return None
+    if not chosen:
+        raise Saturated("all candidates at max_concurrency")
+    return _to_lease(chosen, candidates, lease_id)
+
+
+async def reserve_async(candidates: Sequence[Any]) -> Optional[Lease]:
+    """reserve 的 asyncio 版本。"""
+    if not candidates:
+        raise Saturated("no candidates")
+    lease_id = uuid.uuid4().hex
+    try:
+        chosen = await _async_script("select", _SELECT_RESERVE_LUA)(
+            keys=[INFLIGHT_KEY, LEASE_KEY],
+            args=_select_args(candidates, lease_id),
+        )
+    except Exception as e:
+        logger.warning("inflight reserve failed, forwarding untracked: %s", e)
+        return None
+    if not chosen:
+        raise Saturated("all candidates at max_concurrency")
+    return _to_lease(chosen, candidates, lease_id)
+
+
+def release(lease: Optional[Lease]) -> None:
+    if lease is None or lease.released:
+        return
+    lease.released = True
+    try:
+        _script("release", _RELEASE_LUA)(
+            keys=[INFLIGHT_KEY, LEASE_KEY],
+            args=[lease.member, lease.node.node_id],
+        )
+    except Exception as e:
+        # 租约到期后会被回收
+        logger.warning("inflight release failed node=%s: %s", lease.node.node_id, e)
+
+
+async def release_async(lease: Optional[Lease]) -> None:
+    if lease is None or lease.released:
+        return
+    lease.released = True
+    try:
+        await _async_script("release", _RELEASE_LUA)(
+            keys=[INFLIGHT_KEY, LEASE_KEY],
+            args=[lease.member, lease.node.node_id],
+        )
+    except Exception as e:
+        logger.warning("inflight release failed node=%s: %s", lease.node.node_id, e)
+
+
+def _renew_due(lease: Optional[Lease]) -> bool:
+    if lease is None or lease.released:
+        return False
+    return (time.monotonic() - lease.renewed_at) * 1000 >= LEASE_TTL_MS / 3
+
+
+def _renew_args(lease: Lease) -> List[Any]:
+    lease.renewed_at = time.monotonic()
+    return [lease.member, LEASE_TTL_MS]
+
+
+def maybe_renew(lease: Optional[Lease]) -> None:
+    """长流转发期间调用：距上次续租超过 TTL/3 时延长租约。"""
+    if not _renew_due(lease):
+        return
+    try:
+        _script("renew", _RENEW_LUA)(keys=[LEASE_KEY], args=_renew_args(lease))
+    except Exception as e:
+        logger.warning("inflight renew failed node=%s: %s", lease.node.node_id, e)
+
+
+async def maybe_renew_async(lease: Optional[Lease]) -> None:
+    if not _renew_due(lease):
+        return
+    try:
+        await _async_script("renew", _RENEW_LUA)(
+            keys=[LEASE_KEY], args=_renew_args(lease)
+        )
+    except Exception as e:
+        logger.warning("inflight renew failed node=%s: %s", lease.node.node_id, e)
+
+
+def inflight_counts() -> dict:
+    """各副本当前在途计数（控制面 / 指标使用）。"""
+    try:
+        raw = redis_cli.client.hgetall(INFLIGHT_KEY)
+    except Exception as e:
+        logger.warning("inflight counts read failed: %s", e)
+        return {}
+    return {k: int(v) for k, v in (raw or {}).items()}
+
+
+if INFLIGHT_ENABLED:
+    stats.register_provider("inflight", inflight_counts)
@@ -1,20 +1,42 @@
-from middleware.redis_client import redis_cli
 import logging
-from typing import Any, Dict, List, Mapping, Optional
+import os
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
 from model import Response, ResponseMessage, ResponseStatus, ResponseCode, Node
 
+from service import breaker, catalog, stats
 from service.errors import NoBackendError
-from service.health import HEALTH_ENABLED, HEALTH_FALLBACK, node_is_healthy
+from service.health import HEALTH_ENABLED, HEALTH_FALLBACK, pool_health
+from service.prefix_index import prefix_index
+from service.similarity import sim_index
 from service.routing import (
     filter_pool_by_requested_model,
     node_load,
     requested_openai_model,
-    select_replica_jsq_with_prefix_affinity,
+    select_replica,
 )
 
 logger = logging.getLogger(__name__)
 
+# 单次批量请求的条目上限
+BULK_MAX_ITEMS = int(os.environ.get("NVLLM_BULK_MAX_ITEMS", "1000"))
+# watch 长轮询单次最长等待
+WATCH_TIMEOUT_SEC = float(os.environ.get("NVLLM_CATALOG_WATCH_TIMEOUT_SEC", "30"))
+# SSE 单条连接最长保持时间，到期后由客户端携带 Last-Event-ID 重连
+WATCH_STREAM_MAX_SEC = float(os.environ.get("NVLLM_CATALOG_SSE_MAX_SEC", "300"))
+
+
+def _forget_removed_node(old: Node, new: Optional[Node]) -> None:
+    if new is None:
+        prefix_index.forget_node(old.node_id)
+        sim_index.forget_node(old.node_id)
+        breaker.forget_node(old.node_id)
+
+
+catalog.add_listener(_forget_removed_node)
+stats.register_provider("prefix_index", prefix_index.stats)
+stats.register_provider("similarity_index", sim_index.stats)
+
 def register_node(node: Node, trace_id: str) -> Response:
     """
     注册节点
@@ -24,12 +46,12 @@ def register_node(node: Node, trace_id: str) -> Response:
         {"message": "Node registered successfully", "status": "success", "code": 200} if node registered successfully, {"error": str(e), "status": "error", "code": 500} otherwise
     """
     try:
-        redis_cli.hset("nodes", node.node_id, node.to_dict())
+        stored = catalog.commit_upsert(node)
         return Response(
             message=ResponseMessage.SUCCESS,
             status=ResponseStatus.SUCCESS,
             code=ResponseCode.SUCCESS,
-            data=node.to_dict(),
+            data=stored.to_dict(),
             trace_id=trace_id)
     except Exception as e:
         logger.error(f"trace_id: {trace_id} Error registering node: {e}")
@@ -50,12 +72,11 @@ def get_all_nodes(trace_id: str) -> Response:
         Response object if nodes retrieved successfully, Response object with error message otherwise
     """
     try:
-        nodes = redis_cli.hgetall("nodes")
         return Response(
             message=ResponseMessage.SUCCESS, 
             status=ResponseStatus.SUCCESS, 
             code=ResponseCode.SUCCESS, 
-            data=[Node.from_dict(node) for node in nodes.values()],
+            data=catalog.load_nodes_from_redis(),
             trace_id=trace_id)
     except Exception as e:
         logger.error(f"Error getting node: {e}")
@@ -66,6 +87,62 @@ def get_all_nodes(trace_id: str) -> Response:
             error=str(e),
             trace_id=trace_id)
     
+def list_nodes(
+    model: Optional[str] = None,
+    status: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> Tuple[catalog.CatalogSnapshot, int, List[Node]]:
+    """
+    从进程内目录快照分页读取节点（登记顺序）
+    Args:
+        model: Only nodes whose served_model_name equals this value
+        status: Only nodes whose node_status equals this value
+        offset / limit: Page window over the filtered list (limit None = all)
+    Returns:
+        (snapshot, filtered total, page)
+    """
+    snap = catalog.snapshot()
+    nodes: Sequence[Node] = snap.nodes
+    if model is not None:
+        nodes = [n for n in nodes if n.served_model_name == model]
+    if status is not None:
+        nodes = [n for n in nodes if n.node_status == status]
+    offset = max(0, offset)
+    end = None if limit is None else offset + max(0, limit)
+    return snap, len(nodes), list(nodes[offset:end])
+
+
+def watch_catalog(since: Optional[int], timeout: float) -> Dict[str, Any]:
+    """
+    目录增量：since 为空时立即返回全量（reset=True）；否则等待至版本变化或超时（最长
+    NVLLM_CATALOG_WATCH_TIMEOUT_SEC），返回 since 之后新增或变更的节点与删除的 node_id。
+    历史不足以覆盖 since 时返回全量并置 reset=True。
+    """
+    if since is None:
+        snap = catalog.snapshot()
+        changes = None
+    else:
+        snap = catalog.wait_for_change(since, min(max(0.0, timeout), WATCH_TIMEOUT_SEC))
+        changes = catalog.changes_since(since)
+    if changes is None:
+        return {
+            "version": snap.version,
+            "since": since,
+            "reset": True,
+            "upserts": [n.to_dict() for n in snap.nodes],
+            "deletes": [],
+        }
+    snap, upserts, deletes = changes
+    return {
+        "version": snap.version,
+        "since": since,
+        "reset": False,
+        "upserts": [n.to_dict() for n in upserts],
+        "deletes": deletes,
+    }
+
+
 def get_node(node_id: str, trace_id: str) -> Response:
     """
     获取一个节点
@@ -75,7 +152,7 @@ def get_node(node_id: str, trace_id: str) -> Response:
         Node object if node retrieved successfully, None otherwise
     """
     try:
-        node = redis_cli.hget("nodes", node_id)
+        node = catalog.load_node(node_id)
         if node is None:
             return Response(
                 message=ResponseMessage.NOT_FOUND,
@@ -88,7 +165,7 @@ def get_node(node_id: str, trace_id: str) -> Response:
             message=ResponseMessage.SUCCESS, 
             status=ResponseStatus.SUCCESS, 
             code=ResponseCode.SUCCESS, 
-            data=Node.from_dict(node),
+            data=node,
             trace_id=trace_id)
     except Exception as e:
         logger.error(f"trace_id: {trace_id} Error getting node: {e}")
@@ -100,22 +177,48 @@ def get_node(node_id: str, trace_id: str) -> Response:
             trace_id=trace_id)
     
     
-def update_node(node: Node, trace_id: str) -> Response:
+def update_node(
+    node_id: str,
+    data: Mapping[str, Any],
+    trace_id: str,
+    expected_revision: Optional[int] = None,
+) -> Response:
     """
-    更新节点
+    部分更新节点：只写入请求中出现且取值变化的字段，未出现的字段保持原值
     Args:
-        node: Node object
+        node_id: Node ID
+        data: Fields to update (see Node.MUTABLE_FIELDS)
+        expected_revision: Compare-and-set on the node revision (None = unconditional)
     Returns:
-        {"message": "Node updated successfully", "status": "success", "code": 200} if node updated successfully, {"error": str(e), "status": "error", "code": 500} otherwise
+        Response with the updated node; code 404 if the node does not exist, 409 on revision mismatch
     """
     try:
-        redis_cli.hset("nodes", node.node_id, node.to_dict())
+        node = catalog.commit_patch(
+            node_id, Node.patch_fields(dict(data)), expected_revision
+        )
         return Response(
             message=ResponseMessage.SUCCESS, 
             status=ResponseStatus.SUCCESS, 
             code=ResponseCode.SUCCESS, 
             data=node.to_dict(),
             trace_id=trace_id)
+    except catalog.NodeNotFound:
+        return Response(
+            message=ResponseMessage.NOT_FOUND,
+            status=ResponseStatus.NOT_FOUND,
+            code=ResponseCode.NOT_FOUND,
+            error="node not found",
+            trace_id=trace_id,
+        )
+    except catalog.RevisionConflict as e:
+        return Response(
+            message=ResponseMessage.CONFLICT,
+            status=ResponseStatus.CONFLICT,
+            code=ResponseCode.CONFLICT,
+            data={"revision": e.current},
+            error=str(e),
+            trace_id=trace_id,
+        )
     except Exception as e:
         logger.error(f"trace_id: {trace_id} Error updating node: {e}")
         return Response(
@@ -125,6 +228,153 @@ def update_node(node: Node, trace_id: str) -> Response:
             error=str(e),
             trace_id=trace_id)
     
+def _item_error(index: int, node_id: Optional[str], e: Exception) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"index": index, "node_id": node_id, "error": str(e)}
+    if isinstance(e, catalog.NodeNotFound):
+        out.update(code=ResponseCode.NOT_FOUND.value, error="node not found")
+    elif isinstance(e, catalog.RevisionConflict):
+        out.update(code=ResponseCode.CONFLICT.value, revision=e.current)
+    elif isinstance(e, (TypeError, ValueError, KeyError)):
+        out["code"] = ResponseCode.BAD_REQUEST.value
+    else:
+        out["code"] = ResponseCode.ERROR.value
+    return out
+
+
+def _bulk(
+    items: Sequence[Any],
+    trace_id: str,
+    prepare,
+    commit,
+) -> Response:
+    """
+    批量写入的公共流程：先逐条校验（prepare 返回 (node_id, 提交参数)，失败记为该条 400），
+    再把通过校验的条目交给 commit 在一个 Redis 事务中写入，按输入顺序返回逐条结果。
+    """
+    if len(items) > BULK_MAX_ITEMS:
+        return Response(
+            message=ResponseMessage.BAD_REQUEST,
+            status=ResponseStatus.BAD_REQUEST,
+            code=ResponseCode.BAD_REQUEST,
+            error=f"too many items: {len(items)} > {BULK_MAX_ITEMS}",
+            trace_id=trace_id,
+        )
+    try:
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        accepted: List[int] = []
+        node_ids: List[Optional[str]] = [None] * len(items)
+        batch = []
+        for i, item in enumerate(items):
+            try:
+                node_ids[i], arg = prepare(item)
+            except (TypeError, ValueError, KeyError) as e:
+                node_id = item.get("node_id") if isinstance(item, dict) else None
+                results[i] = _item_error(i, node_id, e)
+                continue
+            accepted.append(i)
+            batch.append(arg)
+        for i, outcome in zip(accepted, commit(batch) if batch else ()):
+            if isinstance(outcome, Exception):
+                results[i] = _item_error(i, node_ids[i], outcome)
+            elif isinstance(outcome, Node):
+                results[i] = {
+                    "index": i,
+                    "node_id": node_ids[i],
+                    "code": ResponseCode.SUCCESS.value,
+                    "revision": outcome.revision,
+                }
+            else:
+                # 删除：outcome 为删除前是否存在
+                code = ResponseCode.SUCCESS if outcome else ResponseCode.NOT_FOUND
+                results[i] = {"index": i, "node_id": node_ids[i], "code": code.value}
+        failed = sum(1 for r in results if r["code"] != ResponseCode.SUCCESS.value)
+        return Response(
+            message=ResponseMessage.SUCCESS,
+            status=ResponseStatus.SUCCESS,
+            code=ResponseCode.SUCCESS,
+            data={
+                "total": len(items),
+                "succeeded": len(items) - failed,
+                "failed": failed,
+                "results": results,
+            },
+            trace_id=trace_id)
+    except Exception as e:
+        logger.error(f"trace_id: {trace_id} Error in bulk node write: {e}")
+        return Response(
+            message=ResponseMessage.ERROR,
+            status=ResponseStatus.ERROR,
+            code=ResponseCode.ERROR,
+            error=str(e),
+            trace_id=trace_id)
+
+
+def _require_object(item: Any) -> Dict[str, Any]:
+    if not isinstance(item, dict):
+        raise ValueError("item must be a JSON object")
+    return item
+
+
+def _optional_revision(value: Any) -> Optional[int]:
+    return None if value is None or value == "" else int(value)
+
+
+def _prepare_register(item: Any):
+    data = _require_object(item)
+    node = Node.from_dict(data)
+    return node.node_id, (node, _optional_revision(data.get("revision")))
+
+
+def _prepare_update(item: Any):
+    data = dict(_require_object(item))
+    node_id = data.pop("node_id", None)
+    if not node_id:
+        raise ValueError("node_id is required")
+    node_id = str(node_id)
+    expected = _optional_revision(data.pop("revision", None))
+    return node_id, (node_id, Node.patch_fields(data), expected)
+
+
+def _prepare_delete(item: Any):
+    node_id = item.get("node_id") if isinstance(item, dict) else item
+    if not isinstance(node_id, str) or not node_id:
+        raise ValueError("node_id is required")
+    return node_id, node_id
+
+
+def register_nodes(items: Sequence[Any], trace_id: str) -> Response:
+    """
+    批量注册节点（整条覆盖，可带 revision 做比较后写入）
+    Args:
+        items: Node dicts
+    Returns:
+        Response whose data.results holds one {"index", "node_id", "code", ...} per item
+    """
+    return _bulk(items, trace_id, _prepare_register, catalog.commit_upsert_many)
+
+
+def update_nodes(items: Sequence[Any], trace_id: str) -> Response:
+    """
+    批量部分更新节点：每条需含 node_id，可带 revision 做比较后写入
+    Args:
+        items: Partial node dicts
+    Returns:
+        Response whose data.results holds one {"index", "node_id", "code", ...} per item
+    """
+    return _bulk(items, trace_id, _prepare_update, catalog.commit_patch_many)
+
+
+def delete_nodes(items: Sequence[Any], trace_id: str) -> Response:
+    """
+    批量删除节点
+    Args:
+        items: node_id strings or {"node_id": ...} objects
+    Returns:
+        Response whose data.results holds one {"index", "node_id", "code"} per item (404 if absent)
+    """
+    return _bulk(items, trace_id, _prepare_delete, catalog.commit_delete_many)
+
+
 def delete_node(node_id: str, trace_id: str) -> Response:
     """
     删除节点
@@ -134,7 +384,7 @@ def delete_node(node_id: str, trace_id: str) -> Response:
         {"message": "Node deleted successfully", "status": "success", "code": 200} if node deleted successfully, {"error": str(e), "status": "error", "code": 500} otherwise    
     """
     try:
-        redis_cli.hdel("nodes", node_id)
+        catalog.commit_delete(node_id)
         return Response(
             message=ResponseMessage.SUCCESS, 
             status=ResponseStatus.SUCCESS, 
@@ -159,7 +409,7 @@ def get_node_status(node_id: str, trace_id: str) -> Response:
         Response object if node status retrieved successfully, Response object with error message otherwise
     """
     try:
-        node = redis_cli.hget("nodes", node_id)
+        node = catalog.load_node(node_id)
         if node is None:
             return Response(
                 message=ResponseMessage.NOT_FOUND,
@@ -172,7 +422,7 @@ def get_node_status(node_id: str, trace_id: str) -> Response:
             message=ResponseMessage.SUCCESS, 
             status=ResponseStatus.SUCCESS, 
             code=ResponseCode.SUCCESS, 
-            data=Node.from_dict(node),
+            data=node,
             trace_id=trace_id)
     except Exception as e:
         logger.error(f"Error getting node status: {e}")
@@ -183,15 +433,34 @@ def get_node_status(node_id: str, trace_id: str) -> Response:
             error=str(e),
             trace_id=trace_id)
         
+def get_gateway_stats(trace_id: str) -> Response:
+    """
+    获取本网关进程的运行指标（连接池等）
+    Args:
+        None
+    Returns:
+        Response object with per-component stats
+    """
+    try:
+        return Response(
+            message=ResponseMessage.SUCCESS,
+            status=ResponseStatus.SUCCESS,
+            code=ResponseCode.SUCCESS,
+            data=stats.collect(),
+            trace_id=trace_id)
+    except Exception as e:
+        logger.error(f"trace_id: {trace_id} Error collecting gateway stats: {e}")
+        return Response(
+            message=ResponseMessage.ERROR,
+            status=ResponseStatus.ERROR,
+            code=ResponseCode.ERROR,
+            error=str(e),
+            trace_id=trace_id)
+
+
 def _nodes_from_redis() -> List[Node]:
-    raw = redis_cli.hgetall("nodes")
-    out = []
-    for v in raw.values():
-        try:
-            out.append(Node.from_dict(v))
-        except (TypeError, ValueError, KeyError) as e:
-            logger.warning("skip invalid node record: %s", e)
-    return out
+    """当前目录快照中的全部副本（仅在目录版本变化时访问 Redis）。"""
+    return list(catalog.snapshot().nodes)
 
 
 def ordered_inference_candidates(
@@ -201,24 +470,17 @@ def ordered_inference_candidates(
     headers: Optional[Mapping[str, str]] = None,
 ) -> List[Node]:
     """
-    返回按优先级排序的副本列表：亲和/JSQ 首选在前，其余按负载升序，供上游故障重试。
+    返回按优先级排序的副本列表：选路策略的首选在前，其余按负载升序，供上游故障重试。
     """
+    snap = catalog.snapshot()
     if target_node_id:
-        raw = redis_cli.hget("nodes", target_node_id)
-        if not raw:
+        node = snap.get(target_node_id)
+        if node is None:
             raise NoBackendError(
                 f"target node {target_node_id} not found",
                 "TARGET_NOT_FOUND",
             )
-        try:
-            node = Node.from_dict(raw)
-        except (TypeError, ValueError, KeyError) as e:
-            logger.error("resolve_backend_node by id failed: %s", e)
-            raise NoBackendError(
-                f"target node {target_node_id} invalid record",
-                "TARGET_NOT_FOUND",
-            ) from e
-        if HEALTH_ENABLED and not node_is_healthy(node):
+        if HEALTH_ENABLED and not pool_health([node])[node.node_id]:
             raise NoBackendError(
                 f"target node {target_node_id} failed health check",
                 "TARGET_UNHEALTHY",
@@ -226,20 +488,17 @@ def ordered_inference_candidates(
         return [node]
 
     if trace_id:
-        raw = redis_cli.hget("nodes", trace_id)
-        if raw:
-            try:
-                node = Node.from_dict(raw)
-                if not HEALTH_ENABLED or node_is_healthy(node):
-                    return [node]
-                logger.warning(
-                    "sticky node %s unhealthy, failing over to pool",
-                    trace_id,
-                )
-            except (TypeError, ValueError, KeyError):
-                pass
-
-    candidates = _nodes_from_redis()
+        node = snap.get(trace_id)
+        if node is not None:
+            healthy = not HEALTH_ENABLED or pool_health([node])[node.node_id]
+            if healthy and breaker.allows(node):
+                return [node]
+            logger.warning(
+                "sticky node %s unhealthy, failing over to pool",
+                trace_id,
+            )
+
+    candidates = list(snap.nodes)
     if not candidates:
         raise NoBackendError("no nodes registered in catalog", "NO_REGISTRY")
 
@@ -254,7 +513,8 @@ def ordered_inference_candidates(
         )
 
     if HEALTH_ENABLED:
-        healthy = [n for n in pool if node_is_healthy(n)]
+        health = pool_health(pool)
+        healthy = [n for n in pool if health.get(n.node_id, True)]
         if healthy:
             pool = healthy
         elif HEALTH_FALLBACK:
@@ -267,7 +527,14 @@ def ordered_inference_candidates(
                 "ALL_UNHEALTHY",
             )
 
-    primary = select_replica_jsq_with_prefix_affinity(pool, body)
+    pool = breaker.filter_pool(pool)
+    if not pool:
+        raise NoBackendError(
+            "all replicas ejected by circuit breaker",
+            "ALL_UNHEALTHY",
+        )
+
+    primary = select_replica(pool, body, headers, model=req_model)
     if primary is None:
         raise NoBackendError("could not select replica", "NO_REGISTRY")
     others = sorted(
@@ -0,0 +1,133 @@
+"""
+网关侧前缀缓存索引：按固定字符块切分 prompt 文本并做链式哈希，记录每条块链最近由哪些副本服务过。
+
+- 块链哈希 h_i = H(h_{i-1} || block_i) 唯一标识前缀树上的一个节点（完整路径），因此索引以扁平
+  字典存储前缀树：查找时逐块下行，遇到缺失即为最长匹配；
+- 每个树节点最多记录 NVLLM_PREFIX_INDEX_REPLICAS 个副本及其最近时间，超过 TTL 的记录视为失效；
+- 树节点总数受 NVLLM_PREFIX_INDEX_MAX_BLOCKS 约束，按 LRU 淘汰（被淘汰节点之下的路径自然不可达并随后淘汰）。
+
+仅为进程内视图，与 vLLM 实际 KV 内容是近似关系：用于提高命中概率，不作为正确性依据。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+PREFIX_INDEX_ENABLED = os.environ.get("NVLLM_PREFIX_INDEX", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+BLOCK_CHARS = max(16, int(os.environ.get("NVLLM_PREFIX_INDEX_BLOCK_CHARS", "512")))
+MAX_CHARS = int(os.environ.get("NVLLM_PREFIX_INDEX_MAX_CHARS", "65536"))
+MAX_BLOCKS = max(1, int(os.environ.get("NVLLM_PREFIX_INDEX_MAX_BLOCKS", "100000")))
+REPLICAS_PER_BLOCK = max(1, int(os.environ.get("NVLLM_PREFIX_INDEX_REPLICAS", "4")))
+ENTRY_TTL_SEC = float(os.environ.get("NVLLM_PREFIX_INDEX_TTL_SEC", "600"))
+
+
+def block_hashes(text: str) -> List[bytes]:
+    """整块切分并计算链式哈希；不足一块的尾部不参与（与引擎按块缓存一致）。"""
+    if MAX_CHARS > 0:
+        text = text[:MAX_CHARS]
+    out: List[bytes] = []
+    prev = b""
+    for start in range(0, len(text) - BLOCK_CHARS + 1, BLOCK_CHARS):
+        block = text[start:start + BLOCK_CHARS].encode("utf-8")
+        prev = hashlib.blake2b(prev + block, digest_size=16).digest()
+        out.append(prev)
+    return out
+
+
+class PrefixIndex:
+    def __init__(
+        self,
+        max_blocks: int = MAX_BLOCKS,
+        replicas_per_block: int = REPLICAS_PER_BLOCK,
+        ttl_sec: float = ENTRY_TTL_SEC,
+    ):
+        self.max_blocks = max_blocks
+        self.replicas_per_block = replicas_per_block
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[bytes, Dict[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def longest_match(
+        self,
+        hashes: List[bytes],
+        allowed: Optional[Iterable[str]] = None,
+    ) -> Dict[str, int]:
+        """返回 node_id -> 已匹配的连续块数（仅含 allowed 中的副本）。"""
+        allowed_set = set(allowed) if allowed is not None else None
+        now = time.monotonic()
+        matched: Dict[str, int] = {}
+        with self._lock:
+            self.lookups += 1
+            for depth, h in enumerate(hashes, start=1):
+                entry = self._entries.get(h)
+                if entry is None:
+                    break
+                live = [
+                    node_id
+                    for node_id, ts in entry.items()
+                    if now - ts < self.ttl_sec
+                    and (allowed_set is None or node_id in allowed_set)
+                ]
+                if not live:
+                    break
+                self._entries.move_to_end(h)
+                for node_id in live:
+                    matched[node_id] = depth
+            if matched:
+                self.hits += 1
+        return matched
+
+    def record(self, hashes: List[bytes], node_id: str) -> None:
+        """记录 node_id 服务过整条块链。"""
+        if not hashes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for h in hashes:
+                entry = self._entries.get(h)
+                if entry is None:
+                    entry = {}
+                    self._entries[h] = entry
+                else:
+                    self._entries.move_to_end(h)
+                entry[node_id] = now
+                if len(entry) > self.replicas_per_block:
+                    oldest = min(entry, key=entry.get)
+                    del entry[oldest]
+            while len(self._entries) > self.max_blocks:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def forget_node(self, node_id: str) -> None:
+        """副本下线时移除其记录（空节点留待 LRU 淘汰）。"""
+        with self._lock:
+            for entry in self._entries.values():
+                entry.pop(node_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "blocks": len(self._entries),
+                "max_blocks": self.max_blocks,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": (self.hits / self.lookups) if self.lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+prefix_index = PrefixIndex()
@@ -0,0 +1,407 @@
+"""
+按租户（JWT 主体）的分布式令牌桶限流：请求数 / 秒 与 prompt+completion tokens / 分钟。
+
+- 两个桶存于 Redis Hash（tokens, ts），由一段 Lua 脚本以 Redis TIME 补充、扣减，跨网关一致；
+- 本地预检：每次访问 Redis 批量领取 NVLLM_RATELIMIT_LOCAL_BATCH 个请求许可，在
+  NVLLM_RATELIMIT_LOCAL_LEASE_MS 内本地扣减，多数请求不访问 Redis；被拒后在 Retry-After 内本地直接拒绝；
+- token 用量在响应结束后才可知（非流式取 usage，流式取末尾 usage 或按事件数估算），先在本地累加，
+  随下一次领取许可或后台每 NVLLM_RATELIMIT_FLUSH_MS 批量写入；token 桶余额 <= 0 时拒绝新请求（允许透支一次）；
+- 租户为 JWT 主体；无有效 JWT 时按其它凭据（Authorization 头摘要，如 vLLM api key）限流，
+  无任何凭据时按客户端地址限流（/v1 默认不要求网关 JWT，省略请求头不能绕过限流）。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from middleware.auth import decode_token
+from middleware.redis_client import redis_cli
+from service import stats
+from service.errors import RateLimited
+from service.response_cache import caller_scope
+from service.routing import _routing_text
+
+logger = logging.getLogger(__name__)
+
+RATELIMIT_RPS = float(os.environ.get("NVLLM_RATELIMIT_RPS", "0"))
+RATELIMIT_BURST = float(
+    os.environ.get("NVLLM_RATELIMIT_BURST", str(max(1.0, RATELIMIT_RPS * 2)))
+)
+RATELIMIT_TPM = float(os.environ.get("NVLLM_RATELIMIT_TPM", "0"))
+RATELIMIT_ENABLED = RATELIMIT_RPS > 0 or RATELIMIT_TPM > 0
+KEY_PREFIX = os.environ.get("NVLLM_RATELIMIT_PREFIX", "nvllm:rl:")
+LOCAL_BATCH = max(1, int(os.environ.get("NVLLM_RATELIMIT_LOCAL_BATCH", "5")))
+LOCAL_LEASE_SEC = float(os.environ.get("NVLLM_RATELIMIT_LOCAL_LEASE_MS", "500")) / 1000
+FLUSH_SEC = max(0.05, float(os.environ.get("NVLLM_RATELIMIT_FLUSH_MS", "1000")) / 1000)
+# 本地租户状态条目数超过该值时清理过期条目
+MAX_SUBJECTS = 10000
+# 流式响应未带 usage 时，prompt 按每 token 约 4 字符估算
+_CHARS_PER_TOKEN = 4
+
+# KEYS: request bucket, token bucket
+# ARGV: rps, burst, want, tpm, charge
+# 返回 {granted, retry_ms}
+_LIMIT_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local function refill(key, rate_per_ms, cap)
+  local v = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(v[1])
+  local ts = tonumber(v[2])
+  if tokens == nil then
+    tokens, ts = cap, now
+  end
+  tokens = math.min(cap, tokens + math.max(0, now - ts) * rate_per_ms)
+  return tokens
+end
+
+local function save(key, tokens, rate_per_ms, cap)
+  redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(cap / rate_per_ms) * 2 + 1000)
+end
+
+local rps, burst, want = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tpm, charge = tonumber(ARGV[4]), tonumber(ARGV[5])
+
+if tpm > 0 then
+  local rate = tpm / 60000
+  local tokens = refill(KEYS[2], rate, tpm) - charge
+  save(KEYS[2], tokens, rate, tpm)
+  if tokens <= 0 then
+    return {0, math.ceil((1 - tokens) / rate)}
+  end
+end
+
+if rps <= 0 or want <= 0 then
+  return {want, 0}
+end
+local rate = rps / 1000
+local tokens = refill(KEYS[1], rate, burst)
+local granted = math.min(want, math.floor(tokens))
+if granted < 1 then
+  save(KEYS[1], tokens, rate, burst)
+  return {0, math.ceil((1 - tokens) / rate)}
+end
+save(KEYS[1], tokens - granted, rate, burst)
+return {granted, 0}
+"""
+
+
+class _Local:
+    __slots__ = ("permits", "expires", "blocked_until", "pending_tokens")
+
+    def __init__(self):
+        self.permits = 0
+        self.expires = 0.0
+        self.blocked_until = 0.0
+        self.pending_tokens = 0
+
+
+_local: Dict[str, _Local] = {}
+_lock = threading.Lock()
+_script = None
+_async_script = None
+_flusher: Optional[threading.Thread] = None
+_metrics: Dict[str, int] = {
+    "allowed_local": 0,
+    "allowed_redis": 0,
+    "limited": 0,
+    "redis_calls": 0,
+    "redis_errors": 0,
+    "tokens_charged": 0,
+}
+
+
+def _keys(subject: str) -> List[str]:
+    return [f"{KEY_PREFIX}req:{subject}", f"{KEY_PREFIX}tok:{subject}"]
+
+
+def _call(subject: str, want: int, charge: int):
+    global _script
+    if _script is None:
+        _script = redis_cli.client.register_script(_LIMIT_LUA)
+    return _script(
+        keys=_keys(subject),
+        args=[RATELIMIT_RPS, RATELIMIT_BURST, want, RATELIMIT_TPM, charge],
+    )
+
+
+async def _acall(subject: str, want: int, charge: int):
+    global _async_script
+    if _async_script is None:
+        _async_script = redis_cli.async_client.register_script(_LIMIT_LUA)
+    return await _async_script(
+        keys=_keys(subject),
+        args=[RATELIMIT_RPS, RATELIMIT_BURST, want, RATELIMIT_TPM, charge],
+    )
+
+
+def subject_of(headers: Mapping[str, str], client: Optional[str] = None) -> str:
+    """限流主体：JWT 主体，否则凭据摘要，否则客户端地址（均无时为 anonymous）。"""
+    claims = decode_token(headers.get("Authorization"))
+    subject = (claims.get("sub") or claims.get("username")) if claims else None
+    if subject:
+        return str(subject)
+    scope = caller_scope(headers)
+    if scope:
+        return f"key:{scope[:32]}"
+    return f"ip:{client}" if client else "anonymous"
+
+
+def _prune(now: float) -> None:
+    """丢弃无待写用量、租约与拒绝窗口均已过期的租户（持锁调用）。"""
+    for subject in [
+        s
+        for s, st in _local.items()
+        if not st.pending_tokens and st.expires <= now and st.blocked_until <= now
+    ]:
+        del _local[subject]
+
+
+def _precheck(subject: str, now: float) -> Tuple[_Local, Optional[int]]:
+    """
+    本地预检：拒绝窗口内抛 RateLimited；租约内有许可时返回 (st, None)；
+    否则返回 (st, 待写回的 token 数)，由调用方访问 Redis。
+    """
+    with _lock:
+        st = _local.get(subject)
+        if st is None:
+            if len(_local) >= MAX_SUBJECTS:
+                _prune(now)
+            st = _Local()
+            _local[subject] = st
+        if st.blocked_until > now:
+            _metrics["limited"] += 1
+            raise RateLimited(
+                f"rate limit exceeded for {subject}",
+                retry_after=st.blocked_until - now,
+            )
+        if st.permits > 0 and now < st.expires:
+            st.permits -= 1
+            _metrics["allowed_local"] += 1
+            return st, None
+        pending, st.pending_tokens = st.pending_tokens, 0
+        _metrics["redis_calls"] += 1
+    return st, pending
+
+
+def _want() -> int:
+    return min(LOCAL_BATCH, max(1, int(RATELIMIT_BURST))) if RATELIMIT_RPS > 0 else 1
+
+
+def _failed(st: _Local, pending: int, err: Exception) -> None:
+    with _lock:
+        _metrics["redis_errors"] += 1
+        st.pending_tokens += pending
+    logger.warning("rate limit check failed, allowing: %s", err)
+
+
+def _settle(subject: str, st: _Local, now: float, reply: Any) -> None:
+    granted, retry_ms = int(reply[0]), int(reply[1])
+    with _lock:
+        if granted < 1:
+            st.permits = 0
+            st.blocked_until = now + retry_ms / 1000
+            _metrics["limited"] += 1
+            raise RateLimited(
+                f"rate limit exceeded for {subject}", retry_after=retry_ms / 1000
+            )
+        st.permits = granted - 1
+        st.expires = now + LOCAL_LEASE_SEC
+        _metrics["allowed_redis"] += 1
+
+
+def check(headers: Mapping[str, str], client: Optional[str] = None) -> Optional[str]:
+    """
+    请求入口调用：超限抛 RateLimited（429 + Retry-After）；返回限流主体（未开启时为 None），
+    供响应结束后 charge 记账。client 为客户端地址（无凭据时的限流主体）。Redis 不可用时放行。
+    """
+    if not RATELIMIT_ENABLED:
+        return None
+    subject = subject_of(headers, client)
+    now = time.monotonic()
+    st, pending = _precheck(subject, now)
+    if pending is None:
+        return subject
+    try:
+        reply = _call(subject, _want(), pending)
+    except Exception as e:
+        _failed(st, pending, e)
+        return subject
+    _settle(subject, st, now, reply)
+    return subject
+
+
+async def acheck(
+    headers: Mapping[str, str], client: Optional[str] = None
+) -> Optional[str]:
+    """check 的 asyncio 版本（Redis 层使用 redis.asyncio）。"""
+    if not RATELIMIT_ENABLED:
+        return None
+    subject = subject_of(headers, client)
+    now = time.monotonic()
+    st, pending = _precheck(subject, now)
+    if pending is None:
+        return subject
+    try:
+        reply = await _acall(subject, _want(), pending)
+    except Exception as e:
+        _failed(st, pending, e)
+        return subject
+    _settle(subject, st, now, reply)
+    return subject
+
+
+def charge(subject: Optional[str], tokens: int) -> None:
+    """记录本次请求消耗的 token（本地累加，批量写回）。"""
+    if subject is None or RATELIMIT_TPM <= 0 or tokens <= 0:
+        return
+    with _lock:
+        st = _local.get(subject)
+        if st is None:
+            st = _Local()
+            _local[subject] = st
+        st.pending_tokens += tokens
+        _metrics["tokens_charged"] += tokens
+    _ensure_flusher()
+
+
+def flush() -> None:
+    """把各租户累计的 token 用量一次 pipeline 写回 Redis。"""
+    with _lock:
+        pending = {s: st.pending_tokens for s, st in _local.items() if st.pending_tokens}
+        for s in pending:
+            _local[s].pending_tokens = 0
+    if not pending:
+        return
+    global _script
+    try:
+        if _script is None:
+            _script = redis_cli.client.register_script(_LIMIT_LUA)
+        pipe = redis_cli.client.pipeline(transaction=False)
+        for subject, tokens in pending.items():
+            _script(
+                keys=_keys(subject),
+                args=[0, 0, 0, RATELIMIT_TPM, tokens],
+                client=pipe,
+            )
+        pipe.execute()
+        with _lock:
+            _metrics["redis_calls"] += 1
+    except Exception as e:
+        logger.warning("rate limit flush failed: %s", e)
+        with _lock:
+            _metrics["redis_errors"] += 1
+            for subject, tokens in pending.items():
+                _local.setdefault(subject, _Local()).pending_tokens += tokens
+
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(FLUSH_SEC)
+        flush()
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(
+            target=_flush_loop, name="nvllm-ratelimit-flush", daemon=True
+        )
+        _flusher.start()
+
+
+def usage_tokens(data: Any) -> int:
+    """OpenAI 响应中的 usage.total_tokens（或 prompt+completion）。"""
+    if not isinstance(data, dict):
+        return 0
+    usage = data.get("usage")
+    if not isinstance(usage, dict):
+        return 0
+    total = usage.get("total_tokens")
+    if total is None:
+        total = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+    try:
+        return int(total)
+    except (TypeError, ValueError):
+        return 0
+
+
+def charge_result(subject: Optional[str], result: Any) -> None:
+    """非流式结果记账：(data, status) 或带 body 的 RawResponse。"""
+    if subject is None or RATELIMIT_TPM <= 0:
+        return
+    if isinstance(result, tuple) and len(result) == 2:
+        data = result[0]
+    else:
+        body = getattr(result, "body", None)
+        if not isinstance(body, (bytes, str)):
+            return
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return
+    charge(subject, usage_tokens(data))
+
+
+class StreamMeter:
+    """流式响应记账：优先取末尾事件的 usage，否则 prompt 字符数 / 4 + 数据事件数。"""
+
+    __slots__ = ("subject", "prompt_estimate", "events", "tail", "done")
+
+    def __init__(self, subject: str, body: Optional[Dict[str, Any]]):
+        self.subject = subject
+        self.prompt_estimate = math.ceil(len(_routing_text(body)) / _CHARS_PER_TOKEN)
+        self.events = 0
+        self.tail = b""
+        self.done = False
+
+    def observe(self, chunk: bytes) -> None:
+        self.events += chunk.count(b"data:")
+        self.tail = (self.tail + chunk)[-4096:]
+
+    def finish(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        tokens = 0
+        for line in reversed(self.tail.split(b"\n")):
+            line = line.strip()
+            if line.startswith(b"data:") and b'"usage"' in line:
+                try:
+                    tokens = usage_tokens(json.loads(line[5:]))
+                except ValueError:
+                    tokens = 0
+                if tokens:
+                    break
+        if not tokens:
+            # 末尾的 [DONE] 不计
+            tokens = self.prompt_estimate + max(0, self.events - 1)
+        charge(self.subject, tokens)
+
+
+def meter(subject: Optional[str], body: Optional[Dict[str, Any]]) -> Optional[StreamMeter]:
+    if subject is None or RATELIMIT_TPM <= 0:
+        return None
+    return StreamMeter(subject, body)
+
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_metrics)
+        out["subjects"] = len(_local)
+    return out
+
+
+if RATELIMIT_ENABLED:
+    stats.register_provider("ratelimit", get_stats)
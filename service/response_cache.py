@@ -0,0 +1,193 @@
+"""
+确定性补全的响应缓存：temperature=0 的非流式 /v1 请求按规范化请求体做键，命中时不经过选路与 GPU。
+
+- 仅对 NVLLM_RESPONSE_CACHE_MODELS 中列出的模型池生效（`*` 表示所有模型；为空则关闭）；
+- 键 = sha256(路径 + 调用方 + 规范化 JSON)：去掉 None 值与不影响输出的字段（user / stream 等），
+  整数值浮点数归一（0.0 与 0 同键），按键排序；调用方为 Authorization 头的摘要，命中不会越过
+  上游鉴权（vLLM --api-key）或跨租户返回；NVLLM_RESPONSE_CACHE_SHARED=1 时所有调用方共享；
+- 请求头 Cache-Control：no-store 不读不写，no-cache 或 max-age=0 跳过读取但写回，max-age=N 只接受 N 秒内的结果；
+  指定 X-Target-Node-Id 的请求不缓存；
+- 只缓存上游 200 响应，响应头 X-NVLLM-Cache 为 HIT / MISS / BYPASS，命中时附带 Age。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+
+from cache import CacheManager
+from service import stats
+from service.routing import requested_openai_model
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_MODELS = frozenset(
+    m.strip()
+    for m in os.environ.get("NVLLM_RESPONSE_CACHE_MODELS", "").split(",")
+    if m.strip()
+)
+RESPONSE_CACHE_ENABLED = bool(RESPONSE_CACHE_MODELS)
+# 单条响应超过该字节数不缓存
+MAX_ITEM_BYTES = int(os.environ.get("NVLLM_RESPONSE_CACHE_MAX_ITEM_BYTES", "1048576"))
+# 1 时缓存键不区分调用方（仅适用于网关前已统一鉴权、各租户可互见结果的部署）
+RESPONSE_CACHE_SHARED = os.environ.get("NVLLM_RESPONSE_CACHE_SHARED", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+_cache = CacheManager(
+    prefix=os.environ.get("NVLLM_RESPONSE_CACHE_PREFIX", "nvllm:rc:"),
+    ttl_sec=float(os.environ.get("NVLLM_RESPONSE_CACHE_TTL_SEC", "600")),
+    local_ttl_sec=float(os.environ.get("NVLLM_RESPONSE_CACHE_LOCAL_TTL_SEC", "60")),
+    local_max_entries=int(
+        os.environ.get("NVLLM_RESPONSE_CACHE_LOCAL_ENTRIES", "10000")
+    ),
+    local_max_bytes=int(
+        os.environ.get("NVLLM_RESPONSE_CACHE_LOCAL_BYTES", str(64 * 1024 * 1024))
+    ),
+    use_redis=os.environ.get("NVLLM_RESPONSE_CACHE_REDIS", "1").lower()
+    in ("1", "true", "yes"),
+)
+
+# 不影响生成结果的字段
+_VOLATILE_FIELDS = frozenset(("user", "stream", "stream_options"))
+
+
+@dataclass
+class CachePlan:
+    key: str
+    lookup: bool
+    max_age: Optional[float] = None
+
+
+@dataclass
+class RawResponse:
+    """已序列化的 JSON 响应（缓存命中或可缓存的上游响应），由 API 层原样返回。"""
+
+    body: bytes
+    status: int
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def caller_scope(headers: Mapping[str, str]) -> str:
+    """调用方标识：Authorization 头的摘要（无凭据时为空串）。"""
+    auth = headers.get("Authorization") or ""
+    return hashlib.sha256(auth.encode("utf-8")).hexdigest() if auth else ""
+
+
+def cache_key(path: str, body: Dict[str, Any], scope: str = "") -> str:
+    canon = _canonical({k: v for k, v in body.items() if k not in _VOLATILE_FIELDS})
+    payload = json.dumps(canon, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{path}\n{scope}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def _cache_control(headers: Mapping[str, str]) -> Dict[str, Optional[str]]:
+    out: Dict[str, Optional[str]] = {}
+    for part in (headers.get("Cache-Control") or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            out[name.lower()] = value.strip() or None
+    return out
+
+
+def _is_deterministic(body: Dict[str, Any]) -> bool:
+    t = body.get("temperature")
+    return isinstance(t, (int, float)) and not isinstance(t, bool) and t == 0
+
+
+def plan(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers: Mapping[str, str],
+) -> Optional[CachePlan]:
+    """请求可缓存时返回 CachePlan，否则 None（照常转发）。"""
+    if not RESPONSE_CACHE_ENABLED or not isinstance(body, dict):
+        return None
+    if body.get("stream") or not _is_deterministic(body):
+        return None
+    if headers.get("X-Target-Node-Id") or headers.get("X-Target-Node-ID"):
+        return None
+    model = requested_openai_model(body, headers) or ""
+    if "*" not in RESPONSE_CACHE_MODELS and model not in RESPONSE_CACHE_MODELS:
+        return None
+    cc = _cache_control(headers)
+    if "no-store" in cc:
+        return None
+    max_age: Optional[float] = None
+    if cc.get("max-age"):
+        try:
+            max_age = float(cc["max-age"])
+        except ValueError:
+            max_age = None
+    try:
+        key = cache_key(
+            path, body, "" if RESPONSE_CACHE_SHARED else caller_scope(headers)
+        )
+    except (TypeError, ValueError) as e:
+        logger.debug("response cache key failed: %s", e)
+        return None
+    lookup = "no-cache" not in cc and max_age != 0
+    return CachePlan(key=key, lookup=lookup, max_age=max_age)
+
+
+def _to_hit(p: CachePlan, entry) -> Optional[RawResponse]:
+    if entry is None:
+        return None
+    if p.max_age is not None and entry.age > p.max_age:
+        return None
+    return RawResponse(
+        body=entry.value,
+        status=200,
+        headers={"X-NVLLM-Cache": "HIT", "Age": str(int(entry.age))},
+    )
+
+
+def lookup(p: CachePlan) -> Optional[RawResponse]:
+    if not p.lookup:
+        return None
+    return _to_hit(p, _cache.get_entry(p.key))
+
+
+async def alookup(p: CachePlan) -> Optional[RawResponse]:
+    if not p.lookup:
+        return None
+    return _to_hit(p, await _cache.aget_entry(p.key))
+
+
+def _miss(p: CachePlan, body: bytes) -> RawResponse:
+    return RawResponse(
+        body=body,
+        status=200,
+        headers={"X-NVLLM-Cache": "MISS" if p.lookup else "BYPASS"},
+    )
+
+
+def store(p: CachePlan, body: bytes) -> RawResponse:
+    """写入上游 200 响应并返回带 MISS / BYPASS 头的原样响应。"""
+    if len(body) <= MAX_ITEM_BYTES:
+        _cache.set_cache(p.key, body)
+    return _miss(p, body)
+
+
+async def astore(p: CachePlan, body: bytes) -> RawResponse:
+    if len(body) <= MAX_ITEM_BYTES:
+        await _cache.aset_cache(p.key, body)
+    return _miss(p, body)
+
+
+if RESPONSE_CACHE_ENABLED:
+    stats.register_provider("response_cache", _cache.stats)
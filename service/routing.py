@@ -1,18 +1,32 @@
 """
-大规模推理入口：前缀亲和（稳定哈希）+ 最短队列回退（JSQ）。
+大规模推理入口：可插拔选路策略，默认前缀亲和（一致性哈希环）+ 最短队列回退（JSQ）。
 
-- 同前缀请求稳定映射到同一副本，利于 prefix KV 局部性；
-- 当亲和副本负载高于全局最小负载超过 margin 时，改派到负载最低副本，避免热点。
+- 前缀索引记录各块链前缀最近由哪个副本服务，共享长系统提示的请求优先落到已缓存最长前缀的副本；
+- 同前缀请求稳定映射到同一副本，利于 prefix KV 局部性；副本增减或被健康摘除时只有约 1/N 的前缀迁移；
+- 当亲和副本负载高于全局最小负载超过 margin 时，改派到负载最低副本，避免热点；
+  负载为综合分：running / waiting、KV 缓存利用率（随 prompt 长度放大）与抢占速率。
+
+其余策略（round_robin / weighted / least_load / minimal / random / sim_prompt（MinHash LSH 近似重复）/ p2c）
+通过同一 RoutingStrategy 接口注册，可按模型池或按请求选择；`python -m service.routing` 输出对比。
 """
 from __future__ import annotations
 
-import hashlib
+import itertools
 import json
 import logging
 import os
-from typing import Any, Dict, List, Mapping, Optional
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import replace
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
 
-from model.node import Node
+from model.node import Node, NodeInfo
+from model.vllm import VllmStrategy
+from service.hashring import ring_for
+from service.prefix_index import PREFIX_INDEX_ENABLED, block_hashes, prefix_index
+from service.similarity import signature, sim_index
 
 logger = logging.getLogger(__name__)
 
@@ -22,21 +36,49 @@ PREFIX_MAX_CHARS = int(os.environ.get("NVLLM_ROUTING_PREFIX_CHARS", "8192"))
 # 亲和副本允许比全局 min_load 高出的「在途量」上限，超过则 JSQ 回退
 AFFINITY_LOAD_MARGIN = int(os.environ.get("NVLLM_AFFINITY_LOAD_MARGIN", "2"))
 
+# 综合负载分（单位约等于「一个在途请求」）：
+#   running + W_wait·waiting + W_kv·kv·(1 + prompt/LONG) + [kv≥高水位]·PENALTY + W_pre·preemptions/s
+#   + W_ttft·TTFT p95（秒，侧车按抓取窗口计算）
+LOAD_WAITING_WEIGHT = float(os.environ.get("NVLLM_LOAD_WAITING_WEIGHT", "1"))
+LOAD_KV_WEIGHT = float(os.environ.get("NVLLM_LOAD_KV_WEIGHT", "4"))
+LOAD_KV_HIGH_WATERMARK = float(os.environ.get("NVLLM_LOAD_KV_HIGH_WATERMARK", "0.9"))
+LOAD_KV_SATURATED_PENALTY = float(
+    os.environ.get("NVLLM_LOAD_KV_SATURATED_PENALTY", "8")
+)
+LOAD_LONG_PROMPT_CHARS = max(
+    1, int(os.environ.get("NVLLM_LOAD_LONG_PROMPT_CHARS", "16384"))
+)
+LOAD_PREEMPTION_WEIGHT = float(os.environ.get("NVLLM_LOAD_PREEMPTION_WEIGHT", "10"))
+LOAD_TTFT_WEIGHT = float(os.environ.get("NVLLM_LOAD_TTFT_WEIGHT", "0"))
+
+
+def load_score(n: Node, prompt_chars: int = 0) -> float:
+    """
+    综合负载：排队量 + KV 缓存压力 + 抢占速率（+ 可选的近期 TTFT p95）。
+    KV 项随 prompt 长度放大，长 prompt 会避开 KV 将满、即将频繁抢占的副本。
+    """
+    info = n.node_info
+    kv = min(max(float(info.kv_cache), 0.0), 1.0)
+    score = int(info.running) + LOAD_WAITING_WEIGHT * int(info.waiting)
+    score += LOAD_KV_WEIGHT * kv * (1.0 + prompt_chars / LOAD_LONG_PROMPT_CHARS)
+    if kv >= LOAD_KV_HIGH_WATERMARK:
+        score += LOAD_KV_SATURATED_PENALTY
+    score += LOAD_PREEMPTION_WEIGHT * max(float(info.preemption_rate), 0.0)
+    if LOAD_TTFT_WEIGHT:
+        score += LOAD_TTFT_WEIGHT * max(float(info.ttft_p95_ms), 0.0) / 1000
+    return score
 
-def _node_load(n: Node) -> int:
-    return int(n.node_info.running) + int(n.node_info.waiting)
 
+def _node_load(n: Node) -> float:
+    return load_score(n)
 
-def node_load(n: Node) -> int:
+
+def node_load(n: Node) -> float:
     """对外暴露的负载标量，供排序与重试顺序使用。"""
     return _node_load(n)
 
 
-def openai_routing_key(body: Optional[Dict[str, Any]]) -> str:
-    """
-    从 OpenAI 兼容 body 提取用于路由的稳定前缀文本。
-    无 messages/prompt 时用 sort_keys JSON 截断，避免各网关字段顺序不一致。
-    """
+def _routing_text(body: Optional[Dict[str, Any]]) -> str:
     if not body:
         return ""
     try:
@@ -61,7 +103,15 @@ def openai_routing_key(body: Optional[Dict[str, Any]]) -> str:
     except (TypeError, ValueError) as e:
         logger.debug("openai_routing_key fallback: %s", e)
         s = json.dumps(body, ensure_ascii=False, sort_keys=True)
-    s = s.strip()
+    return s.strip()
+
+
+def openai_routing_key(body: Optional[Dict[str, Any]]) -> str:
+    """
+    从 OpenAI 兼容 body 提取用于路由的稳定前缀文本。
+    无 messages/prompt 时用 sort_keys JSON 截断，避免各网关字段顺序不一致。
+    """
+    s = _routing_text(body)
     if len(s) > PREFIX_MAX_CHARS:
         s = s[:PREFIX_MAX_CHARS]
     return s
@@ -102,44 +152,441 @@ def filter_pool_by_requested_model(
     return [n for n in pool if (n.served_model_name or "").strip() == rm]
 
 
-def _stable_bucket(key: str, n_slots: int) -> int:
-    if n_slots <= 0:
-        return 0
-    h = hashlib.sha256(key.encode("utf-8")).digest()[:8]
-    return int.from_bytes(h, "big", signed=False) % n_slots
+def affinity_node(pool: List[Node], key: str) -> Optional[Node]:
+    """前缀键在 pool 成员构成的带权哈希环上对应的副本。"""
+    if not pool:
+        return None
+    by_id = {n.node_id: n for n in pool}
+    ring = ring_for((n.node_id, n.weight) for n in by_id.values())
+    return by_id.get(ring.lookup(key))
 
 
-def select_replica_jsq_with_prefix_affinity(
+def _longest_cached_prefix(
     pool: List[Node],
-    body: Optional[Dict[str, Any]],
+    hashes: List[bytes],
+    view: "PoolView",
 ) -> Optional[Node]:
-    """
-    在 pool 上先做稳定排序，再按前缀哈希选槽位；若该槽负载明显高于全局最短路则回退到 JSQ。
-    """
-    if not pool:
+    """前缀索引中匹配块数最多、且负载不超过 min_load + margin 的副本；同块数取负载低者。"""
+    matched = prefix_index.longest_match(hashes, (n.node_id for n in pool))
+    if not matched:
         return None
-    if len(pool) == 1:
-        return pool[0]
+    limit = view.min_load + AFFINITY_LOAD_MARGIN
+    eligible = [n for n in pool if matched.get(n.node_id) and view.load(n) <= limit]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda n: (matched[n.node_id], -view.load(n)))
 
-    ordered = sorted(pool, key=lambda n: n.node_id)
-    key = openai_routing_key(body)
-    if not key:
-        return min(ordered, key=_node_load)
 
-    idx = _stable_bucket(key, len(ordered))
-    primary = ordered[idx]
-    loads = [_node_load(n) for n in ordered]
-    min_load = min(loads)
-    if _node_load(primary) <= min_load + AFFINITY_LOAD_MARGIN:
+def _affinity_or_jsq(view: "PoolView", key: str) -> Node:
+    primary = affinity_node(view.ordered, key)
+    if view.load(primary) <= view.min_load + AFFINITY_LOAD_MARGIN:
         return primary
-    best = min(ordered, key=_node_load)
+    best = view.least_loaded()
     if best.node_id != primary.node_id:
         logger.debug(
-            "routing jsq fallback primary=%s load=%s min_load=%s margin=%s -> %s",
+            "routing jsq fallback primary=%s load=%.2f min_load=%.2f margin=%s -> %s",
             primary.node_id,
-            _node_load(primary),
-            min_load,
+            view.load(primary),
+            view.min_load,
             AFFINITY_LOAD_MARGIN,
             best.node_id,
         )
     return best
+
+
+class PoolView:
+    """
+    一次选路的候选池视图：排序、路由文本与各副本负载按需计算并缓存，
+    策略只读取自己需要的部分（p2c 只算两个副本的负载）。
+    """
+
+    __slots__ = ("nodes", "body", "model", "_ordered", "_text", "_loads", "_min_load")
+
+    def __init__(
+        self,
+        nodes: Sequence[Node],
+        body: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None,
+    ):
+        self.nodes = list(nodes)
+        self.body = body
+        self.model = model or ""
+        self._ordered: Optional[List[Node]] = None
+        self._text: Optional[str] = None
+        self._loads: Dict[str, float] = {}
+        self._min_load: Optional[float] = None
+
+    @property
+    def ordered(self) -> List[Node]:
+        """按 node_id 排序，保证各网关在同一成员集合上的结果一致。"""
+        if self._ordered is None:
+            self._ordered = sorted(self.nodes, key=lambda n: n.node_id)
+        return self._ordered
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = _routing_text(self.body)
+        return self._text
+
+    @property
+    def key(self) -> str:
+        return self.text[:PREFIX_MAX_CHARS]
+
+    def load(self, n: Node) -> float:
+        score = self._loads.get(n.node_id)
+        if score is None:
+            score = load_score(n, len(self.text))
+            self._loads[n.node_id] = score
+        return score
+
+    @property
+    def min_load(self) -> float:
+        if self._min_load is None:
+            self._min_load = min(self.load(n) for n in self.nodes)
+        return self._min_load
+
+    def least_loaded(self) -> Node:
+        return min(self.ordered, key=self.load)
+
+
+class RoutingStrategy:
+    """选路策略接口：在非空 PoolView 上返回首选副本；其余候选由调用方按负载排序用于重试。"""
+
+    name: str = ""
+
+    def select(self, view: PoolView) -> Node:
+        raise NotImplementedError
+
+
+class RoundRobinStrategy(RoutingStrategy):
+    """按模型池轮询。"""
+
+    name = VllmStrategy.ROUND_ROBIN.value
+
+    def __init__(self):
+        self._counters: Dict[str, "itertools.count[int]"] = {}
+        self._lock = threading.Lock()
+
+    def select(self, view: PoolView) -> Node:
+        counter = self._counters.get(view.model)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(view.model, itertools.count())
+        ordered = view.ordered
+        return ordered[next(counter) % len(ordered)]
+
+
+class WeightedStrategy(RoutingStrategy):
+    """按 weight 平滑加权轮询（nginx smooth WRR），同一池内分配比例等于权重比。"""
+
+    name = VllmStrategy.WEIGHTED.value
+
+    def __init__(self):
+        self._current: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def select(self, view: PoolView) -> Node:
+        with self._lock:
+            prev = self._current.get(view.model, {})
+            current: Dict[str, int] = {}
+            total = 0
+            best: Optional[Node] = None
+            for n in view.ordered:
+                w = max(1, int(n.weight))
+                total += w
+                current[n.node_id] = prev.get(n.node_id, 0) + w
+                if best is None or current[n.node_id] > current[best.node_id]:
+                    best = n
+            current[best.node_id] -= total
+            self._current[view.model] = current
+        return best
+
+
+class LeastLoadStrategy(RoutingStrategy):
+    """综合负载分最低者（JSQ）。"""
+
+    name = VllmStrategy.LEAST_LOAD.value
+
+    def select(self, view: PoolView) -> Node:
+        return view.least_loaded()
+
+
+class MinimalStrategy(RoutingStrategy):
+    """最少连接：running + waiting 最少者，同值取综合负载分低者。"""
+
+    name = VllmStrategy.STREAM.value
+
+    def select(self, view: PoolView) -> Node:
+        return min(
+            view.ordered,
+            key=lambda n: (
+                int(n.node_info.running) + int(n.node_info.waiting),
+                view.load(n),
+            ),
+        )
+
+
+class RandomStrategy(RoutingStrategy):
+    """均匀随机。"""
+
+    name = VllmStrategy.RANDOM.value
+
+    def select(self, view: PoolView) -> Node:
+        return random.choice(view.nodes)
+
+
+class PowerOfTwoStrategy(RoutingStrategy):
+    """随机取两个副本，选负载较低者：只计算两个副本的负载，适合数百副本的大池。"""
+
+    name = VllmStrategy.POWER_OF_TWO.value
+
+    def select(self, view: PoolView) -> Node:
+        if len(view.nodes) <= 2:
+            return view.least_loaded()
+        a, b = random.sample(view.nodes, 2)
+        return a if view.load(a) <= view.load(b) else b
+
+
+class SimPromptStrategy(RoutingStrategy):
+    """
+    相似 prompt：路由文本的 MinHash 签名在 LSH 索引中找近似重复的邻居，派往服务过邻居、
+    且负载在 margin 内的副本（相似度高者优先）；无邻居或邻居副本过载时走默认前缀亲和 + JSQ。
+    """
+
+    name = VllmStrategy.SIM_PROMPT.value
+
+    def select(self, view: PoolView) -> Node:
+        key = view.key
+        if not key:
+            return view.least_loaded()
+        sig = signature(key)
+        chosen = _most_similar(view, sig) if sig is not None else None
+        if chosen is None:
+            chosen = _strategies[VllmStrategy.PREFIX_AFFINITY.value].select(view)
+        if sig is not None:
+            sim_index.record(sig, chosen.node_id)
+        return chosen
+
+
+def _most_similar(view: PoolView, sig) -> Optional[Node]:
+    matched = sim_index.nearest(sig, (n.node_id for n in view.nodes))
+    if not matched:
+        return None
+    limit = view.min_load + AFFINITY_LOAD_MARGIN
+    eligible = [n for n in view.ordered if n.node_id in matched and view.load(n) <= limit]
+    if not eligible:
+        logger.debug("sim_prompt neighbours overloaded %s, falling back", sorted(matched))
+        return None
+    return max(eligible, key=lambda n: (matched[n.node_id], -view.load(n)))
+
+
+class PrefixAffinityStrategy(RoutingStrategy):
+    """
+    1. 前缀索引：选已缓存最长块链前缀、且负载在 margin 内的副本；
+    2. 否则按前缀键在一致性哈希环上选亲和副本；
+    3. 若亲和副本综合负载明显高于全局最低则回退到 JSQ。
+    选中结果写回前缀索引，供后续共享前缀的请求命中。
+    """
+
+    name = VllmStrategy.PREFIX_AFFINITY.value
+
+    def select(self, view: PoolView) -> Node:
+        key = view.key
+        if not key:
+            return view.least_loaded()
+        hashes = block_hashes(view.text) if PREFIX_INDEX_ENABLED else []
+        chosen = _longest_cached_prefix(view.ordered, hashes, view) if hashes else None
+        if chosen is None:
+            chosen = _affinity_or_jsq(view, key)
+        if hashes:
+            prefix_index.record(hashes, chosen.node_id)
+        return chosen
+
+
+_strategies: Dict[str, RoutingStrategy] = {}
+
+
+def register_strategy(strategy: RoutingStrategy) -> None:
+    """注册（或替换）同名策略；扩展策略在导入时调用即可参与配置与基准对比。"""
+    _strategies[strategy.name] = strategy
+
+
+def get_strategy(name: str) -> Optional[RoutingStrategy]:
+    return _strategies.get((name or "").strip().lower())
+
+
+def strategy_names() -> List[str]:
+    return sorted(_strategies)
+
+
+for _cls in (
+    RoundRobinStrategy,
+    WeightedStrategy,
+    LeastLoadStrategy,
+    MinimalStrategy,
+    RandomStrategy,
+    PowerOfTwoStrategy,
+    SimPromptStrategy,
+    PrefixAffinityStrategy,
+):
+    register_strategy(_cls())
+
+
+def _load_pool_strategies(raw: str) -> Dict[str, str]:
+    if not raw.strip():
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        logger.warning("invalid NVLLM_POOL_STRATEGIES, ignored: %s", e)
+        return {}
+    if not isinstance(data, dict):
+        logger.warning("NVLLM_POOL_STRATEGIES must be a JSON object, ignored")
+        return {}
+    return {str(k).strip(): str(v) for k, v in data.items()}
+
+
+# 全局默认策略；按模型池覆盖：{"<served_model_name>": "<strategy>", "": "<通用池策略>"}
+ROUTING_STRATEGY = os.environ.get(
+    "NVLLM_ROUTING_STRATEGY", VllmStrategy.DEFAULT.value
+)
+POOL_STRATEGIES = _load_pool_strategies(os.environ.get("NVLLM_POOL_STRATEGIES", ""))
+# 是否允许客户端通过 X-Route-Strategy 按请求指定策略
+STRATEGY_HEADER_ENABLED = os.environ.get(
+    "NVLLM_ROUTING_STRATEGY_HEADER", "1"
+).lower() in ("1", "true", "yes")
+
+
+def resolve_strategy(
+    model: Optional[str],
+    headers: Optional[Mapping[str, str]] = None,
+) -> RoutingStrategy:
+    """请求头 X-Route-Strategy > 模型池配置 > 全局默认；未知名称忽略并继续向下查找。"""
+    names = []
+    if STRATEGY_HEADER_ENABLED and headers:
+        names.append(("header", headers.get("X-Route-Strategy")))
+    names.append(("pool", POOL_STRATEGIES.get((model or "").strip())))
+    names.append(("default", ROUTING_STRATEGY))
+    for source, name in names:
+        if not name:
+            continue
+        strategy = get_strategy(name)
+        if strategy is not None:
+            return strategy
+        # 请求头由客户端控制，降级为 debug 以免刷屏
+        log = logger.debug if source == "header" else logger.warning
+        log("unknown routing strategy %r from %s, ignored", name, source)
+    return _strategies[VllmStrategy.DEFAULT.value]
+
+
+def select_replica(
+    pool: List[Node],
+    body: Optional[Dict[str, Any]],
+    headers: Optional[Mapping[str, str]] = None,
+    model: Optional[str] = None,
+    strategy: Optional[RoutingStrategy] = None,
+) -> Optional[Node]:
+    """按解析出的策略在 pool 中选首选副本。"""
+    if not pool:
+        return None
+    if len(pool) == 1:
+        return pool[0]
+    if strategy is None:
+        strategy = resolve_strategy(model, headers)
+    return strategy.select(PoolView(pool, body, model))
+
+
+def select_replica_jsq_with_prefix_affinity(
+    pool: List[Node],
+    body: Optional[Dict[str, Any]],
+) -> Optional[Node]:
+    """默认策略（前缀索引 + 哈希环亲和 + JSQ 回退）的直接入口。"""
+    return select_replica(
+        pool, body, strategy=_strategies[VllmStrategy.PREFIX_AFFINITY.value]
+    )
+
+
+def benchmark_strategies(
+    pool: List[Node],
+    bodies: Sequence[Optional[Dict[str, Any]]],
+    names: Optional[Iterable[str]] = None,
+    concurrency: int = 4,
+) -> Dict[str, Dict[str, float]]:
+    """
+    在同一组请求上比较各策略：每次选择耗时（微秒）与分配均衡度（最多 / 平均）。
+    以「每副本约 concurrency 个在途请求」模拟负载反馈：选中即 running+1，最早的请求完成后 -1
+    （记录不可变，按目录的做法替换池中对应条目）。
+    只测选路本身，不含 Redis 与上游；前缀索引为进程内共享状态，结果含其命中效果。
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    for name in names or strategy_names():
+        strategy = get_strategy(name)
+        if strategy is None or not bodies:
+            continue
+        nodes = list(pool)
+        index: Dict[str, int] = {n.node_id: i for i, n in enumerate(nodes)}
+        counts: Dict[str, int] = {n.node_id: 0 for n in nodes}
+        outstanding: "deque[str]" = deque()
+        elapsed = 0.0
+
+        def _bump(node_id: str, delta: int) -> None:
+            i = index[node_id]
+            n = nodes[i]
+            nodes[i] = replace(
+                n, node_info=replace(n.node_info, running=n.node_info.running + delta)
+            )
+
+        for body in bodies:
+            start = time.perf_counter()
+            chosen = select_replica(nodes, body, strategy=strategy)
+            elapsed += time.perf_counter() - start
+            counts[chosen.node_id] += 1
+            _bump(chosen.node_id, 1)
+            outstanding.append(chosen.node_id)
+            if len(outstanding) > concurrency * len(nodes):
+                _bump(outstanding.popleft(), -1)
+        mean = len(bodies) / len(nodes)
+        results[name] = {
+            "us_per_select": elapsed / len(bodies) * 1e6,
+            "max_over_mean": max(counts.values()) / mean,
+            "replicas_used": sum(1 for c in counts.values() if c),
+        }
+    return results
+
+
+def _main() -> None:
+    rng = random.Random(7)
+    system_prompts = [f"system prompt {i} " * 200 for i in range(32)]
+    bodies = [
+        {
+            "messages": [
+                {"role": "system", "content": rng.choice(system_prompts)},
+                {"role": "user", "content": f"question {i}"},
+            ]
+        }
+        for i in range(5000)
+    ]
+    print(f"{'pool':>5} {'strategy':>16} {'us/select':>10} {'max/mean':>9} {'used':>5}")
+    for size in (8, 64, 512):
+        pool = [
+            Node(
+                node_id=f"node-{i:03d}",
+                weight=rng.choice((1, 1, 2)),
+                node_info=NodeInfo(
+                    running=rng.randint(0, 8),
+                    waiting=rng.randint(0, 4),
+                    kv_cache=rng.random(),
+                ),
+            )
+            for i in range(size)
+        ]
+        for name, r in benchmark_strategies(pool, bodies).items():
+            print(
+                f"{size:>5} {name:>16} {r['us_per_select']:>10.1f} "
+                f"{r['max_over_mean']:>9.2f} {r['replicas_used']:>5}"
+            )
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,211 @@
+"""
+相似 prompt 索引（SIM_PROMPT 策略）：对路由文本做字符 shingle + MinHash 签名，按 LSH 分桶找近似重复的请求，
+返回最近服务过这些「邻居」的副本（同一批 RAG 文档、few-shot 示例顺序不同等精确前缀无法命中的情况）。
+
+- 签名为单次哈希分箱 MinHash（one-permutation hashing，空箱轮转填充）：每个 shingle 只哈希一次，
+  8K 字符的 prompt 也只需一次线性扫描；
+- 签名切成 BANDS 段、每段 ROWS 个值，任一段完全相同即为候选，再以签名一致比例估计 Jaccard 相似度；
+- 条目数受 NVLLM_SIM_MAX_ENTRIES 约束按 LRU 淘汰，每个桶只保留最新的 NVLLM_SIM_BUCKET_SIZE 个条目，
+  超过 TTL 的条目不参与匹配。
+
+签名使用进程内 hash()，仅在本进程内比较；与 prefix_index 一样是近似视图，不作为正确性依据。
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+SHINGLE_CHARS = max(2, int(os.environ.get("NVLLM_SIM_SHINGLE_CHARS", "8")))
+BANDS = max(1, int(os.environ.get("NVLLM_SIM_BANDS", "16")))
+ROWS = max(1, int(os.environ.get("NVLLM_SIM_ROWS", "4")))
+NUM_HASHES = BANDS * ROWS
+SIM_THRESHOLD = float(os.environ.get("NVLLM_SIM_THRESHOLD", "0.5"))
+MAX_ENTRIES = max(1, int(os.environ.get("NVLLM_SIM_MAX_ENTRIES", "20000")))
+BUCKET_SIZE = max(1, int(os.environ.get("NVLLM_SIM_BUCKET_SIZE", "8")))
+ENTRY_TTL_SEC = float(os.environ.get("NVLLM_SIM_TTL_SEC", "600"))
+# 与已有条目相似度不低于该值且副本相同时只刷新时间，避免重复 prompt 占满索引
+DEDUPE_THRESHOLD = 0.9
+
+_MASK32 = 0xFFFFFFFF
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+_GOLDEN32 = 0x9E3779B1
+_WS = re.compile(r"\s+")
+
+
+def signature(text: str, num_hashes: int = NUM_HASHES) -> Optional[array]:
+    """文本的 MinHash 签名（num_hashes 个 uint32）；空文本返回 None。"""
+    text = _WS.sub(" ", text).strip().lower()
+    if not text:
+        return None
+    if len(text) <= SHINGLE_CHARS:
+        shingles = {text}
+    else:
+        shingles = {
+            text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)
+        }
+    bins: List[Optional[int]] = [None] * num_hashes
+    for s in shingles:
+        h = hash(s) & _MASK64
+        b = h % num_hashes
+        v = h >> 32
+        cur = bins[b]
+        if cur is None or v < cur:
+            bins[b] = v
+    sig = array("I", [0]) * num_hashes
+    for i in range(num_hashes):
+        v = bins[i]
+        if v is None:
+            # 轮转填充：取右侧最近非空箱的值并按距离偏移，避免两个短文本在空箱上偶然相同
+            for step in range(1, num_hashes):
+                src = bins[(i + step) % num_hashes]
+                if src is not None:
+                    v = (src + step * _GOLDEN32) & _MASK32
+                    break
+        sig[i] = v
+    return sig
+
+
+def similarity(a: array, b: array) -> float:
+    """签名一致比例，即 Jaccard 相似度的估计。"""
+    if len(a) != len(b) or not a:
+        return 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def _band_keys(sig: array) -> List[int]:
+    return [hash((i, sig[i * ROWS:(i + 1) * ROWS].tobytes())) for i in range(BANDS)]
+
+
+class _Entry:
+    __slots__ = ("sig", "node_id", "ts", "keys")
+
+    def __init__(self, sig: array, node_id: str, ts: float, keys: List[int]):
+        self.sig = sig
+        self.node_id = node_id
+        self.ts = ts
+        self.keys = keys
+
+
+class SimilarityIndex:
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        bucket_size: int = BUCKET_SIZE,
+        ttl_sec: float = ENTRY_TTL_SEC,
+        threshold: float = SIM_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.bucket_size = bucket_size
+        self.ttl_sec = ttl_sec
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[int, Deque[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _candidates(self, keys: List[int]) -> Iterable[int]:
+        seen = set()
+        for k in keys:
+            for eid in self._buckets.get(k, ()):
+                if eid not in seen:
+                    seen.add(eid)
+                    yield eid
+
+    def nearest(
+        self,
+        sig: array,
+        allowed: Optional[Iterable[str]] = None,
+    ) -> Dict[str, float]:
+        """返回 node_id -> 邻居中的最高相似度（仅含不低于阈值、且在 allowed 中的副本）。"""
+        allowed_set = set(allowed) if allowed is not None else None
+        keys = _band_keys(sig)
+        now = time.monotonic()
+        best: Dict[str, float] = {}
+        with self._lock:
+            self.lookups += 1
+            for eid in self._candidates(keys):
+                e = self._entries.get(eid)
+                if e is None or now - e.ts >= self.ttl_sec:
+                    continue
+                if allowed_set is not None and e.node_id not in allowed_set:
+                    continue
+                sim = similarity(sig, e.sig)
+                if sim >= self.threshold and sim > best.get(e.node_id, 0.0):
+                    best[e.node_id] = sim
+                    self._entries.move_to_end(eid)
+            if best:
+                self.hits += 1
+        return best
+
+    def record(self, sig: array, node_id: str) -> None:
+        """记录 node_id 服务过签名为 sig 的请求。"""
+        keys = _band_keys(sig)
+        now = time.monotonic()
+        with self._lock:
+            for eid in self._candidates(keys):
+                e = self._entries.get(eid)
+                if (
+                    e is not None
+                    and e.node_id == node_id
+                    and similarity(sig, e.sig) >= DEDUPE_THRESHOLD
+                ):
+                    e.ts = now
+                    self._entries.move_to_end(eid)
+                    return
+            eid = next(self._ids)
+            self._entries[eid] = _Entry(sig, node_id, now, keys)
+            for k in keys:
+                bucket = self._buckets.get(k)
+                if bucket is None:
+                    bucket = deque(maxlen=self.bucket_size)
+                    self._buckets[k] = bucket
+                bucket.append(eid)
+            while len(self._entries) > self.max_entries:
+                old_id, old = self._entries.popitem(last=False)
+                self._unlink(old_id, old)
+                self.evictions += 1
+
+    def _unlink(self, eid: int, e: _Entry) -> None:
+        for k in e.keys:
+            bucket = self._buckets.get(k)
+            if bucket is None:
+                continue
+            try:
+                bucket.remove(eid)
+            except ValueError:
+                pass
+            if not bucket:
+                del self._buckets[k]
+
+    def forget_node(self, node_id: str) -> None:
+        """副本下线时移除其全部条目。"""
+        with self._lock:
+            for eid in [i for i, e in self._entries.items() if e.node_id == node_id]:
+                self._unlink(eid, self._entries.pop(eid))
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "buckets": len(self._buckets),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_ratio": (self.hits / self.lookups) if self.lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+sim_index = SimilarityIndex()
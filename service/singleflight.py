@@ -0,0 +1,361 @@
+"""
+相同请求合并（single-flight）：非流式、temperature=0 的重复请求在途时只有第一个（leader）访问上游，
+其余等待并共享其结果，重复请求只消耗一次 GPU 生成。
+
+- 键 = 规范化请求体（同响应缓存）+ Authorization 摘要，不同调用方凭证不会共享结果；
+- 进程内：同步路径用 threading.Event，ASGI 数据面用 asyncio.Future；等待超过 NVLLM_SINGLEFLIGHT_WAIT_SEC
+  后各自转发；leader 抛出的异常同样传给等待者；
+- 跨网关（可选）：进程内 leader 再以 Redis `SET NX PX` 抢占全局锁；抢到的网关转发并把 2xx 结果写入
+  短 TTL 结果键后释放锁，其余网关轮询结果键，锁消失仍无结果时自行转发。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from middleware.redis_client import redis_cli
+from service import stats
+from service.response_cache import (
+    RawResponse,
+    _cache_control,
+    _is_deterministic,
+    cache_key,
+    caller_scope,
+)
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.environ.get("NVLLM_SINGLEFLIGHT", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+SINGLEFLIGHT_REDIS = os.environ.get("NVLLM_SINGLEFLIGHT_REDIS", "0").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+WAIT_SEC = float(os.environ.get("NVLLM_SINGLEFLIGHT_WAIT_SEC", "120"))
+LOCK_MS = int(float(os.environ.get("NVLLM_SINGLEFLIGHT_LOCK_SEC", "120")) * 1000)
+RESULT_TTL_MS = int(float(os.environ.get("NVLLM_SINGLEFLIGHT_RESULT_SEC", "5")) * 1000)
+POLL_SEC = max(0.005, float(os.environ.get("NVLLM_SINGLEFLIGHT_POLL_MS", "25")) / 1000)
+KEY_PREFIX = os.environ.get("NVLLM_SINGLEFLIGHT_PREFIX", "nvllm:sf:")
+
+COALESCED_HEADER = "X-NVLLM-Coalesced"
+
+# KEYS: lock  ARGV: token
+_UNLOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_metrics: Dict[str, int] = {
+    "leaders": 0,
+    "local_followers": 0,
+    "remote_followers": 0,
+    "wait_timeouts": 0,
+    "remote_fallbacks": 0,
+}
+_metrics_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def flight_key(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers: Mapping[str, str],
+) -> Optional[str]:
+    """可合并的请求返回合并键，否则 None。"""
+    if not SINGLEFLIGHT_ENABLED or not isinstance(body, dict):
+        return None
+    if body.get("stream") or not _is_deterministic(body):
+        return None
+    if headers.get("X-Target-Node-Id") or headers.get("X-Target-Node-ID"):
+        return None
+    if "no-store" in _cache_control(headers):
+        return None
+    try:
+        return cache_key(path, body, caller_scope(headers))
+    except (TypeError, ValueError):
+        return None
+
+
+def _shareable(result: Any) -> Optional[RawResponse]:
+    """把 leader 结果转成可多次返回的 RawResponse；流式等无法共享的结果返回 None。"""
+    if isinstance(result, RawResponse):
+        return result
+    if isinstance(result, tuple) and len(result) == 2:
+        data, status = result
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+        return RawResponse(body=body, status=int(status))
+    return None
+
+
+def mark_shared(result: Any) -> Any:
+    """等待者拿到的结果：附加 X-NVLLM-Coalesced 头（各自一份 headers）。"""
+    raw = _shareable(result)
+    if raw is None:
+        return result
+    return RawResponse(
+        body=raw.body,
+        status=raw.status,
+        headers={**raw.headers, COALESCED_HEADER: "1"},
+    )
+
+
+# ---------- 跨网关（Redis） ----------
+
+
+def _lock_key(key: str) -> str:
+    return f"{KEY_PREFIX}lock:{key}"
+
+
+def _result_key(key: str) -> str:
+    return f"{KEY_PREFIX}result:{key}"
+
+
+def _encode(raw: RawResponse) -> str:
+    return f"{raw.status}:" + raw.body.decode("utf-8")
+
+
+def _decode(value: Any) -> Optional[RawResponse]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    status, sep, body = value.partition(":")
+    if not sep or not status.isdigit():
+        return None
+    return RawResponse(body=body.encode("utf-8"), status=int(status))
+
+
+def _publishable(result: Any) -> Optional[str]:
+    raw = _shareable(result)
+    if raw is None or not 200 <= raw.status < 300:
+        return None
+    try:
+        return _encode(raw)
+    except UnicodeDecodeError:
+        return None
+
+
+_unlock_script = None
+
+
+def _unlock(key: str, token: str) -> None:
+    global _unlock_script
+    if _unlock_script is None:
+        _unlock_script = redis_cli.client.register_script(_UNLOCK_LUA)
+    _unlock_script(keys=[_lock_key(key)], args=[token])
+
+
+_async_unlock_script = None
+
+
+async def _aunlock(key: str, token: str) -> None:
+    global _async_unlock_script
+    if _async_unlock_script is None:
+        _async_unlock_script = redis_cli.async_client.register_script(_UNLOCK_LUA)
+    await _async_unlock_script(keys=[_lock_key(key)], args=[token])
+
+
+def _run_global(key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    token = uuid.uuid4().hex
+    try:
+        acquired = redis_cli.client.set(_lock_key(key), token, nx=True, px=LOCK_MS)
+    except Exception as e:
+        logger.warning("singleflight lock failed, forwarding locally: %s", e)
+        return fn(), False
+    if acquired:
+        result = None
+        try:
+            result = fn()
+            return result, False
+        finally:
+            try:
+                value = _publishable(result)
+                if value is not None:
+                    redis_cli.client.set(_result_key(key), value, px=RESULT_TTL_MS)
+                _unlock(key, token)
+            except Exception as e:
+                logger.warning("singleflight publish failed: %s", e)
+
+    deadline = time.monotonic() + WAIT_SEC
+    while time.monotonic() < deadline:
+        try:
+            value, lock = redis_cli.client.mget(_result_key(key), _lock_key(key))
+        except Exception as e:
+            logger.warning("singleflight poll failed, forwarding locally: %s", e)
+            break
+        raw = _decode(value)
+        if raw is not None:
+            _count("remote_followers")
+            return raw, True
+        if lock is None:
+            break
+        time.sleep(POLL_SEC)
+    _count("remote_fallbacks")
+    return fn(), False
+
+
+async def _arun_global(key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+    client = redis_cli.async_client
+    token = uuid.uuid4().hex
+    try:
+        acquired = await client.set(_lock_key(key), token, nx=True, px=LOCK_MS)
+    except Exception as e:
+        logger.warning("singleflight lock failed, forwarding locally: %s", e)
+        return await fn(), False
+    if acquired:
+        result = None
+        try:
+            result = await fn()
+            return result, False
+        finally:
+            try:
+                value = _publishable(result)
+                if value is not None:
+                    await client.set(_result_key(key), value, px=RESULT_TTL_MS)
+                await _aunlock(key, token)
+            except Exception as e:
+                logger.warning("singleflight publish failed: %s", e)
+
+    deadline = time.monotonic() + WAIT_SEC
+    while time.monotonic() < deadline:
+        try:
+            value, lock = await client.mget(_result_key(key), _lock_key(key))
+        except Exception as e:
+            logger.warning("singleflight poll failed, forwarding locally: %s", e)
+            break
+        raw = _decode(value)
+        if raw is not None:
+            _count("remote_followers")
+            return raw, True
+        if lock is None:
+            break
+        await asyncio.sleep(POLL_SEC)
+    _count("remote_fallbacks")
+    return await fn(), False
+
+
+# ---------- 进程内 ----------
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_calls: Dict[str, _Call] = {}
+_calls_lock = threading.Lock()
+
+
+def do(key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+    """
+    执行 fn 或等待同键的在途调用；返回 (结果, 是否共享自其它请求)。
+    共享结果需经 mark_shared 后返回给客户端。
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+    if not leader:
+        if call.event.wait(WAIT_SEC):
+            _count("local_followers")
+            if call.error is not None:
+                raise call.error
+            if _shareable(call.result) is not None:
+                return call.result, True
+        else:
+            _count("wait_timeouts")
+        return fn(), False
+
+    _count("leaders")
+    try:
+        if SINGLEFLIGHT_REDIS:
+            call.result, shared = _run_global(key, fn)
+        else:
+            call.result, shared = fn(), False
+        return call.result, shared
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.event.set()
+
+
+_futures: Dict[str, "asyncio.Future[Any]"] = {}
+
+
+async def ado(key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+    """do 的 asyncio 版本（同一事件循环内合并）。"""
+    fut = _futures.get(key)
+    if fut is not None:
+        try:
+            result = await asyncio.wait_for(asyncio.shield(fut), WAIT_SEC)
+        except asyncio.TimeoutError:
+            _count("wait_timeouts")
+            return await fn(), False
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                raise
+            # leader 被取消（其客户端断开），由本请求自行转发
+            return await fn(), False
+        _count("local_followers")
+        if _shareable(result) is not None:
+            return result, True
+        return await fn(), False
+
+    fut = asyncio.get_running_loop().create_future()
+    _futures[key] = fut
+    _count("leaders")
+    try:
+        if SINGLEFLIGHT_REDIS:
+            result, shared = await _arun_global(key, fn)
+        else:
+            result, shared = await fn(), False
+        fut.set_result(result)
+        return result, shared
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except BaseException as e:
+        fut.set_exception(e)
+        # 无等待者时避免 "exception was never retrieved"
+        fut.exception()
+        raise
+    finally:
+        _futures.pop(key, None)
+
+
+def get_stats() -> Dict[str, int]:
+    with _metrics_lock:
+        out = dict(_metrics)
+    out["in_flight"] = len(_calls) + len(_futures)
+    return out
+
+
+if SINGLEFLIGHT_ENABLED:
+    stats.register_provider("singleflight", get_stats)
@@ -0,0 +1,24 @@
+"""网关进程内指标汇总：各组件按名称注册 provider，控制面接口按需拉取（仅本进程视图）。"""
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_provider(name: str, fn: Callable[[], Dict[str, Any]]) -> None:
+    _providers[name] = fn
+
+
+def collect() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for name, fn in list(_providers.items()):
+        try:
+            out[name] = fn()
+        except Exception as e:
+            logger.warning("stats provider %s failed: %s", name, e)
+            out[name] = {"error": str(e)}
+    return out
@@ -0,0 +1,126 @@
+"""
+上游 vLLM 连接池：按 node_id 维护持久 requests.Session（HTTP keep-alive），
+稳态请求复用已建立的 TCP 连接，不再在 TTFT 关键路径上重复握手。
+
+- 每个副本一个 Session，连接池上限取节点 max_concurrency（未设置时为 NVLLM_UPSTREAM_POOL_SIZE）；
+- 副本被删除或地址/端口变化时（目录变更回调）立即关闭并移除；
+- 超过 NVLLM_UPSTREAM_POOL_IDLE_SEC 未使用的 Session 在取用时顺带回收。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from service import catalog, stats
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_POOL_SIZE = max(1, int(os.environ.get("NVLLM_UPSTREAM_POOL_SIZE", "32")))
+UPSTREAM_POOL_IDLE_SEC = float(os.environ.get("NVLLM_UPSTREAM_POOL_IDLE_SEC", "300"))
+
+
+class _PooledSession:
+    __slots__ = ("session", "endpoint", "last_used")
+
+    def __init__(self, endpoint: Tuple[str, int], pool_size: int):
+        self.endpoint = endpoint
+        self.last_used = time.monotonic()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+
+_sessions: Dict[str, _PooledSession] = {}
+_lock = threading.Lock()
+_last_reap = time.monotonic()
+_counters = {"hits": 0, "misses": 0, "evictions": 0, "reaped": 0}
+
+
+def _endpoint(node: Any) -> Tuple[str, int]:
+    return str(node.node_address), int(node.node_port)
+
+
+def _close(entry: _PooledSession) -> None:
+    try:
+        entry.session.close()
+    except Exception:
+        pass
+
+
+def session_for(node: Any) -> requests.Session:
+    """取该副本的持久 Session；地址变化时替换。"""
+    endpoint = _endpoint(node)
+    now = time.monotonic()
+    stale: Optional[_PooledSession] = None
+    with _lock:
+        entry = _sessions.get(node.node_id)
+        if entry is not None and entry.endpoint == endpoint:
+            _counters["hits"] += 1
+            entry.last_used = now
+            session = entry.session
+        else:
+            if entry is not None:
+                stale = entry
+                _counters["evictions"] += 1
+            _counters["misses"] += 1
+            pool_size = int(getattr(node, "max_concurrency", 0) or 0) or UPSTREAM_POOL_SIZE
+            entry = _PooledSession(endpoint, pool_size)
+            _sessions[node.node_id] = entry
+            session = entry.session
+    if stale is not None:
+        _close(stale)
+    if UPSTREAM_POOL_IDLE_SEC > 0 and now - _last_reap >= UPSTREAM_POOL_IDLE_SEC / 4:
+        reap_idle()
+    return session
+
+
+def evict(node_id: str) -> None:
+    with _lock:
+        entry = _sessions.pop(node_id, None)
+        if entry is not None:
+            _counters["evictions"] += 1
+    if entry is not None:
+        _close(entry)
+
+
+def reap_idle() -> int:
+    """关闭超过空闲阈值的 Session，返回回收数量。"""
+    global _last_reap
+    now = time.monotonic()
+    with _lock:
+        _last_reap = now
+        idle = [
+            node_id
+            for node_id, entry in _sessions.items()
+            if now - entry.last_used >= UPSTREAM_POOL_IDLE_SEC
+        ]
+        reaped = [_sessions.pop(node_id) for node_id in idle]
+        _counters["reaped"] += len(reaped)
+    for entry in reaped:
+        _close(entry)
+    return len(reaped)
+
+
+def pool_stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_counters)
+        out["sessions"] = len(_sessions)
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = (out["hits"] / lookups) if lookups else 0.0
+    return out
+
+
+def _on_catalog_change(old: Any, new: Optional[Any]) -> None:
+    if new is None or _endpoint(old) != _endpoint(new):
+        evict(old.node_id)
+
+
+catalog.add_listener(_on_catalog_change)
+stats.register_provider("upstream_pool", pool_stats)
@@ -1,12 +1,29 @@
+import itertools
 import logging
 import os
-from typing import Any, Dict, Optional, Tuple, Union
+import queue
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import requests
 from flask import Response, stream_with_context
 
+from service import (
+    admission,
+    breaker,
+    hedging,
+    inflight,
+    ratelimit,
+    response_cache,
+    singleflight,
+    upstream,
+)
+from service.errors import NoBackendError
 from service.health import invalidate_node
 from service.node import ordered_inference_candidates
+from service.routing import requested_openai_model
 
 logger = logging.getLogger(__name__)
 
@@ -16,19 +33,197 @@ UPSTREAM_MAX_TRIES = max(1, int(os.environ.get("NVLLM_UPSTREAM_MAX_TRIES", "3"))
 # 非流式响应中视为可换副本重试的 HTTP 状态
 _RETRY_UPSTREAM_STATUS = {500, 502, 503, 504}
 
+# vLLM 以 --api-key 启动时使用；设置后替换客户端 Authorization（如 /v1 鉴权用的网关 JWT）
+UPSTREAM_API_KEY = os.environ.get("NVLLM_UPSTREAM_API_KEY", "")
+
 
 def _base_url(node: Any) -> str:
     return f"http://{node.node_address}:{node.node_port}"
 
 
+def _forward_headers(headers) -> Dict[str, str]:
+    fwd_headers = {"Content-Type": "application/json"}
+    auth = f"Bearer {UPSTREAM_API_KEY}" if UPSTREAM_API_KEY else headers.get("Authorization")
+    if auth:
+        fwd_headers["Authorization"] = auth
+    return fwd_headers
+
+
+def _all_failed(last_err: str) -> Tuple[Dict[str, Any], int]:
+    return (
+        {
+            "error": "all upstream replicas failed",
+            "detail": last_err,
+        },
+        502,
+    )
+
+
+def _pick(remaining: List[Any]) -> Tuple[Any, Optional[inflight.Lease]]:
+    """
+    开启在途计数时由 Lua 脚本原子选择并占位，否则按候选顺序取首个；
+    选中 half-open 副本但试探名额已被占满时归还占位、换下一个候选，全部不可用抛 Saturated。
+    """
+    candidates = list(remaining)
+    while candidates:
+        lease = inflight.reserve(candidates) if inflight.INFLIGHT_ENABLED else None
+        node = lease.node if lease is not None else candidates[0]
+        if breaker.acquire(node):
+            return node, lease
+        inflight.release(lease)
+        candidates = [n for n in candidates if n is not node]
+    raise inflight.Saturated("half-open probe slots taken")
+
+
+def _raw_response(raw: response_cache.RawResponse) -> Response:
+    return Response(
+        raw.body,
+        status=raw.status,
+        mimetype="application/json",
+        headers=raw.headers,
+    )
+
+
+def _upstream_failed(node: Any, started: float) -> None:
+    """上游尝试失败：启用熔断器时由其决定摘除时长，否则按固定时长在 Redis 标记不健康。"""
+    if breaker.BREAKER_ENABLED:
+        breaker.record(node, started, ok=False)
+    else:
+        invalidate_node(node.node_id)
+
+
+def _saturated(last_err: str) -> NoBackendError:
+    return NoBackendError(
+        f"all candidate replicas at max_concurrency ({last_err})",
+        "ALL_SATURATED",
+    )
+
+
 def forward_openai(
     path: str,
     body: Optional[Dict[str, Any]],
     headers,
+    client: Optional[str] = None,
 ) -> Union[Response, Tuple[Any, int]]:
     """
     将 OpenAI 兼容请求转发到选中的 vLLM 节点；支持候选链路与运维级重试。
+    可缓存的确定性请求先查响应缓存，命中时不选路、不访问上游；
+    同一确定性请求并发到达时只有首个转发，其余共享其结果（single-flight）。
+    按租户限流在最前执行（client 为客户端地址，无凭据时按它限流）；token 用量只记入实际访问上游的请求。
+    """
+    subject = ratelimit.check(headers, client)
+    cache_plan = response_cache.plan(path, body, headers)
+    if cache_plan is not None:
+        hit = response_cache.lookup(cache_plan)
+        if hit is not None:
+            return _raw_response(hit)
+
+    key = singleflight.flight_key(path, body, headers)
+    if key is None:
+        result = _forward(path, body, headers, cache_plan)
+    else:
+        result, shared = singleflight.do(
+            key, lambda: _forward(path, body, headers, cache_plan)
+        )
+        if shared:
+            return _raw_response(singleflight.mark_shared(result))
+    if isinstance(result, Response):
+        meter = ratelimit.meter(subject, body)
+        if meter is not None:
+            result.response = _metered(result.response, meter)
+            result.call_on_close(meter.finish)
+        return result
+    ratelimit.charge_result(subject, result)
+    if isinstance(result, response_cache.RawResponse):
+        return _raw_response(result)
+    return result
+
+
+class _StreamBody:
+    """
+    非对冲流式响应体：按首个非空块的耗时记录熔断结果（vLLM 在首个 token 之前就返回响应头）；
+    close 关闭上游连接并归还在途占位，可重复调用（生成器 finally 与 call_on_close 都会调用）。
     """
+
+    def __init__(self, r: requests.Response, lease: Optional[inflight.Lease], node: Any, started: float):
+        self.r = r
+        self.lease = lease
+        self.node = node
+        self.started = started
+        self._pending = True
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _settle(self, ok: bool) -> None:
+        if self._pending:
+            self._pending = False
+            breaker.record(self.node, self.started, ok=ok)
+
+    def __iter__(self):
+        try:
+            for chunk in self.r.iter_content(chunk_size=None):
+                if chunk:
+                    self._settle(True)
+                    inflight.maybe_renew(self.lease)
+                    yield chunk
+            self._settle(True)
+        except requests.RequestException:
+            self._settle(False)
+            raise
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            pending, self._pending = self._pending, False
+        self.r.close()
+        if pending:
+            # 客户端在首块前断开：不计成败
+            breaker.abandon(self.node)
+        inflight.release(self.lease)
+
+
+def _metered(chunks, meter: ratelimit.StreamMeter):
+    try:
+        for chunk in chunks:
+            meter.observe(chunk)
+            yield chunk
+    finally:
+        # 客户端断开时关闭内层生成器，及时释放上游连接与在途占位
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def _forward(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    cache_plan: Optional[response_cache.CachePlan],
+) -> Union[Response, response_cache.RawResponse, Tuple[Any, int]]:
+    """经准入控制后转发；流式响应在连接关闭时归还名额。"""
+    ticket = admission.admit(body, headers)
+    try:
+        result = _send_upstream(path, body, headers, cache_plan)
+    except BaseException:
+        admission.release(ticket)
+        raise
+    if ticket is not None and isinstance(result, Response):
+        result.call_on_close(ticket.release)
+    else:
+        admission.release(ticket)
+    return result
+
+
+def _send_upstream(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    cache_plan: Optional[response_cache.CachePlan],
+) -> Union[Response, response_cache.RawResponse, Tuple[Any, int]]:
     target = headers.get("X-Target-Node-Id") or headers.get("X-Target-Node-ID")
     trace_id = headers.get("X-Trace-ID")
     candidates = ordered_inference_candidates(
@@ -39,19 +234,27 @@ def forward_openai(
     )
 
     stream = bool(body and body.get("stream"))
+    if stream and hedging.HEDGE_ENABLED:
+        return _stream_hedged(path, body, headers, candidates)
     max_tries = min(UPSTREAM_MAX_TRIES, len(candidates))
     last_err: str = "no attempt made"
 
-    for i, node in enumerate(candidates[:max_tries]):
+    remaining = list(candidates)
+    for _ in range(max_tries):
+        try:
+            node, lease = _pick(remaining)
+        except inflight.Saturated:
+            if last_err == "no attempt made":
+                raise _saturated(last_err)
+            break
+        remaining = [n for n in remaining if n is not node]
         url = f"{_base_url(node)}{path}"
         timeout = float(node.timeout or 60)
-        fwd_headers = {"Content-Type": "application/json"}
-        auth = headers.get("Authorization")
-        if auth:
-            fwd_headers["Authorization"] = auth
+        fwd_headers = _forward_headers(headers)
 
+        started = breaker.begin(node)
         try:
-            r = requests.post(
+            r = upstream.session_for(node).post(
                 url,
                 json=body,
                 headers=fwd_headers,
@@ -59,6 +262,7 @@ def forward_openai(
                 stream=stream,
             )
         except requests.RequestException as e:
+            inflight.release(lease)
             last_err = str(e)
             logger.warning(
                 "upstream unreachable node=%s url=%s err=%s",
@@ -66,32 +270,34 @@ def forward_openai(
                 url,
                 e,
             )
-            invalidate_node(node.node_id)
+            _upstream_failed(node, started)
             continue
 
         if stream:
             if r.status_code in _RETRY_UPSTREAM_STATUS:
                 r.close()
+                inflight.release(lease)
                 last_err = r.text or f"upstream status {r.status_code}"
                 logger.warning(
                     "upstream 5xx stream node=%s status=%s", node.node_id, r.status_code
                 )
-                invalidate_node(node.node_id)
+                _upstream_failed(node, started)
                 continue
 
-            def generate():
-                try:
-                    for chunk in r.iter_content(chunk_size=None):
-                        if chunk:
-                            yield chunk
-                finally:
-                    r.close()
-
-            return Response(
-                stream_with_context(generate()),
+            chunks = _StreamBody(r, lease, node, started)
+            resp = Response(
+                stream_with_context(iter(chunks)),
                 status=r.status_code,
                 mimetype=r.headers.get("Content-Type", "text/event-stream"),
             )
+            # 响应在首次迭代前就被关闭（客户端在响应头之后断开）时生成器的 finally 不会执行
+            resp.call_on_close(chunks.close)
+            return resp
+
+        # 非流式响应体已在 post 返回时读完
+        inflight.release(lease)
+        if r.status_code not in _RETRY_UPSTREAM_STATUS:
+            breaker.record(node, started, ok=True)
 
         if 400 <= r.status_code < 500:
             try:
@@ -107,19 +313,206 @@ def forward_openai(
             logger.warning(
                 "upstream 5xx node=%s status=%s", node.node_id, r.status_code
             )
-            invalidate_node(node.node_id)
+            _upstream_failed(node, started)
             continue
 
+        if cache_plan is not None and r.status_code == 200:
+            return response_cache.store(cache_plan, r.content)
+
         try:
             return r.json(), r.status_code
         except ValueError:
             text = r.text or "invalid upstream response"
             return {"error": text}, r.status_code
 
-    return (
-        {
-            "error": "all upstream replicas failed",
-            "detail": last_err,
-        },
-        502,
+    return _all_failed(last_err)
+
+
+# ---------- 流式对冲（TTFT 看门狗） ----------
+
+
+class _Attempt:
+    """对冲竞速中的一路流式请求：在独立线程中建立连接并读取首块。"""
+
+    def __init__(self, node: Any, lease: Optional[inflight.Lease], hedge: bool):
+        self.node = node
+        self.lease = lease
+        self.hedge = hedge
+        self.started = breaker.begin(node)
+        self.response: Optional[requests.Response] = None
+        self.chunks = None
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.done = False
+
+    def close(self) -> None:
+        if self.response is not None:
+            self.response.close()
+        inflight.release(self.lease)
+
+    def cancel(self) -> None:
+        """取消未胜出的一路：已完成则直接关闭，否则中断连接打断读取，由线程收尾。"""
+        with self.lock:
+            self.cancelled = True
+            done = self.done
+        if done:
+            self.close()
+        elif self.response is not None:
+            _abort(self.response)
+
+
+def _abort(r: requests.Response) -> None:
+    """
+    关闭正被其它线程阻塞读取的连接：response.close() 会等待读线程持有的缓冲区锁，
+    这里直接 shutdown 底层 socket，读线程随即以异常返回并自行收尾。
+    """
+    sock = getattr(getattr(r.raw, "connection", None), "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _open_stream(
+    att: _Attempt,
+    url: str,
+    body: Optional[Dict[str, Any]],
+    fwd_headers: Dict[str, str],
+    results: "queue.Queue[_Attempt]",
+) -> None:
+    try:
+        att.response = upstream.session_for(att.node).post(
+            url,
+            json=body,
+            headers=fwd_headers,
+            timeout=float(att.node.timeout or 60),
+            stream=True,
+        )
+        if att.response.status_code in _RETRY_UPSTREAM_STATUS:
+            att.error = att.response.text or f"upstream status {att.response.status_code}"
+        else:
+            chunks = (c for c in att.response.iter_content(chunk_size=None) if c)
+            first = next(chunks, b"")
+            att.chunks = itertools.chain((first,), chunks) if first else chunks
+    except Exception as e:
+        # 被取消时连接已关闭，读取会以各种异常结束
+        att.error = str(e) or type(e).__name__
+    with att.lock:
+        att.done = True
+        cancelled = att.cancelled
+    if cancelled or att.error is not None:
+        att.close()
+    if not cancelled:
+        results.put(att)
+
+
+def _stream_hedged(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    candidates: List[Any],
+) -> Union[Response, Tuple[Any, int]]:
+    """
+    带首字节看门狗的流式转发：时限内无首字节则（预算允许时）对下一个候选发出对冲请求，
+    先到首字节者胜出并继续转发，另一方关闭连接；连接失败或 5xx 时与普通路径一样换副本重试。
+    """
+    model = requested_openai_model(body, headers)
+    budget = hedging.ttft_budget(model)
+    fwd_headers = _forward_headers(headers)
+    max_tries = min(UPSTREAM_MAX_TRIES, len(candidates))
+    results: "queue.Queue[_Attempt]" = queue.Queue()
+    attempts: List[_Attempt] = []
+    remaining = list(candidates)
+
+    def launch(hedge: bool) -> bool:
+        nonlocal remaining
+        if len(attempts) >= max_tries or not remaining:
+            return False
+        try:
+            node, lease = _pick(remaining)
+        except inflight.Saturated:
+            if not attempts:
+                raise _saturated("no attempt made")
+            return False
+        remaining = [n for n in remaining if n is not node]
+        att = _Attempt(node, lease, hedge)
+        attempts.append(att)
+        threading.Thread(
+            target=_open_stream,
+            args=(att, f"{_base_url(node)}{path}", body, fwd_headers, results),
+            name="nvllm-stream-open",
+            daemon=True,
+        ).start()
+        return True
+
+    launch(hedge=False)
+    running = 1
+    deadline = time.monotonic() + budget
+    hedged = False
+    winner: Optional[_Attempt] = None
+    last_err = "no attempt made"
+    try:
+        while running:
+            timeout = None if hedged else max(0.0, deadline - time.monotonic())
+            try:
+                att = results.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                can_hedge = remaining and len(attempts) < max_tries
+                if can_hedge and hedging.try_hedge() and launch(hedge=True):
+                    logger.info(
+                        "ttft watchdog fired after %.0fms, hedging node=%s",
+                        budget * 1000,
+                        attempts[-1].node.node_id,
+                    )
+                    running += 1
+                continue
+            running -= 1
+            if att.error is None:
+                winner = att
+                break
+            last_err = att.error
+            logger.warning(
+                "upstream stream failed node=%s err=%s", att.node.node_id, att.error
+            )
+            _upstream_failed(att.node, att.started)
+            if running == 0 and launch(hedge=att.hedge):
+                running += 1
+                # 换副本重试是新的一路：重新启用首字节看门狗（否则卡在 prefill 时要等到 node.timeout）
+                deadline = time.monotonic() + budget
+                hedged = False
+    finally:
+        for att in attempts:
+            if att is not winner:
+                if att.error is None:
+                    breaker.abandon(att.node)
+                att.cancel()
+
+    if winner is None:
+        return _all_failed(last_err)
+    r = winner.response
+    breaker.record(winner.node, winner.started, ok=True)
+    if r.status_code == 200:
+        hedging.observe(model, time.monotonic() - winner.started)
+    if winner.hedge:
+        hedging.hedge_won()
+
+    def generate(att=winner):
+        try:
+            for chunk in att.chunks:
+                inflight.maybe_renew(att.lease)
+                yield chunk
+        finally:
+            att.close()
+
+    resp = Response(
+        stream_with_context(generate()),
+        status=r.status_code,
+        mimetype=r.headers.get("Content-Type", "text/event-stream"),
     )
+    # 同非对冲路径：响应在首次迭代前被关闭时由 call_on_close 收尾（close 可重复调用）
+    resp.call_on_close(winner.close)
+    return resp
@@ -0,0 +1,450 @@
+"""
+asyncio 版 OpenAI 转发（ASGI 数据面）：选路与重试语义与 service.vllm.forward_openai 一致，
+上游连接由共享的 httpx.AsyncClient 在事件循环上复用，长时间 SSE 流不再独占工作线程。
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+from service import (
+    admission,
+    breaker,
+    hedging,
+    inflight,
+    ratelimit,
+    response_cache,
+    singleflight,
+)
+from service.health import invalidate_node_async
+from service.node import ordered_inference_candidates
+from service.routing import requested_openai_model
+from service.vllm import (
+    UPSTREAM_MAX_TRIES,
+    _RETRY_UPSTREAM_STATUS,
+    _all_failed,
+    _base_url,
+    _forward_headers,
+    _saturated,
+)
+
+logger = logging.getLogger(__name__)
+
+# 事件循环内共享连接池上限
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("NVLLM_ASYNC_MAX_CONNECTIONS", "4096"))
+ASYNC_MAX_KEEPALIVE = int(os.environ.get("NVLLM_ASYNC_MAX_KEEPALIVE", "512"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    """进程退出（ASGI lifespan shutdown）时关闭共享连接。"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class UpstreamStream:
+    """已建立的上游流式响应；由 ASGI 层逐块转发并负责 aclose。"""
+
+    def __init__(
+        self,
+        response: httpx.Response,
+        lease: Optional[inflight.Lease] = None,
+        chunks: Optional[AsyncIterator[bytes]] = None,
+        node: Any = None,
+        started: Optional[float] = None,
+    ):
+        self.response = response
+        self.lease = lease
+        # 已读取首块（对冲竞速）时由调用方传入续读迭代器
+        self.chunks = chunks
+        # 待记录的熔断结果：vLLM 在首个 token 之前就返回响应头，按首个非空块的耗时记录
+        # （对冲路径在竞速时已记录，不传 node）
+        self._breaker = (node, started) if node is not None and started is not None else None
+        self.ticket: Optional[admission.Ticket] = None
+        self.meter: Optional[ratelimit.StreamMeter] = None
+        self.status_code = response.status_code
+        self.content_type = response.headers.get("Content-Type", "text/event-stream")
+
+    def _record(self, ok: bool) -> None:
+        pending, self._breaker = self._breaker, None
+        if pending is not None:
+            breaker.record(pending[0], pending[1], ok=ok)
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.chunks or self.response.aiter_raw():
+                if chunk:
+                    self._record(ok=True)
+                    await inflight.maybe_renew_async(self.lease)
+                    if self.meter is not None:
+                        self.meter.observe(chunk)
+                    yield chunk
+        except httpx.HTTPError:
+            self._record(ok=False)
+            raise
+        self._record(ok=True)
+
+    async def aclose(self) -> None:
+        if self._breaker is not None:
+            # 客户端在首块前断开：不计成败
+            breaker.abandon(self._breaker[0])
+            self._breaker = None
+        try:
+            await self.response.aclose()
+        finally:
+            if self.meter is not None:
+                self.meter.finish()
+            admission.release(self.ticket)
+            await inflight.release_async(self.lease)
+
+
+async def _upstream_failed(node: Any, started: float) -> None:
+    if breaker.BREAKER_ENABLED:
+        breaker.record(node, started, ok=False)
+    else:
+        await invalidate_node_async(node.node_id)
+
+
+async def _pick(remaining: List[Any]) -> Tuple[Any, Optional[inflight.Lease]]:
+    """同 service.vllm._pick。"""
+    candidates = list(remaining)
+    while candidates:
+        lease = (
+            await inflight.reserve_async(candidates)
+            if inflight.INFLIGHT_ENABLED
+            else None
+        )
+        node = lease.node if lease is not None else candidates[0]
+        if breaker.acquire(node):
+            return node, lease
+        await inflight.release_async(lease)
+        candidates = [n for n in candidates if n is not node]
+    raise inflight.Saturated("half-open probe slots taken")
+
+
+def _json_or_error(r: httpx.Response, default: str) -> Any:
+    try:
+        return r.json()
+    except ValueError:
+        return {"error": r.text or default}
+
+
+async def forward_openai_async(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    client: Optional[str] = None,
+) -> Union[UpstreamStream, response_cache.RawResponse, Tuple[Any, int]]:
+    """
+    将 OpenAI 兼容请求转发到选中的 vLLM 节点；候选链路、重试、响应缓存、请求合并与限流规则同 forward_openai。
+    选路在线程池中执行（目录快照变化时才会访问 Redis），避免阻塞事件循环。
+    """
+    subject = await ratelimit.acheck(headers, client)
+    cache_plan = response_cache.plan(path, body, headers)
+    if cache_plan is not None:
+        hit = await response_cache.alookup(cache_plan)
+        if hit is not None:
+            return hit
+
+    key = singleflight.flight_key(path, body, headers)
+    if key is None:
+        result = await _forward(path, body, headers, cache_plan)
+    else:
+        result, shared = await singleflight.ado(
+            key, lambda: _forward(path, body, headers, cache_plan)
+        )
+        if shared:
+            return singleflight.mark_shared(result)
+    if isinstance(result, UpstreamStream):
+        result.meter = ratelimit.meter(subject, body)
+    else:
+        ratelimit.charge_result(subject, result)
+    return result
+
+
+async def _forward(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    cache_plan: Optional[response_cache.CachePlan],
+) -> Union[UpstreamStream, response_cache.RawResponse, Tuple[Any, int]]:
+    """经准入控制后转发；流式响应由 UpstreamStream.aclose 归还名额。"""
+    ticket = await admission.aadmit(body, headers)
+    try:
+        result = await _send_upstream(path, body, headers, cache_plan)
+    except BaseException:
+        admission.release(ticket)
+        raise
+    if isinstance(result, UpstreamStream):
+        result.ticket = ticket
+    else:
+        admission.release(ticket)
+    return result
+
+
+async def _send_upstream(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    cache_plan: Optional[response_cache.CachePlan],
+) -> Union[UpstreamStream, response_cache.RawResponse, Tuple[Any, int]]:
+    target = headers.get("X-Target-Node-Id") or headers.get("X-Target-Node-ID")
+    trace_id = headers.get("X-Trace-ID")
+    loop = asyncio.get_running_loop()
+    candidates = await loop.run_in_executor(
+        None,
+        functools.partial(
+            ordered_inference_candidates,
+            target_node_id=target,
+            trace_id=trace_id,
+            body=body,
+            headers=headers,
+        ),
+    )
+
+    stream = bool(body and body.get("stream"))
+    if stream and hedging.HEDGE_ENABLED:
+        return await _stream_hedged(path, body, headers, candidates)
+    max_tries = min(UPSTREAM_MAX_TRIES, len(candidates))
+    last_err: str = "no attempt made"
+    client = _http_client()
+
+    remaining = list(candidates)
+    for _ in range(max_tries):
+        try:
+            node, lease = await _pick(remaining)
+        except inflight.Saturated:
+            if last_err == "no attempt made":
+                raise _saturated(last_err)
+            break
+        remaining = [n for n in remaining if n is not node]
+        url = f"{_base_url(node)}{path}"
+        timeout = float(node.timeout or 60)
+        request = client.build_request(
+            "POST",
+            url,
+            json=body,
+            headers=_forward_headers(headers),
+            timeout=timeout,
+        )
+        started = breaker.begin(node)
+        try:
+            r = await client.send(request, stream=stream)
+        except httpx.HTTPError as e:
+            await inflight.release_async(lease)
+            last_err = str(e) or type(e).__name__
+            logger.warning(
+                "upstream unreachable node=%s url=%s err=%s",
+                node.node_id,
+                url,
+                last_err,
+            )
+            await _upstream_failed(node, started)
+            continue
+
+        if stream:
+            if r.status_code in _RETRY_UPSTREAM_STATUS:
+                try:
+                    await r.aread()
+                    last_err = r.text or f"upstream status {r.status_code}"
+                except httpx.HTTPError:
+                    last_err = f"upstream status {r.status_code}"
+                finally:
+                    await r.aclose()
+                    await inflight.release_async(lease)
+                logger.warning(
+                    "upstream 5xx stream node=%s status=%s", node.node_id, r.status_code
+                )
+                await _upstream_failed(node, started)
+                continue
+            return UpstreamStream(r, lease, node=node, started=started)
+
+        await inflight.release_async(lease)
+        if r.status_code not in _RETRY_UPSTREAM_STATUS:
+            breaker.record(node, started, ok=True)
+
+        if 400 <= r.status_code < 500:
+            return _json_or_error(r, "upstream client error"), r.status_code
+
+        if r.status_code in _RETRY_UPSTREAM_STATUS:
+            try:
+                last_err = str(r.json())
+            except ValueError:
+                last_err = r.text or f"status {r.status_code}"
+            logger.warning(
+                "upstream 5xx node=%s status=%s", node.node_id, r.status_code
+            )
+            await _upstream_failed(node, started)
+            continue
+
+        if cache_plan is not None and r.status_code == 200:
+            return await response_cache.astore(cache_plan, r.content)
+
+        return _json_or_error(r, "invalid upstream response"), r.status_code
+
+    return _all_failed(last_err)
+
+
+# ---------- 流式对冲（TTFT 看门狗） ----------
+
+
+class _StreamFailed(Exception):
+    """上游流式请求返回可重试的 5xx。"""
+
+
+async def _prepend(first: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield first
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _open_stream(
+    node: Any,
+    lease: Optional[inflight.Lease],
+    url: str,
+    body: Optional[Dict[str, Any]],
+    fwd_headers: Dict[str, str],
+) -> UpstreamStream:
+    """建立连接并读到首个非空块；失败或被取消时自行关闭连接、归还占位。"""
+    client = _http_client()
+    r: Optional[httpx.Response] = None
+    try:
+        request = client.build_request(
+            "POST",
+            url,
+            json=body,
+            headers=fwd_headers,
+            timeout=float(node.timeout or 60),
+        )
+        r = await client.send(request, stream=True)
+        if r.status_code in _RETRY_UPSTREAM_STATUS:
+            await r.aread()
+            raise _StreamFailed(r.text or f"upstream status {r.status_code}")
+        chunks = r.aiter_raw()
+        async for first in chunks:
+            if first:
+                return UpstreamStream(r, lease, chunks=_prepend(first, chunks))
+        return UpstreamStream(r, lease, chunks=chunks)
+    except BaseException:
+        if r is not None:
+            await r.aclose()
+        await inflight.release_async(lease)
+        raise
+
+
+async def _stream_hedged(
+    path: str,
+    body: Optional[Dict[str, Any]],
+    headers,
+    candidates: List[Any],
+) -> Union[UpstreamStream, Tuple[Any, int]]:
+    """同 service.vllm._stream_hedged：各路为独立 Task，未胜出者直接取消。"""
+    model = requested_openai_model(body, headers)
+    budget = hedging.ttft_budget(model)
+    fwd_headers = _forward_headers(headers)
+    max_tries = min(UPSTREAM_MAX_TRIES, len(candidates))
+    # Task -> (node, 是否对冲, 发出时间)
+    attempts: Dict["asyncio.Task[UpstreamStream]", Tuple[Any, bool, float]] = {}
+    remaining = list(candidates)
+
+    async def launch(hedge: bool) -> bool:
+        nonlocal remaining
+        if len(attempts) >= max_tries or not remaining:
+            return False
+        try:
+            node, lease = await _pick(remaining)
+        except inflight.Saturated:
+            if not attempts:
+                raise _saturated("no attempt made")
+            return False
+        remaining = [n for n in remaining if n is not node]
+        task = asyncio.ensure_future(
+            _open_stream(node, lease, f"{_base_url(node)}{path}", body, fwd_headers)
+        )
+        attempts[task] = (node, hedge, breaker.begin(node))
+        return True
+
+    await launch(hedge=False)
+    pending = set(attempts)
+    deadline = time.monotonic() + budget
+    hedged = False
+    winner: Optional["asyncio.Task[UpstreamStream]"] = None
+    last_err = "no attempt made"
+    try:
+        while pending and winner is None:
+            timeout = None if hedged else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                hedged = True
+                can_hedge = remaining and len(attempts) < max_tries
+                if can_hedge and hedging.try_hedge() and await launch(hedge=True):
+                    task = list(attempts)[-1]
+                    logger.info(
+                        "ttft watchdog fired after %.0fms, hedging node=%s",
+                        budget * 1000,
+                        attempts[task][0].node_id,
+                    )
+                    pending.add(task)
+                continue
+            for task in done:
+                err = task.exception()
+                if err is None:
+                    winner = winner or task
+                    continue
+                if not isinstance(err, (httpx.HTTPError, _StreamFailed)):
+                    raise err
+                node, hedge, started = attempts[task]
+                last_err = str(err) or type(err).__name__
+                logger.warning(
+                    "upstream stream failed node=%s err=%s", node.node_id, last_err
+                )
+                await _upstream_failed(node, started)
+                if winner is None and not pending and await launch(hedge=hedge):
+                    pending.add(list(attempts)[-1])
+                    # 换副本重试是新的一路：重新启用首字节看门狗
+                    deadline = time.monotonic() + budget
+                    hedged = False
+    finally:
+        for task in attempts:
+            if task is winner:
+                continue
+            if not task.done():
+                breaker.abandon(attempts[task][0])
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                breaker.abandon(attempts[task][0])
+                await task.result().aclose()
+
+    if winner is None:
+        return _all_failed(last_err)
+    result = winner.result()
+    node, hedge, started = attempts[winner]
+    breaker.record(node, started, ok=True)
+    if result.status_code == 200:
+        hedging.observe(model, time.monotonic() - started)
+    if hedge:
+        hedging.hedge_won()
+    return result